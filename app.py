@@ -1,56 +1,85 @@
 import os
 import logging
-import logging.handlers
 import datetime
+import hashlib
+import hmac
+import ipaddress
+import json
+import random
 import secrets
+import sys
+import threading
+import time
 
+# Start of the startup profile (see create_app)
+_IMPORT_STARTED = time.perf_counter()
+
+import click
 from flask import (
     Flask, render_template, redirect, url_for, request, 
-    session, abort, jsonify, send_from_directory
+    session, abort, jsonify, send_from_directory, make_response,
+    before_render_template, template_rendered, has_request_context, stream_template, stream_with_context
 )
+from jinja2.utils import Namespace
+from markupsafe import Markup
 from dotenv import load_dotenv
-from flask_wtf.csrf import CSRFProtect
-import requests
-import bleach
+from flask_wtf.csrf import CSRFProtect, generate_csrf
+
+import metrics
+
+startup_profile = metrics.StartupProfile(started=_IMPORT_STARTED)
+startup_profile.mark('import framework')
+
+import jobs
+import sessions
+import tokens
+from pagination import (
+    SpotifyPageError, check_in_batches, fetch_spotify_items_with_pagination, iter_all_items, put_in_batches
+)
+import resilience
+from cache import SharedPlaylistCache, TTLCache
+from fanout import FanOut
+from library_index import LibraryVersions, SavedLibraryIndex
+from log_pipeline import LogPipeline
+from models import (
+    PLAYLIST_FIELDS, PLAYLIST_PAGE_FIELDS, SEARCH_INDEX_FIELDS, Playlist, SavedAlbum, as_dict,
+    parse_playlist, parse_playlists, parse_saved_albums, parse_track_page
+)
+from prefetch import Prefetcher
+from ratelimit import RateLimitScheduler
+from sanitize import DescriptionSanitizer
+from search_index import FIELDS as SEARCH_FIELDS, PlaylistIndexCache
+from spotify_client import SpotifyClient, SpotifyUnavailable
+
+startup_profile.mark('import app modules')
+
+# Load environment variables
+load_dotenv()
+
+# Spotify API base URLs (overridable to point at a local fake for benchmarks)
+SPOTIFY_ACCOUNTS_URL = os.getenv('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
+SPOTIFY_API_URL = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
 
 # Spotify API URLs
 SPOTIFY_API = {
     'auth': {
-        'authorize': 'https://accounts.spotify.com/authorize',
-        'token': 'https://accounts.spotify.com/api/token'
+        'authorize': f'{SPOTIFY_ACCOUNTS_URL}/authorize',
+        'token': f'{SPOTIFY_ACCOUNTS_URL}/api/token'
     },
     'user': {
-        'profile': 'https://api.spotify.com/v1/me',
-        'playlists': 'https://api.spotify.com/v1/me/playlists',
-        'albums': 'https://api.spotify.com/v1/me/albums',
-        'tracks': 'https://api.spotify.com/v1/me/tracks',
-        'check_saved_albums': 'https://api.spotify.com/v1/me/albums/contains'
+        'profile': f'{SPOTIFY_API_URL}/me',
+        'playlists': f'{SPOTIFY_API_URL}/me/playlists',
+        'albums': f'{SPOTIFY_API_URL}/me/albums',
+        'tracks': f'{SPOTIFY_API_URL}/me/tracks',
+        'check_saved_albums': f'{SPOTIFY_API_URL}/me/albums/contains',
+        'check_saved_tracks': f'{SPOTIFY_API_URL}/me/tracks/contains'
     },
     'playlists': {
-        'get': 'https://api.spotify.com/v1/playlists/{playlist_id}',
-        'tracks': 'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
+        'get': f'{SPOTIFY_API_URL}/playlists/{{playlist_id}}',
+        'tracks': f'{SPOTIFY_API_URL}/playlists/{{playlist_id}}/tracks'
     }
 }
 
-def fetch_spotify_items_with_pagination(endpoint, token, offset=0, limit=20, item_key="items"):
-    """
-    Utility to fetch paginated data from Spotify API.
-    Returns: items, total, next_offset, prev_offset
-    """
-    headers = {'Authorization': f"Bearer {token}"}
-    resp = requests.get(f"{endpoint}?limit={limit}&offset={offset}", headers=headers)
-    if resp.status_code != 200:
-        return [], 0, None, None
-    data = resp.json()
-    items = data.get(item_key, [])
-    total = data.get('total', 0)
-    next_offset = offset + limit if offset + limit < total else None
-    prev_offset = offset - limit if offset - limit >= 0 else (0 if offset > 0 else None)
-    return items, total, next_offset, prev_offset
-
-# Load environment variables
-load_dotenv()
-
 # Application configuration
 class Config:
     """Application configuration from environment variables with defaults."""
@@ -71,8 +100,100 @@ class Config:
     LOG_FILE = os.path.join(LOG_DIR, 'spotiplay.log')
     LOG_MAX_BYTES = 10 * 1024 * 1024  # 10MB
     LOG_BACKUP_COUNT = 5
+    # Records waiting for the background log thread; more than this are dropped
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    # Fraction of requests that get a structured access record (errors and
+    # requests slower than ACCESS_LOG_SLOW_MS are always recorded)
+    ACCESS_LOG_SAMPLE_RATE = float(os.getenv('ACCESS_LOG_SAMPLE_RATE', 0.1))
+    ACCESS_LOG_SLOW_MS = float(os.getenv('ACCESS_LOG_SLOW_MS', 1000))
+    
+    # Spotify HTTP client settings
+    SPOTIFY_POOL_SIZE = int(os.getenv('SPOTIFY_POOL_SIZE', 10))
+    SPOTIFY_FANOUT_WORKERS = int(os.getenv('SPOTIFY_FANOUT_WORKERS', 4))
+    SPOTIFY_REQUEST_DEADLINE = float(os.getenv('SPOTIFY_REQUEST_DEADLINE', 10))
+    SPOTIFY_PAGINATION_WORKERS = int(os.getenv('SPOTIFY_PAGINATION_WORKERS', 4))
+    
+    # Upstream timeouts and failure handling. Every request gets a budget of
+    # SPOTIFY_REQUEST_DEADLINE seconds for its Spotify calls; each call is
+    # capped at SPOTIFY_TIMEOUT. SPOTIFY_HEDGE_AFTER > 0 re-sends slow GETs.
+    SPOTIFY_TIMEOUT = float(os.getenv('SPOTIFY_TIMEOUT', 10))
+    SPOTIFY_HEDGE_AFTER = float(os.getenv('SPOTIFY_HEDGE_AFTER', 0))
+    SPOTIFY_BREAKER_FAILURES = int(os.getenv('SPOTIFY_BREAKER_FAILURES', 5))
+    SPOTIFY_BREAKER_RESET = float(os.getenv('SPOTIFY_BREAKER_RESET', 30))
+    
+    # Rate limiting, shared by all workers (requests/second; 0 disables)
+    SPOTIFY_RATE_LIMIT = float(os.getenv('SPOTIFY_RATE_LIMIT', 20))
+    SPOTIFY_RATE_BURST = int(os.getenv('SPOTIFY_RATE_BURST', 40))
+    # Tokens each worker takes from the shared bucket per write
+    SPOTIFY_RATE_LEASE = int(os.getenv('SPOTIFY_RATE_LEASE', 4))
+    SPOTIFY_MAX_CONCURRENCY = int(os.getenv('SPOTIFY_MAX_CONCURRENCY', 8))
+    SPOTIFY_MAX_RETRIES = int(os.getenv('SPOTIFY_MAX_RETRIES', 3))
+    
+    # Opt-in async views backed by a shared async HTTP client
+    # (needs requirements/async.txt)
+    ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'false').lower() == 'true'
+    
+    # Saved-library index settings
+    LIBRARY_INDEX_TTL = int(os.getenv('LIBRARY_INDEX_TTL', 300))
+    LIBRARY_INDEX_MAX_MB = int(os.getenv('LIBRARY_INDEX_MAX_MB', 32))
+    
+    # Playlist metadata and track pages shared across users (seconds/entries)
+    SHARED_CACHE_TTL = int(os.getenv('SHARED_CACHE_TTL', 300))
+    SHARED_CACHE_META_TTL = int(os.getenv('SHARED_CACHE_META_TTL', 30))
+    SHARED_CACHE_MAX_ENTRIES = int(os.getenv('SHARED_CACHE_MAX_ENTRIES', 512))
+    
+    # Rendered track-list fragments
+    FRAGMENT_CACHE_TTL = int(os.getenv('FRAGMENT_CACHE_TTL', 300))
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.getenv('FRAGMENT_CACHE_MAX_ENTRIES', 1024))
+    
+    # In-playlist search indexes (seconds/playlists held)
+    SEARCH_INDEX_TTL = int(os.getenv('SEARCH_INDEX_TTL', 600))
+    SEARCH_INDEX_MAX_ENTRIES = int(os.getenv('SEARCH_INDEX_MAX_ENTRIES', 32))
+    SEARCH_INDEX_WORKERS = int(os.getenv('SEARCH_INDEX_WORKERS', 2))
+    
+    # Sanitized playlist descriptions held in memory
+    DESCRIPTION_CACHE_MAX_ENTRIES = int(os.getenv('DESCRIPTION_CACHE_MAX_ENTRIES', 2048))
+    
+    # Each user's profile, playlists and saved-album pages for the dashboard
+    DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', 300))
+    
+    # Background warming of the next tracks page
+    PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'true').lower() == 'true'
+    PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 2))
+    PREFETCH_PER_USER = int(os.getenv('PREFETCH_PER_USER', 1))
+    
+    # Seconds between each worker's writes of its metrics to the shared store
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+    # Who may scrape /metrics: direct (un-proxied) requests from these
+    # networks, or any request bearing METRICS_TOKEN. Under Docker, host
+    # scrapes arrive from the bridge gateway, so deploy.sh adds its range.
+    METRICS_ALLOWED_NETWORKS = os.getenv('METRICS_ALLOWED_NETWORKS', '127.0.0.1/32,::1/128')
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    
+    # Shared state (job progress etc.) lives in SQLite files under DATA_DIR
+    DATA_DIR = os.getenv('DATA_DIR', 'data')
     
-    # Session settings
+    # Background job settings
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+    JOB_SYNC_WAIT = float(os.getenv('JOB_SYNC_WAIT', 0.5))
+    
+    # Refresh access tokens this many seconds before they expire
+    TOKEN_REFRESH_MARGIN = int(os.getenv('TOKEN_REFRESH_MARGIN', 300))
+    
+    # A streamed "show all" response stops adding pages after this many
+    # seconds (keep it under gunicorn's worker timeout) and ends with a
+    # button that streams the rest
+    STREAM_MAX_SECONDS = float(os.getenv('STREAM_MAX_SECONDS', 20))
+    
+    # Most IDs one bulk save request may post
+    BULK_SAVE_MAX_IDS = int(os.getenv('BULK_SAVE_MAX_IDS', 500))
+    
+    # Session settings. 'sqlite' keeps session data server-side under
+    # DATA_DIR with only an ID in the cookie; 'cookie' uses Flask's signed
+    # cookie sessions.
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite').lower()
+    # Unchanged sessions get their expiry extended at most this often
+    SESSION_TOUCH_INTERVAL = int(os.getenv('SESSION_TOUCH_INTERVAL', 300))
     SESSION_COOKIE_SECURE = not DEBUG
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
@@ -90,40 +211,359 @@ class Config:
         if missing:
             raise RuntimeError(f"Missing required configuration: {', '.join(missing)}")
 
-# Validate configuration
+# At import, so every entry point (create_app(), `flask --app app`, a bare
+# `app:app`) fails loudly without credentials
 Config.validate()
+startup_profile.mark('config')
 
 # Set up the Flask application
 app = Flask(__name__)
 app.config.from_object(Config)
 app.secret_key = Config.SECRET_KEY
 
+# Server-side sessions, and per-user values shared by every worker
+session_store = sessions.SessionStore(os.path.join(Config.DATA_DIR, 'sessions.db'))
+if Config.SESSION_BACKEND == 'sqlite':
+    app.session_interface = sessions.SQLiteSessionInterface(session_store, touch_interval=Config.SESSION_TOUCH_INTERVAL)
+
 # Initialize extensions
 csrf = CSRFProtect(app)
 
-# Set up handlers for logging
-handlers = [logging.StreamHandler()]
+# Log records are queued and written by a background thread; one process
+# per host owns the rotating log file. Started by create_app().
+log_pipeline = None
+access_logger = logging.getLogger('spotiplay.access')
+logger = logging.getLogger(__name__)
+
+# One pooled Spotify client per worker process. Gunicorn forks workers after
+# import, so clients are created lazily and rebuilt if the pid changes.
+_spotify_client = None
+_spotify_client_pid = None
+_async_spotify_client = None
+_async_spotify_client_pid = None
+# Threaded/green workers can ask for a client concurrently; only one gets built
+_spotify_client_lock = threading.Lock()
 
-# Always use file logging
-if not os.path.exists(Config.LOG_DIR):
-    os.makedirs(Config.LOG_DIR, exist_ok=True)
-    
-handlers.append(
-    logging.handlers.RotatingFileHandler(
-        Config.LOG_FILE, 
-        maxBytes=Config.LOG_MAX_BYTES, 
-        backupCount=Config.LOG_BACKUP_COUNT
+# Latency histograms, aggregated across workers for /metrics
+metrics_registry = metrics.MetricsRegistry(
+    os.path.join(Config.DATA_DIR, 'metrics.db'),
+    flush_interval=Config.METRICS_FLUSH_INTERVAL
+)
+metrics_registry.describe('spotiplay_request_duration_seconds', 'histogram', 'Time to handle a request, by view.')
+metrics_registry.describe('spotiplay_render_duration_seconds', 'histogram', 'Template rendering time per request, by view.')
+metrics_registry.describe('spotiplay_upstream_duration_seconds', 'histogram', 'Spotify API call latency, by SPOTIFY_API endpoint.')
+metrics_registry.describe('spotiplay_upstream_response_bytes_total', 'counter', 'Bytes received from the Spotify API, by endpoint.')
+metrics_registry.describe('spotiplay_log_dropped_total', 'counter', 'Log records dropped because the log queue or writer was full.')
+
+def _observe_spotify_call(endpoint, method, status, elapsed, nbytes):
+    metrics.record_upstream(endpoint, status, elapsed, nbytes)
+    status_class = f'{status // 100}xx' if status else 'error'
+    metrics_registry.observe('spotiplay_upstream_duration_seconds', elapsed, endpoint=endpoint, status=status_class)
+    metrics_registry.increment('spotiplay_upstream_response_bytes_total', nbytes, endpoint=endpoint)
+
+# Per-process circuit breaker shared by the sync and async clients, keyed by
+# SPOTIFY_API endpoint
+spotify_breaker = resilience.CircuitBreaker(
+    failure_threshold=Config.SPOTIFY_BREAKER_FAILURES,
+    reset_timeout=Config.SPOTIFY_BREAKER_RESET
+)
+
+def _rate_limiter():
+    """Shared rate-limit scheduler for this app's Spotify client ID, if enabled."""
+    if Config.SPOTIFY_RATE_LIMIT <= 0:
+        return None
+    return RateLimitScheduler(
+        os.path.join(Config.DATA_DIR, 'ratelimit.db'),
+        Config.SPOTIFY_CLIENT_ID,
+        rate=Config.SPOTIFY_RATE_LIMIT,
+        burst=Config.SPOTIFY_RATE_BURST,
+        max_concurrency=Config.SPOTIFY_MAX_CONCURRENCY,
+        lease=Config.SPOTIFY_RATE_LEASE
     )
+
+def get_spotify_client():
+    """Return this worker process's pooled Spotify client."""
+    global _spotify_client, _spotify_client_pid
+    if _spotify_client is not None and _spotify_client_pid == os.getpid():
+        return _spotify_client
+    with _spotify_client_lock:
+        if _spotify_client is None or _spotify_client_pid != os.getpid():
+            _spotify_client = SpotifyClient(
+                SPOTIFY_API,
+                pool_size=Config.SPOTIFY_POOL_SIZE,
+                scheduler=_rate_limiter(),
+                max_retries=Config.SPOTIFY_MAX_RETRIES,
+                timeout=Config.SPOTIFY_TIMEOUT,
+                breaker=spotify_breaker,
+                hedge_after=Config.SPOTIFY_HEDGE_AFTER or None,
+                on_call=_observe_spotify_call,
+                token_refresher=_refresh_stale_token
+            )
+            _spotify_client_pid = os.getpid()
+        return _spotify_client
+
+def get_async_spotify_client():
+    """Return this worker process's async Spotify client (ASYNC_VIEWS mode)."""
+    global _async_spotify_client, _async_spotify_client_pid
+    if _async_spotify_client is not None and _async_spotify_client_pid == os.getpid():
+        return _async_spotify_client
+    with _spotify_client_lock:
+        if _async_spotify_client is None or _async_spotify_client_pid != os.getpid():
+            from spotify_async import AsyncSpotifyClient
+            _async_spotify_client = AsyncSpotifyClient(
+                SPOTIFY_API,
+                pool_size=Config.SPOTIFY_POOL_SIZE,
+                scheduler=_rate_limiter(),
+                max_retries=Config.SPOTIFY_MAX_RETRIES,
+                timeout=Config.SPOTIFY_TIMEOUT,
+                breaker=spotify_breaker,
+                on_call=_observe_spotify_call,
+                token_refresher=_refresh_stale_token
+            )
+            _async_spotify_client_pid = os.getpid()
+        return _async_spotify_client
+
+# Each login's refresh token and expiry, shared by all workers
+token_manager = tokens.TokenManager(
+    tokens.TokenStore(os.path.join(Config.DATA_DIR, 'tokens.db')),
+    get_spotify_client,
+    Config.SPOTIFY_CLIENT_ID,
+    Config.SPOTIFY_CLIENT_SECRET,
+    refresh_margin=Config.TOKEN_REFRESH_MARGIN
 )
 
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, Config.LOG_LEVEL),
-    format=Config.LOG_FORMAT,
-    handlers=handlers
+def _refresh_stale_token(token):
+    """Client hook for 401s: the token's replacement, also stored in the session if it's this user's."""
+    new_token = token_manager.refresh_stale(token)
+    if new_token and has_request_context() and session.get('spotify_token') == token:
+        session['spotify_token'] = new_token
+    return new_token
+
+# Which tracks/albums each user has saved, so playlist pages only call the
+# `contains` endpoints for IDs we haven't seen recently. Saves bump a
+# version shared by all workers, so no worker keeps serving the old state.
+library_index = SavedLibraryIndex(
+    ttl=Config.LIBRARY_INDEX_TTL,
+    max_bytes=Config.LIBRARY_INDEX_MAX_MB * 1024 * 1024,
+    versions=LibraryVersions(os.path.join(Config.DATA_DIR, 'library.db'))
 )
-logger = logging.getLogger(__name__)
-logger.info("Application starting with configuration: DEBUG=%s", Config.DEBUG)
+
+# Playlist metadata and track pages, shared by users of this worker process
+playlist_cache = SharedPlaylistCache(
+    ttl=Config.SHARED_CACHE_TTL,
+    meta_ttl=Config.SHARED_CACHE_META_TTL,
+    max_entries=Config.SHARED_CACHE_MAX_ENTRIES
+)
+
+# Rendered track lists. They are cached with a placeholder in place of the
+# CSRF token, which is filled in per request.
+fragment_cache = TTLCache(ttl=Config.FRAGMENT_CACHE_TTL, max_entries=Config.FRAGMENT_CACHE_MAX_ENTRIES)
+CSRF_PLACEHOLDER = f'csrf-{secrets.token_hex(16)}'
+
+# Prefix indexes for searching within playlists, one per playlist snapshot
+search_indexes = PlaylistIndexCache(
+    ttl=Config.SEARCH_INDEX_TTL, max_entries=Config.SEARCH_INDEX_MAX_ENTRIES, max_workers=Config.SEARCH_INDEX_WORKERS
+)
+
+# Safe HTML for playlist descriptions, cached by content
+description_sanitizer = DescriptionSanitizer(max_entries=Config.DESCRIPTION_CACHE_MAX_ENTRIES)
+
+def _spotify_throttled():
+    scheduler = get_spotify_client().scheduler
+    return scheduler is not None and scheduler.is_throttled()
+
+# Warms the next tracks page after a playlist page has been sent
+prefetcher = Prefetcher(
+    max_workers=Config.PREFETCH_WORKERS,
+    per_user=Config.PREFETCH_PER_USER,
+    paused=_spotify_throttled
+)
+
+# "Add playlist to library" runs as a background job with shared progress
+job_manager = jobs.JobManager(
+    jobs.JobStore(os.path.join(Config.DATA_DIR, 'jobs.db')),
+    get_spotify_client,
+    on_saved=lambda user, track_ids: library_index.mark_saved(user, 'tracks', track_ids),
+    library=library_index,
+    max_workers=Config.JOB_WORKERS,
+    concurrency=Config.SPOTIFY_PAGINATION_WORKERS
+)
+
+def _collect_log_stats():
+    if log_pipeline is not None:
+        metrics_registry.set_counter('spotiplay_log_dropped_total', log_pipeline.dropped, stage='queue')
+        metrics_registry.set_counter('spotiplay_log_dropped_total', log_pipeline.send_failures, stage='writer')
+
+def _collect_prefetch_stats():
+    stats = prefetcher.stats()
+    for outcome in ('scheduled', 'skipped', 'dropped', 'completed', 'failed'):
+        metrics_registry.set_counter('spotiplay_prefetch_total', stats[outcome], outcome=outcome)
+    metrics_registry.set_counter('spotiplay_prefetch_claims_total', stats['hits'], result='hit')
+    metrics_registry.set_counter('spotiplay_prefetch_claims_total', stats['misses'], result='miss')
+
+def _spotify_clients():
+    """This process's Spotify clients that have been built so far, by mode."""
+    clients = {'sync': (_spotify_client, _spotify_client_pid), 'async': (_async_spotify_client, _async_spotify_client_pid)}
+    return {mode: client for mode, (client, pid) in clients.items() if client is not None and pid == os.getpid()}
+
+def _collect_ratelimit_stats():
+    totals = {'acquired': 0, 'queued': 0, 'queued_seconds': 0.0, 'throttled': 0, 'retries': 0}
+    for client in _spotify_clients().values():
+        if client.scheduler is not None:
+            stats = client.scheduler.stats()
+            for name in totals:
+                totals[name] += stats[name]
+    metrics_registry.set_counter('spotiplay_ratelimit_acquired_total', totals['acquired'])
+    metrics_registry.set_counter('spotiplay_ratelimit_queued_total', totals['queued'])
+    metrics_registry.set_counter('spotiplay_ratelimit_queued_seconds_total', totals['queued_seconds'])
+    metrics_registry.set_counter('spotiplay_ratelimit_throttled_total', totals['throttled'])
+    metrics_registry.set_counter('spotiplay_ratelimit_retries_total', totals['retries'])
+
+def _collect_cache_stats():
+    shared = playlist_cache.stats()
+    caches = {
+        'playlist_metadata': shared['playlists'],
+        'playlist_pages': shared['pages'],
+        'shared_playlists': {'coalesced': shared['coalesced']},
+        'fragments': fragment_cache.stats(),
+        'search_indexes': search_indexes.stats(),
+        'descriptions': description_sanitizer.stats(),
+        'saved_library': library_index.stats(),
+    }
+    for cache, stats in caches.items():
+        for name in ('hits', 'misses', 'evictions', 'coalesced'):
+            if name in stats:
+                metrics_registry.set_counter(f'spotiplay_cache_{name}_total', stats[name], cache=cache)
+
+def _collect_spotify_client_stats():
+    connections = {}
+    saved = {}
+    for client in _spotify_clients().values():
+        for endpoint, stats in client.stats().items():
+            for connection in ('new', 'reused'):
+                key = (endpoint, connection)
+                connections[key] = connections.get(key, 0) + stats[f'{connection}_connections']
+            saved[endpoint] = saved.get(endpoint, 0.0) + (stats['handshake_saved_ms'] or 0) / 1000
+    for (endpoint, connection), count in connections.items():
+        metrics_registry.set_counter('spotiplay_upstream_connections_total', count, endpoint=endpoint, connection=connection)
+    for endpoint, seconds in saved.items():
+        metrics_registry.set_counter('spotiplay_upstream_handshake_saved_seconds', seconds, endpoint=endpoint)
+
+# Counts the components above keep themselves, copied into /metrics on
+# every flush
+metrics_registry.describe('spotiplay_upstream_connections_total', 'counter', 'Spotify calls by whether they opened a new connection or reused a pooled one.')
+metrics_registry.describe(
+    'spotiplay_upstream_handshake_saved_seconds', 'gauge',
+    'Estimated time keep-alive saved: the extra cost of a new connection times the reused ones.'
+)
+metrics_registry.describe('spotiplay_cache_hits_total', 'counter', 'In-memory cache lookups answered from the cache, by cache.')
+metrics_registry.describe('spotiplay_cache_misses_total', 'counter', 'In-memory cache lookups that missed, by cache.')
+metrics_registry.describe('spotiplay_cache_evictions_total', 'counter', 'Entries evicted to stay under a cache\'s size limit, by cache.')
+metrics_registry.describe('spotiplay_cache_coalesced_total', 'counter', 'Cache misses that waited for an identical upstream call instead of making their own.')
+metrics_registry.describe('spotiplay_ratelimit_acquired_total', 'counter', 'Spotify calls let through by the shared rate limiter.')
+metrics_registry.describe('spotiplay_ratelimit_queued_total', 'counter', 'Spotify calls that had to wait for the rate limiter.')
+metrics_registry.describe('spotiplay_ratelimit_queued_seconds_total', 'counter', 'Seconds Spotify calls spent waiting for the rate limiter.')
+metrics_registry.describe('spotiplay_ratelimit_throttled_total', 'counter', '429 responses from Spotify.')
+metrics_registry.describe('spotiplay_ratelimit_retries_total', 'counter', 'Spotify calls retried after a 429.')
+metrics_registry.describe('spotiplay_prefetch_total', 'counter', 'Next-page prefetches, by what became of them.')
+metrics_registry.describe('spotiplay_prefetch_claims_total', 'counter', 'Page requests that found their page prefetched (hit) or not (miss).')
+metrics_registry.add_collector(_collect_log_stats)
+metrics_registry.add_collector(_collect_prefetch_stats)
+metrics_registry.add_collector(_collect_ratelimit_stats)
+metrics_registry.add_collector(_collect_cache_stats)
+metrics_registry.add_collector(_collect_spotify_client_stats)
+
+@app.before_request
+def start_spotify_deadline():
+    resilience.clear_deadline()
+    resilience.start_deadline(Config.SPOTIFY_REQUEST_DEADLINE)
+
+@app.teardown_request
+def end_spotify_deadline(exc):
+    resilience.clear_deadline()
+
+@app.before_request
+def refresh_spotify_token():
+    """Swap in a fresh access token before the old one expires."""
+    grant_id = session.get('spotify_token_id')
+    if grant_id is None or 'spotify_token' not in session:
+        return
+    # The session knows its token's expiry, so the store is only read near it
+    if session.get('spotify_token_expires', 0) - Config.TOKEN_REFRESH_MARGIN > time.time():
+        return
+    grant = token_manager.current(grant_id)
+    if grant is None:
+        # Revoked or unrefreshable: views see a logged-out session
+        for key in ('spotify_token', 'spotify_token_id', 'spotify_token_expires'):
+            session.pop(key, None)
+        return
+    session['spotify_token'] = grant.access_token
+    session['spotify_token_expires'] = grant.expires_at
+
+@app.before_request
+def start_request_timings():
+    metrics.start_request()
+
+@app.after_request
+def add_server_timing(response):
+    timings = metrics.current()
+    if timings is not None:
+        view = request.endpoint or 'unknown'
+        response.headers['Server-Timing'] = timings.server_timing()
+        metrics_registry.observe('spotiplay_request_duration_seconds', timings.total(), view=view)
+        if 'render' in timings.phases:
+            metrics_registry.observe('spotiplay_render_duration_seconds', timings.phases['render'], view=view)
+        metrics_registry.maybe_flush()
+    return response
+
+@app.after_request
+def log_access(response):
+    """Emit a sampled, structured access record for the request."""
+    timings = metrics.current()
+    if timings is None:
+        return response
+    duration_ms = timings.total() * 1000
+    if not (
+        response.status_code >= 500
+        or duration_ms >= Config.ACCESS_LOG_SLOW_MS
+        or random.random() < Config.ACCESS_LOG_SAMPLE_RATE
+    ):
+        return response
+    access_logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'view': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(duration_ms, 1),
+        'spotify_calls': len(timings.upstream),
+        'spotify_ms': round(sum(call[2] for call in timings.upstream) * 1000, 1),
+        'bytes': response.content_length,
+        'htmx': request.headers.get('HX-Request') == 'true',
+        'sample_rate': Config.ACCESS_LOG_SAMPLE_RATE,
+    }))
+    return response
+
+@app.teardown_request
+def end_request_timings(exc):
+    metrics.finish_request()
+
+@before_render_template.connect_via(app)
+def _template_render_started(sender, template, context, **extra):
+    timings = metrics.current()
+    if timings is not None:
+        timings.render_started()
+
+@template_rendered.connect_via(app)
+def _template_render_finished(sender, template, context, **extra):
+    timings = metrics.current()
+    if timings is not None:
+        timings.render_finished()
+
+def _user_key():
+    """Stable key for per-user state: the Spotify user ID once known, else a hash of the login's grant or token."""
+    if session.get('spotify_user_id'):
+        return session['spotify_user_id']
+    return hashlib.sha256((session.get('spotify_token_id') or session['spotify_token']).encode()).hexdigest()
 
 
 @app.route('/favicon.ico')
@@ -158,7 +598,6 @@ def callback():
             return render_template('_401_fragment.html', message=message), 401
         return render_template('base.html', content=render_template('_401_fragment.html', message=message)), 401
     code = request.args.get('code')
-    token_url = SPOTIFY_API['auth']['token']
     payload = {
         'grant_type': 'authorization_code',
         'code': code,
@@ -167,9 +606,15 @@ def callback():
         'client_secret': Config.SPOTIFY_CLIENT_SECRET
     }
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    response = requests.post(token_url, data=payload, headers=headers)
+    response = get_spotify_client().post('auth.token', data=payload, headers=headers)
     if response.status_code == 200:
-        session['spotify_token'] = response.json()['access_token']
+        token_response = response.json()
+        if isinstance(app.session_interface, sessions.SQLiteSessionInterface):
+            # New session ID at login, so one issued beforehand can't be reused
+            app.session_interface.regenerate(session)
+        session['spotify_token'] = token_response['access_token']
+        session['spotify_token_id'] = token_manager.issue(token_response)
+        session['spotify_token_expires'] = time.time() + token_response.get('expires_in', 3600)
         return redirect(url_for('dashboard'))
     else:
         return 'Spotify authorization failed', 400
@@ -179,170 +624,668 @@ def dashboard():
     if 'spotify_token' not in session:
         return redirect(url_for('index'))
 
-    headers = {'Authorization': f"Bearer {session['spotify_token']}"}
-
-    # Fetch user profile from Spotify
-    user_profile = None
-    profile_resp = requests.get(SPOTIFY_API['user']['profile'], headers=headers)
-    if profile_resp.status_code == 200:
-        user_profile = profile_resp.json()
+    token = session['spotify_token']
+    client = get_spotify_client()
+    user = _user_key()
+    album_offset = _album_offset()
+    album_key = f'albums:{album_offset}'
+    if request.headers.get('HX-Request') == 'true' and 'album_offset' in request.args:
+        # Album "Next"/"Previous": just the albums grid
+        album_page = _cached_value(user, album_key)
+        if album_page is None:
+            album_page = _load_album_page(client, token, album_offset)
+            _cache_value(user, album_key, album_page)
+        return render_template('_albums_fragment.html', **_album_context(album_page))
 
-    # Fetch user playlists from Spotify
-    playlists = []
-    resp = requests.get(SPOTIFY_API['user']['playlists'], headers=headers)
-    if resp.status_code == 200:
-        data = resp.json()
-        playlists = data.get('items', [])
-    else:
-        playlists = None
+    # A revisit within DASHBOARD_CACHE_TTL needs no Spotify calls at all
+    user_profile = _cached_value(user, 'profile')
+    playlists = _cached_value(user, 'playlists')
+    album_page = _cached_value(user, album_key)
+    fetched = []
+    with FanOut(client.max_concurrency(Config.SPOTIFY_FANOUT_WORKERS), resilience.remaining()) as fanout:
+        playlists_future = fanout.submit(_load_all_playlists, client, token) if playlists is None else None
+        albums_future = fanout.submit(_load_album_page, client, token, album_offset) if album_page is None else None
+        if user_profile is None:
+            # On this thread, so an open circuit fails the page as before
+            user_profile = _load_profile(client, token)
+            fetched.append(('profile', user_profile))
+        if playlists_future is not None:
+            playlists = fanout.result(playlists_future)
+            fetched.append(('playlists', playlists))
+        if albums_future is not None:
+            album_page = fanout.result(albums_future)
+            fetched.append((album_key, album_page))
+    if user_profile is not None and user_profile['id']:
+        session['spotify_user_id'] = user_profile['id']
+        user = user_profile['id']
+    for key, value in fetched:
+        _cache_value(user, key, value)
 
+    playlists = [Playlist(**playlist) for playlist in playlists] if playlists is not None else None
     return render_template(
         'dashboard.html',
         playlists=playlists,
-        user_profile=user_profile
+        descriptions=_playlist_descriptions(playlists or []),
+        user_profile=user_profile,
+        **_album_context(album_page)
+    )
+
+# Saved albums per page of the dashboard's albums grid
+ALBUM_PAGE_LIMIT = 20
+
+def _album_offset():
+    try:
+        return max(int(request.args.get('album_offset', 0)), 0)
+    except ValueError:
+        return 0
+
+def _cached_value(user, key):
+    return session_store.get_user_value(user, key)
+
+def _cache_value(user, key, value):
+    """
+    Keep a dashboard value for DASHBOARD_CACHE_TTL seconds. Values live in
+    the session store so every worker process shares them. Empty album
+    pages aren't kept, since a failed fetch looks the same.
+    """
+    if value is None or (key.startswith('albums:') and not value['albums']):
+        return
+    session_store.set_user_value(user, key, value, Config.DASHBOARD_CACHE_TTL)
+
+def _forget_saved_albums(user):
+    """Drop a user's cached album pages after they save albums."""
+    session_store.delete_user_values(user, prefix='albums:')
+
+def _load_profile(client, token):
+    """The parts of the user's profile the dashboard shows, or None."""
+    resp = client.get('user.profile', token)
+    return _profile_summary(resp.json()) if resp.status_code == 200 else None
+
+def _profile_summary(data):
+    return {
+        'id': data.get('id'),
+        'display_name': data.get('display_name'),
+        'images': [{'url': image.get('url')} for image in (data.get('images') or [])[:1]],
+    }
+
+def _load_all_playlists(client, token):
+    """Every one of the user's playlists as dicts (pages are fetched concurrently), or None."""
+    try:
+        items = list(iter_all_items(
+            client, 'user.playlists', token, limit=50,
+            max_workers=client.max_concurrency(Config.SPOTIFY_PAGINATION_WORKERS)
+        ))
+    except SpotifyPageError as exc:
+        logger.warning("Failed to fetch playlists: %s", exc)
+        return None
+    return [as_dict(playlist) for playlist in parse_playlists({'items': items})]
+
+def _load_album_page(client, token, offset):
+    albums, total, next_offset, prev_offset = fetch_spotify_items_with_pagination(
+        client, 'user.albums', token, offset=offset, limit=ALBUM_PAGE_LIMIT
+    )
+    return _album_page(albums, offset, total, next_offset, prev_offset)
+
+def _album_page(items, offset, total, next_offset, prev_offset):
+    """A page of saved albums as cached: album dicts plus the paging the fragment shows."""
+    return {
+        'albums': [as_dict(album) for album in parse_saved_albums(items)],
+        'album_offset': offset,
+        'total_albums': total,
+        'next_album_offset': next_offset,
+        'prev_album_offset': prev_offset,
+    }
+
+def _album_context(album_page):
+    """Template variables for `_albums_fragment.html`."""
+    if album_page is None:
+        return {'albums': None}
+    return {**album_page, 'albums': [SavedAlbum(**album) for album in album_page['albums']]}
+
+
+# Most IDs Spotify accepts per library save or contains request, and the
+# SPOTIFY_API endpoints for each
+LIBRARY_ID_LIMITS = {'tracks': 50, 'albums': 20}
+LIBRARY_ENDPOINTS = {
+    'tracks': ('user.tracks', 'user.check_saved_tracks'),
+    'albums': ('user.albums', 'user.check_saved_albums'),
+}
+
+def _batches(ids, size):
+    return [ids[i:i+size] for i in range(0, len(ids), size)]
+
+def _collect_saved_checks(fanout, checks):
+    """Merge `contains` responses for (batch, future) pairs into an id -> saved dict."""
+    saved = {}
+    for batch, future in checks:
+        check_resp = fanout.result(future)
+        if check_resp is not None and check_resp.status_code == 200:
+            for item_id, is_saved in zip(batch, check_resp.json()):
+                saved[item_id] = is_saved
+    return saved
+
+def _check_saved_state(fanout, client, token, user, tracks):
+    """
+    Saved state of the albums and tracks in `tracks`, as two id -> saved
+    dicts. Answers from the saved-library index first, then checks the
+    misses for albums and tracks (Liked Songs) in parallel, up to
+    Spotify's per-request ID limit at a time.
+    """
+    unique_album_ids, track_ids = _saved_state_ids(tracks)
+    saved_albums, missing_albums = library_index.lookup(user, 'albums', unique_album_ids)
+    saved_tracks, missing_tracks = library_index.lookup(user, 'tracks', track_ids)
+    album_checks = [
+        (batch, fanout.submit(client.get, 'user.check_saved_albums', token, params={'ids': ','.join(batch)}))
+        for batch in _batches(missing_albums, LIBRARY_ID_LIMITS['albums'])
+    ]
+    track_checks = [
+        (batch, fanout.submit(client.get, 'user.check_saved_tracks', token, params={'ids': ','.join(batch)}))
+        for batch in _batches(missing_tracks, LIBRARY_ID_LIMITS['tracks'])
+    ]
+    checked_albums = _collect_saved_checks(fanout, album_checks)
+    checked_tracks = _collect_saved_checks(fanout, track_checks)
+    library_index.record(user, 'albums', checked_albums)
+    library_index.record(user, 'tracks', checked_tracks)
+    saved_albums.update(checked_albums)
+    saved_tracks.update(checked_tracks)
+    return saved_albums, saved_tracks
+
+# Shared by the sync and async playlist views
+PLAYLIST_PAGE_LIMIT = 50
+# Tracks per upstream page (Spotify's maximum) when streaming a whole playlist
+STREAM_PAGE_LIMIT = 100
+
+def _request_offset():
+    try:
+        return int(request.args.get('offset', 0))
+    except ValueError:
+        return 0
+
+def _load_playlist(client, token, playlist_id):
+    resp = client.get(
+        'playlists.get', token, path={'playlist_id': playlist_id},
+        params={'fields': PLAYLIST_FIELDS}
+    )
+    return parse_playlist(resp.json(), playlist_id) if resp.status_code == 200 else None
+
+def _load_tracks_page(client, token, playlist_id, offset, limit):
+    resp = client.get(
+        'playlists.tracks', token, path={'playlist_id': playlist_id},
+        params={'fields': PLAYLIST_PAGE_FIELDS, 'offset': offset, 'limit': limit}
+    )
+    return parse_track_page(resp.json()) if resp.status_code == 200 else None
+
+def _sanitize_description(playlist):
+    """Sanitize playlist description for HTML links."""
+    with metrics.phase('sanitize'):
+        return description_sanitizer.sanitize(playlist.description)
+
+def _playlist_descriptions(playlists):
+    """Safe description HTML for each playlist on the dashboard, by playlist ID."""
+    with metrics.phase('sanitize'):
+        html = description_sanitizer.sanitize_many([playlist.description for playlist in playlists])
+    return {playlist.id: description for playlist, description in zip(playlists, html)}
+
+def _page_offsets(offset, limit, total):
+    """Return (next_offset, prev_offset) for a page of `limit` items."""
+    next_offset = offset + limit if offset + limit < total else None
+    if offset - limit >= 0:
+        prev_offset = offset - limit
+    elif offset > 0:
+        prev_offset = 0
+    else:
+        prev_offset = None
+    return next_offset, prev_offset
+
+def _saved_state_ids(tracks):
+    """Unique album IDs and track IDs whose saved state the page needs."""
+    unique_album_ids = []
+    seen_album_ids = set()
+    track_ids = []
+    for track in tracks:
+        album = track.album
+        if album is not None and album.id not in seen_album_ids:
+            unique_album_ids.append(album.id)
+            seen_album_ids.add(album.id)
+        if track.id:
+            track_ids.append(track.id)
+    return unique_album_ids, track_ids
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _render_key(playlist, offset, limit, total_tracks, saved_albums, saved_tracks):
+    """
+    Digest of everything the track list is rendered from, or None when the
+    playlist has no snapshot_id to pin its tracks down.
+    """
+    if not playlist.snapshot_id:
+        return None
+    return _digest(
+        '_tracks_fragment.html', playlist.id, playlist.snapshot_id, offset, limit, total_tracks,
+        sorted(saved_albums.items()), sorted(saved_tracks.items())
     )
 
+def _page_etag(render_key, playlist, htmx):
+    """
+    Strong ETag for a playlist page. It covers the session's CSRF token and
+    a time bucket of half the token lifetime, so a 304 never hands back a
+    page whose token has expired.
+    """
+    generate_csrf()
+    csrf_secret = session.get(app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+    bucket = int(time.time() // ((app.config.get('WTF_CSRF_TIME_LIMIT') or 3600) / 2))
+    header = None
+    if not htmx:
+        header = (playlist.name, playlist.description, playlist.owner, playlist.image)
+    return _digest(render_key, htmx, header, csrf_secret, bucket)
+
+def _render_tracks_fragment(render_key, **context):
+    """Render the track list, reusing a cached render when `render_key` is set."""
+    if render_key is None:
+        return Markup(render_template('_tracks_fragment.html', **context))
+    html = fragment_cache.get(render_key)
+    if html is None:
+        html = render_template('_tracks_fragment.html', csrf_placeholder=CSRF_PLACEHOLDER, **context)
+        fragment_cache.set(render_key, html)
+    return Markup(html.replace(CSRF_PLACEHOLDER, generate_csrf()))
+
+def _render_playlist_page(playlist, tracks, offset, limit, total_tracks, next_offset, prev_offset, saved_albums, saved_tracks):
+    htmx = request.headers.get('HX-Request') == 'true'
+    render_key = _render_key(playlist, offset, limit, total_tracks, saved_albums, saved_tracks)
+    etag = _page_etag(render_key, playlist, htmx) if render_key else None
+    if etag and request.if_none_match.contains(etag):
+        resp = make_response('', 304)
+    else:
+        tracks_html = _render_tracks_fragment(
+            render_key,
+            playlist=playlist,
+            tracks=tracks,
+            offset=offset,
+            limit=limit,
+            total_tracks=total_tracks,
+            next_offset=next_offset,
+            prev_offset=prev_offset,
+            saved_albums=saved_albums,
+            saved_tracks=saved_tracks
+        )
+        if htmx:
+            resp = make_response(tracks_html)
+        else:
+            resp = make_response(render_template(
+                'playlist_detail.html',
+                playlist=playlist,
+                description_html=_sanitize_description(playlist),
+                tracks_html=tracks_html
+            ))
+    return _set_page_validator(resp, etag)
+
+def _set_page_validator(resp, etag):
+    if etag:
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.vary.add('HX-Request')
+    return resp
+
+def _revalidate_from_cache(user, playlist_id, offset, limit):
+    """
+    Answer an If-None-Match for a playlist page from local state alone:
+    the cached snapshot, its cached track page and the library index.
+    Returns (304 response, playlist), or (None, None) when any of it
+    would need an upstream call.
+    """
+    if not request.if_none_match:
+        return None, None
+    playlist = playlist_cache.cached_playlist(user, playlist_id)
+    if playlist is None or not playlist.snapshot_id:
+        return None, None
+    track_data = playlist_cache.cached_tracks_page(user, playlist, offset, limit)
+    if track_data is None:
+        return None, None
+    album_ids, track_ids = _saved_state_ids(track_data.tracks)
+    saved_albums, missing_albums = library_index.lookup(user, 'albums', album_ids)
+    saved_tracks, missing_tracks = library_index.lookup(user, 'tracks', track_ids)
+    if missing_albums or missing_tracks:
+        return None, None
+    htmx = request.headers.get('HX-Request') == 'true'
+    render_key = _render_key(playlist, offset, limit, playlist.total, saved_albums, saved_tracks)
+    etag = _page_etag(render_key, playlist, htmx) if render_key else None
+    if not etag or not request.if_none_match.contains(etag):
+        return None, None
+    return _set_page_validator(make_response('', 304), etag), playlist
+
+def _prefetch_page(user, token, playlist_id, offset, limit):
+    """Warm the shared track page and the user's saved state for a page."""
+    client = get_spotify_client()
+    playlist = playlist_cache.cached_playlist(user, playlist_id)
+    if playlist is None:
+        return
+    track_data = playlist_cache.tracks_page(
+        user, playlist, offset, limit,
+        lambda: _load_tracks_page(client, token, playlist_id, offset, limit)
+    )
+    if track_data is None:
+        return
+    unique_album_ids, track_ids = _saved_state_ids(track_data.tracks)
+    for kind, endpoint, ids in (
+        ('albums', 'user.check_saved_albums', unique_album_ids),
+        ('tracks', 'user.check_saved_tracks', track_ids),
+    ):
+        _, missing = library_index.lookup(user, kind, ids)
+        for batch in _batches(missing, LIBRARY_ID_LIMITS[kind]):
+            resp = client.get(endpoint, token, params={'ids': ','.join(batch)})
+            if resp.status_code == 200:
+                library_index.record(user, kind, dict(zip(batch, resp.json())))
+
+def _schedule_prefetch(resp, user, token, playlist, limit, next_offset):
+    """Once `resp` has been sent, warm the page the "Next" button loads."""
+    # Without a snapshot_id the page can't be cached, so there's nothing to warm
+    if not Config.PREFETCH_ENABLED or next_offset is None or not playlist.snapshot_id:
+        return
+    key = (user, playlist.id, next_offset)
+    resp.call_on_close(
+        lambda: prefetcher.schedule(user, key, _prefetch_page, user, token, playlist.id, next_offset, limit)
+    )
 
 @app.route('/playlist/<playlist_id>')
 def playlist_detail(playlist_id):
     if 'spotify_token' not in session:
         return redirect(url_for('login'))
-    headers = {'Authorization': f"Bearer {session['spotify_token']}"}
-    # Get pagination params
-    try:
-        offset = int(request.args.get('offset', 0))
-    except ValueError:
-        offset = 0
-    limit = 50
-    # Fetch playlist details
-    playlist_resp = requests.get(SPOTIFY_API['playlists']['get'].format(playlist_id=playlist_id), headers=headers)
-    if playlist_resp.status_code != 200:
-        abort(400, description="Failed to fetch playlist")
-    playlist = playlist_resp.json()
-    # Sanitize playlist description for HTML links
-    if playlist.get('description'):
-        playlist['description_html'] = bleach.clean(
-            playlist['description'],
-            tags=['a'],
-            attributes={
-                'a': ['href', 'rel', 'target']
-            },
-            protocols=['http', 'https'],
-            strip=True
-        )
-    else:
-        playlist['description_html'] = ''
-    # Fetch just one page of tracks
-    tracks_url = f"{SPOTIFY_API['playlists']['tracks'].format(playlist_id=playlist_id)}?fields=items(track(id,name,artists,album,external_urls)),total,next,previous&offset={offset}&limit={limit}"
-    track_resp = requests.get(tracks_url, headers=headers)
+    token = session['spotify_token']
+    client = get_spotify_client()
+    offset = _request_offset()
+    limit = PLAYLIST_PAGE_LIMIT
     tracks = []
     total_tracks = 0
     next_offset = None
     prev_offset = None
     saved_albums = {}
     saved_tracks = {}
-    if track_resp.status_code == 200:
-        data = track_resp.json()
-        for item in data.get('items', []):
-            if item.get('track'):
-                tracks.append(item['track'])
-        total_tracks = playlist['tracks']['total']
-        # Pagination
-        if offset + limit < total_tracks:
-            next_offset = offset + limit
-        if offset - limit >= 0:
-            prev_offset = offset - limit
-        elif offset > 0:
-            prev_offset = 0
-        
-        # Extract unique album IDs to check if they're in the user's library
-        unique_album_ids = []
-        seen_album_ids = set()
-        track_ids = []
-        for track in tracks:
-            album = track.get('album')
-            if album and album.get('id') and album['id'] not in seen_album_ids:
-                unique_album_ids.append(album['id'])
-                seen_album_ids.add(album['id'])
-            if track.get('id'):
-                track_ids.append(track['id'])
-        
-        # Check which albums are in the user's library
-        saved_albums = {}
-        if unique_album_ids:
-            # Spotify API allows checking up to 50 IDs at once
-            for i in range(0, len(unique_album_ids), 50):
-                batch = unique_album_ids[i:i+50]
-                check_url = f"https://api.spotify.com/v1/me/albums/contains?ids={','.join(batch)}"
-                check_resp = requests.get(check_url, headers=headers)
-                if check_resp.status_code == 200:
-                    results = check_resp.json()
-                    for album_id, is_saved in zip(batch, results):
-                        saved_albums[album_id] = is_saved
-        # Check which tracks are already saved (in Liked Songs)
-        saved_tracks = {}
-        if track_ids:
-            for i in range(0, len(track_ids), 50):
-                batch = track_ids[i:i+50]
-                check_url = f"https://api.spotify.com/v1/me/tracks/contains?ids={','.join(batch)}"
-                check_resp = requests.get(check_url, headers=headers)
-                if check_resp.status_code == 200:
-                    results = check_resp.json()
-                    for track_id, is_saved in zip(batch, results):
-                        saved_tracks[track_id] = is_saved
-
-    template_name = '_tracks_fragment.html' if request.headers.get('HX-Request') == 'true' else 'playlist_detail.html'
-    return render_template(
-        template_name,
-        playlist=playlist, 
-        tracks=tracks, 
-        offset=offset, 
-        limit=limit, 
-        total_tracks=total_tracks, 
-        next_offset=next_offset, 
+    user = _user_key()
+    if offset and request.headers.get('HX-Request') == 'true':
+        # A "Next"/"Previous" click; counts toward the prefetch hit rate
+        prefetcher.claim((user, playlist_id, offset))
+    resp, playlist = _revalidate_from_cache(user, playlist_id, offset, limit)
+    if resp is not None:
+        next_offset, _ = _page_offsets(offset, limit, playlist.total)
+        _schedule_prefetch(resp, user, token, playlist, limit, next_offset)
+        return resp
+
+    def load_playlist():
+        return _load_playlist(client, token, playlist_id)
+
+    def load_tracks():
+        return _load_tracks_page(client, token, playlist_id, offset, limit)
+
+    with FanOut(client.max_concurrency(Config.SPOTIFY_FANOUT_WORKERS), resilience.remaining()) as fanout:
+        playlist = playlist_cache.cached_playlist(user, playlist_id)
+        if playlist is not None:
+            # The cached snapshot_id tells us which track page to reuse
+            track_data = fanout.result(fanout.submit(playlist_cache.tracks_page, user, playlist, offset, limit, load_tracks))
+        else:
+            # Playlist details and the requested page of tracks are independent
+            playlist_future = fanout.submit(playlist_cache.playlist, user, playlist_id, load_playlist)
+            track_future = fanout.submit(load_tracks)
+            playlist = fanout.result(playlist_future)
+            track_data = fanout.result(track_future)
+            if playlist is not None:
+                playlist_cache.store_tracks_page(user, playlist, offset, limit, track_data)
+        if playlist is None:
+            abort(400, description="Failed to fetch playlist")
+        if track_data is not None:
+            tracks = track_data.tracks
+            total_tracks = playlist.total
+            next_offset, prev_offset = _page_offsets(offset, limit, total_tracks)
+            saved_albums, saved_tracks = _check_saved_state(fanout, client, token, user, tracks)
+
+    resp = _render_playlist_page(
+        playlist, tracks, offset, limit, total_tracks,
+        next_offset, prev_offset, saved_albums, saved_tracks
+    )
+    _schedule_prefetch(resp, user, token, playlist, limit, next_offset)
+    return resp
+
+@app.route('/playlist/<playlist_id>/all')
+def playlist_all_tracks(playlist_id):
+    """
+    The whole playlist on one page. The header is sent as soon as the
+    playlist metadata is in, then track rows are streamed one upstream
+    page at a time. htmx requests (the "Load more" row) get just the rows
+    from `offset` on.
+    """
+    if 'spotify_token' not in session:
+        return redirect(url_for('login'))
+    token = session['spotify_token']
+    client = get_spotify_client()
+    user = _user_key()
+    offset = _request_offset()
+    fanout = FanOut(client.max_concurrency(Config.SPOTIFY_FANOUT_WORKERS), resilience.remaining())
+    # The first page is fetched while the metadata loads
+    first_page = fanout.submit(_load_tracks_page, client, token, playlist_id, offset, STREAM_PAGE_LIMIT)
+    playlist = fanout.result(fanout.submit(
+        playlist_cache.playlist, user, playlist_id, lambda: _load_playlist(client, token, playlist_id)
+    ))
+    if playlist is None:
+        fanout.shutdown()
+        abort(400, description="Failed to fetch playlist")
+    # The session can't change once streaming starts, so settle the CSRF token now
+    rows = _stream_track_rows(fanout, client, token, user, playlist, offset, first_page, generate_csrf())
+    if request.headers.get('HX-Request') == 'true':
+        resp = app.response_class(stream_with_context(rows))
+    else:
+        resp = app.response_class(stream_template(
+            'playlist_all.html', playlist=playlist, description_html=_sanitize_description(playlist), chunks=rows
+        ))
+    resp.call_on_close(fanout.shutdown)
+    # Stop nginx from buffering the stream
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+def _stream_track_rows(fanout, client, token, user, playlist, offset, page_future, csrf):
+    """
+    Yield rendered track rows for `playlist` from `offset` on. While a
+    page's saved state is checked and its rows are sent, the next page is
+    already being fetched, so at most two pages are held in memory
+    whatever the playlist's size. Each page gets a fresh upstream
+    deadline; after STREAM_MAX_SECONDS the stream ends with a "Load more"
+    row instead.
+    """
+    stop_at = time.monotonic() + Config.STREAM_MAX_SECONDS
+    while page_future is not None:
+        page = fanout.result(page_future)
+        if page is None:
+            yield Markup(render_template('_stream_status_row.html', playlist=playlist, failed=True))
+            return
+        resilience.clear_deadline()
+        resilience.start_deadline(Config.SPOTIFY_REQUEST_DEADLINE)
+        fanout.reset_deadline(Config.SPOTIFY_REQUEST_DEADLINE)
+        offset += STREAM_PAGE_LIMIT
+        more = bool(page.tracks) and offset < page.total
+        page_future = None
+        if more and time.monotonic() < stop_at:
+            page_future = fanout.submit(_load_tracks_page, client, token, playlist.id, offset, STREAM_PAGE_LIMIT)
+        saved_albums, saved_tracks = _check_saved_state(fanout, client, token, user, page.tracks)
+        yield Markup(render_template(
+            '_track_rows.html',
+            tracks=page.tracks,
+            saved_albums=saved_albums,
+            saved_tracks=saved_tracks,
+            seen_albums={},
+            unsaved=Namespace(tracks=False),
+            csrf_placeholder=csrf
+        ))
+    if more:
+        yield Markup(render_template('_stream_status_row.html', playlist=playlist, next_offset=offset))
+
+@app.route('/playlist/<playlist_id>/search')
+def playlist_search(playlist_id):
+    """
+    Tracks of a playlist matching `q` (word prefixes in the track name,
+    artists and/or album, per `field`), optionally only `saved` or
+    `unsaved` ones per `status`, a page at a time. The first search of a
+    playlist snapshot starts building its index in the background and
+    answers with a placeholder that polls until it's ready; later searches
+    are answered from the index. Saved state (for the status filter and
+    the Add buttons) only comes from the library index; IDs it doesn't
+    know are checked in the background while the results poll, never on
+    the keystroke itself.
+    """
+    if 'spotify_token' not in session:
+        return redirect(url_for('login'))
+    token = session['spotify_token']
+    client = get_spotify_client()
+    user = _user_key()
+    offset = max(_request_offset(), 0)
+    limit = PLAYLIST_PAGE_LIMIT
+    search = {
+        'q': request.args.get('q', '').strip(),
+        'field': request.args.get('field', 'all'),
+        'status': request.args.get('status', 'all'),
+    }
+    fields = SEARCH_FIELDS if search['field'] not in SEARCH_FIELDS else (search['field'],)
+
+    # Metadata from the playlist page or the last search; only a search
+    # opened straight from a link fetches it
+    playlist = playlist_cache.cached_playlist(user, playlist_id) or search_indexes.playlist(user, playlist_id)
+    if playlist is None:
+        playlist = playlist_cache.playlist(user, playlist_id, lambda: _load_playlist(client, token, playlist_id))
+    if playlist is None:
+        abort(400, description="Failed to fetch playlist")
+    index, state = search_indexes.ready(user, playlist, lambda: _load_all_tracks(client, token, playlist_id))
+    if state == 'failed':
+        abort(400, description="Failed to fetch playlist")
+    pending = None
+    if index is None:
+        pending = 'index'
+        positions, tracks, saved_albums, saved_tracks = [], [], {}, {}
+    else:
+        with metrics.phase('search'):
+            positions = index.search(search['q'], fields)
+        unknown_tracks = []
+        if search['status'] in ('saved', 'unsaved'):
+            positions, unknown_tracks = _filter_by_saved_state(user, index, positions, search['status'] == 'saved')
+        tracks = index.tracks(positions[offset:offset + limit])
+        album_ids, track_ids = _saved_state_ids(tracks)
+        saved_albums, unknown_albums = library_index.lookup(user, 'albums', album_ids)
+        saved_tracks, missing = library_index.lookup(user, 'tracks', track_ids)
+        unknown_tracks = list(dict.fromkeys(unknown_tracks + missing))
+        if unknown_albums or unknown_tracks:
+            # Shown as unsaved for now; the results poll until the checks are in
+            pending = 'saved'
+            prefetcher.schedule(
+                user, (user, playlist_id, 'saved'), _check_saved_in_background, user, token, unknown_albums, unknown_tracks
+            )
+
+    next_offset, prev_offset = _page_offsets(offset, limit, len(positions))
+    tracks_html = _render_tracks_fragment(
+        None,
+        playlist=playlist,
+        tracks=tracks,
+        offset=offset,
+        limit=limit,
+        total_tracks=len(positions),
+        next_offset=next_offset,
         prev_offset=prev_offset,
         saved_albums=saved_albums,
-        saved_tracks=saved_tracks
+        saved_tracks=saved_tracks,
+        search=search,
+        pending=pending
+    )
+    if request.headers.get('HX-Request') == 'true':
+        return tracks_html
+    return render_template(
+        'playlist_detail.html',
+        playlist=playlist,
+        description_html=_sanitize_description(playlist),
+        tracks_html=tracks_html,
+        search=search
     )
 
+def _filter_by_saved_state(user, index, positions, wanted):
+    """
+    The `positions` whose track is saved (or not, per `wanted`) as far as
+    the library index knows, and the IDs of tracks whose state is still
+    unknown. Unknown tracks are left out until they have been checked.
+    """
+    track_ids = [index.track_id(position) for position in positions]
+    known, missing = library_index.lookup(user, 'tracks', list(dict.fromkeys(filter(None, track_ids))))
+    kept = [position for position, track_id in zip(positions, track_ids) if known.get(track_id) == wanted]
+    return kept, missing
+
+def _check_saved_in_background(user, token, album_ids, track_ids):
+    """Record the saved state of `album_ids` and `track_ids` in the library index."""
+    if album_ids:
+        _saved_flags(user, token, 'albums', album_ids)
+    if track_ids:
+        _saved_flags(user, token, 'tracks', track_ids)
+
+def _load_all_tracks(client, token, playlist_id):
+    """Every track of a playlist, for the search index, or None if a page failed."""
+    try:
+        items = iter_all_items(
+            client, 'playlists.tracks', token, path={'playlist_id': playlist_id},
+            params={'fields': SEARCH_INDEX_FIELDS}, limit=STREAM_PAGE_LIMIT,
+            max_workers=client.max_concurrency(Config.SPOTIFY_PAGINATION_WORKERS)
+        )
+        return parse_track_page({'items': list(items)}).tracks
+    except SpotifyPageError as exc:
+        logger.warning("Failed to index playlist %s: %s", playlist_id, exc)
+        return None
+
 @app.route('/add_playlist_to_library/<playlist_id>', methods=['POST'])
 def add_playlist_to_library(playlist_id):
     if 'spotify_token' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
-    headers = {'Authorization': f"Bearer {session['spotify_token']}"}
-    # Step 1: Fetch all track IDs from the playlist (handle pagination)
-    track_ids = []
-    url = f"{SPOTIFY_API['playlists']['tracks'].format(playlist_id=playlist_id)}?fields=items(track(id)),next&limit=100"
-    while url:
-        resp = requests.get(url, headers=headers)
-        if resp.status_code != 200:
-            return render_template('htmx_add_result.html', message='Failed to fetch playlist tracks.')
-        data = resp.json()
-        for item in data.get('items', []):
-            track = item.get('track')
-            if track and track.get('id'):
-                track_ids.append(track['id'])
-        url = data.get('next')
-    # Step 2: Add tracks to user's library in batches of 50
-    batch_size = 50
-    failed = False
-    for i in range(0, len(track_ids), batch_size):
-        batch = track_ids[i:i+batch_size]
-        save_url = SPOTIFY_API['user']['tracks']
-        save_resp = requests.put(save_url, headers={**headers, 'Content-Type': 'application/json'}, json={'ids': batch})
-        if save_resp.status_code not in (200, 201):
-            failed = True
-    message = f"Added {len(track_ids)} tracks to your library!" if not failed else "Some tracks may not have been added."
-    return render_template('htmx_add_result.html', message=message)
+    # Saving runs as a background job; small playlists usually finish within
+    # the grace period and get their result straight away.
+    job = job_manager.submit_playlist_save(_user_key(), playlist_id, session['spotify_token'])
+    job = job_manager.wait(job.id, Config.JOB_SYNC_WAIT)
+    return _render_job(job)
+
+def _render_job(job):
+    if job.state == jobs.DONE:
+        return render_template('htmx_add_result.html', message=job.message)
+    return render_template('_job_progress_fragment.html', job=job)
+
+def _get_user_job(job_id):
+    job = job_manager.store.get(job_id)
+    if job is None or job.user != _user_key():
+        abort(404)
+    return job
+
+@app.route('/jobs/<job_id>')
+def job_progress(job_id):
+    if 'spotify_token' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    return _render_job(_get_user_job(job_id))
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if 'spotify_token' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    job = _get_user_job(job_id)
+    job_manager.cancel(job)
+    return _render_job(job_manager.store.get(job_id))
+
+@app.route('/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    if 'spotify_token' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    job = _get_user_job(job_id)
+    job_manager.resume(job, session['spotify_token'])
+    return _render_job(job_manager.wait(job_id, Config.JOB_SYNC_WAIT))
 
 @app.route('/add_track_to_library/<track_id>', methods=['POST'])
 def add_track_to_library(track_id):
     if 'spotify_token' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
-    headers = {'Authorization': f"Bearer {session['spotify_token']}"}
-    save_url = SPOTIFY_API['user']['tracks']
-    resp = requests.put(save_url, headers={**headers, 'Content-Type': 'application/json'}, json={'ids': [track_id]})
+    resp = get_spotify_client().put('user.tracks', session['spotify_token'], json={'ids': [track_id]})
     if resp.status_code in (200, 201):
+        library_index.mark_saved(_user_key(), 'tracks', [track_id])
         message = 'Added to your library!'
     else:
         message = 'Failed to add track.'
@@ -352,17 +1295,172 @@ def add_track_to_library(track_id):
 def add_album_to_library(album_id):
     if 'spotify_token' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
-    headers = {'Authorization': f"Bearer {session['spotify_token']}"}
-    save_url = SPOTIFY_API['user']['albums']
-    resp = requests.put(save_url, headers={**headers, 'Content-Type': 'application/json'}, json={'ids': [album_id]})
+    resp = get_spotify_client().put('user.albums', session['spotify_token'], json={'ids': [album_id]})
     if resp.status_code in (200, 201):
+        library_index.mark_saved(_user_key(), 'albums', [album_id])
+        _forget_saved_albums(_user_key())
         message = 'Album added to your library!'
     else:
         message = 'Failed to add album.'
     return render_template('htmx_add_result.html', message=message)
 
+def _posted_ids():
+    """Unique IDs posted as `ids` (repeated and/or comma-separated), in order."""
+    ids = []
+    for value in request.form.getlist('ids'):
+        ids.extend(part.strip() for part in value.split(','))
+    ids = list(dict.fromkeys(item_id for item_id in ids if item_id))
+    if len(ids) > Config.BULK_SAVE_MAX_IDS:
+        abort(400, description=f"At most {Config.BULK_SAVE_MAX_IDS} items can be added at once")
+    return ids
+
+def _save_to_library(user, token, kind, ids):
+    """PUT `ids` to the user's library in concurrent batches; returns (saved, failed) counts."""
+    client = get_spotify_client()
+    saved = failed = 0
+    batches = put_in_batches(
+        client, LIBRARY_ENDPOINTS[kind][0], token, ids,
+        batch_size=LIBRARY_ID_LIMITS[kind], max_workers=client.max_concurrency(Config.SPOTIFY_PAGINATION_WORKERS)
+    )
+    try:
+        for batch, succeeded in batches:
+            if succeeded:
+                saved += len(batch)
+                library_index.mark_saved(user, kind, batch)
+            else:
+                failed += len(batch)
+    finally:
+        batches.close()
+    if kind == 'albums' and saved:
+        _forget_saved_albums(user)
+    return saved, failed
+
+def _unsaved(user, token, kind, ids):
+    """The subset of `ids` not in the user's library, checking the index first."""
+    known = _saved_flags(user, token, kind, ids)
+    return [item_id for item_id in ids if not known.get(item_id)]
+
+def _saved_flags(user, token, kind, ids):
+    """{id: is_saved} for `ids` from the index, checking unknown IDs in batches; unanswered IDs are left out."""
+    client = get_spotify_client()
+    known, missing = library_index.lookup(user, kind, ids)
+    checks = check_in_batches(
+        client, LIBRARY_ENDPOINTS[kind][1], token, missing,
+        batch_size=LIBRARY_ID_LIMITS[kind], max_workers=client.max_concurrency(Config.SPOTIFY_PAGINATION_WORKERS)
+    )
+    try:
+        for batch, flags in checks:
+            # An unanswered check just means those IDs get saved again
+            if flags is not None:
+                known.update(zip(batch, flags))
+                library_index.record(user, kind, dict(zip(batch, flags)))
+    finally:
+        checks.close()
+    return known
+
+def _bulk_save_message(kind, saved, failed, skipped=0):
+    if failed:
+        return f"Some {kind} may not have been added."
+    message = f"Added {saved} {kind} to your library!"
+    if skipped:
+        message += f" Skipped {skipped} already there."
+    return message
+
+@app.route('/add_tracks_to_library', methods=['POST'])
+def add_tracks_to_library():
+    if 'spotify_token' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    track_ids = _posted_ids()
+    if not track_ids:
+        return render_template('htmx_add_result.html', message='No tracks selected.')
+    saved, failed = _save_to_library(_user_key(), session['spotify_token'], 'tracks', track_ids)
+    return render_template('htmx_add_result.html', message=_bulk_save_message('tracks', saved, failed))
+
+@app.route('/add_albums_to_library', methods=['POST'])
+def add_albums_to_library():
+    if 'spotify_token' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    album_ids = _posted_ids()
+    if not album_ids:
+        return render_template('htmx_add_result.html', message='No albums selected.')
+    saved, failed = _save_to_library(_user_key(), session['spotify_token'], 'albums', album_ids)
+    return render_template('htmx_add_result.html', message=_bulk_save_message('albums', saved, failed))
+
+@app.route('/add_playlist_albums_to_library/<playlist_id>', methods=['POST'])
+def add_playlist_albums_to_library(playlist_id):
+    if 'spotify_token' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    token = session['spotify_token']
+    user = _user_key()
+    client = get_spotify_client()
+    album_ids = []
+    items = iter_all_items(
+        client, 'playlists.tracks', token, path={'playlist_id': playlist_id},
+        params={'fields': 'items(track(album(id))),total'},
+        limit=100, max_workers=client.max_concurrency(Config.SPOTIFY_PAGINATION_WORKERS)
+    )
+    try:
+        for item in items:
+            album = (item.get('track') or {}).get('album')
+            if album and album.get('id'):
+                album_ids.append(album['id'])
+    except SpotifyPageError:
+        return render_template('htmx_add_result.html', message='Failed to fetch playlist tracks.')
+    finally:
+        items.close()
+    album_ids = list(dict.fromkeys(album_ids))
+    unsaved = _unsaved(user, token, 'albums', album_ids)
+    saved, failed = _save_to_library(user, token, 'albums', unsaved)
+    message = _bulk_save_message('albums', saved, failed, skipped=len(album_ids) - len(unsaved))
+    return render_template('htmx_add_result.html', message=message)
+
+METRICS_NETWORKS = [
+    ipaddress.ip_network(network.strip()) for network in Config.METRICS_ALLOWED_NETWORKS.split(',') if network.strip()
+]
+
+def _metrics_allowed():
+    """
+    Scrapes from METRICS_NETWORKS, like nginx's /nginx_status, or with the
+    METRICS_TOKEN bearer token. Requests nginx proxies for the public carry
+    X-Forwarded-For, so they don't count as local.
+    """
+    if Config.METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '')
+        if hmac.compare_digest(supplied.encode(), f'Bearer {Config.METRICS_TOKEN}'.encode()):
+            return True
+    if request.headers.get('X-Forwarded-For'):
+        return False
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in network for network in METRICS_NETWORKS)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not _metrics_allowed():
+        abort(404)
+    return metrics_registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/metrics/spotify')
+def spotify_client_stats():
+    """This worker's Spotify call timings per endpoint, with the keep-alive savings, and its most recent calls."""
+    if not _metrics_allowed():
+        abort(404)
+    return jsonify({
+        'pid': os.getpid(),
+        'clients': {
+            mode: {'endpoints': client.stats(), 'recent_calls': client.recent_calls()}
+            for mode, client in _spotify_clients().items()
+        },
+    })
+
 @app.route('/logout', methods=['GET', 'POST'])
 def logout():
+    if session.get('spotify_token_id'):
+        token_manager.revoke(session['spotify_token_id'])
+    if 'spotify_token' in session:
+        session_store.delete_user_values(_user_key())
     session.clear()
     return redirect(url_for('index'))
 
@@ -410,17 +1508,80 @@ def server_error(e):
         return render_template('_500_fragment.html', message=message), 500
     return render_template('500.html', message=message), 500
 
-if __name__ == '__main__':
-    # Use Config class values for consistency
-    app.debug = Config.DEBUG
-    
-    # Only enable the debug toolbar in development
+@app.errorhandler(SpotifyUnavailable)
+def spotify_unavailable(e):
+    logger.warning("Spotify unavailable: %s", e)
+    message = 'Spotify is not responding right now. Please try again in a moment.'
+    if request.headers.get('HX-Request') == 'true':
+        return render_template('_500_fragment.html', message=message), 503
+    return render_template('500.html', message=message), 503
+
+startup_profile.mark('module setup')
+
+_created = False
+
+def create_app(log_writer=True):
+    """
+    Finish setting up the app for serving and return it: start logging,
+    enable optional extensions and compile every template. Servers load
+    `app:create_app()`; under gunicorn's --preload this runs once in the
+    master, so forked workers start with the modules and compiled
+    templates already in (copy-on-write) memory. The master passes
+    `log_writer=False` so it never takes the log file from its workers.
+    Calling it again returns the same app.
+    """
+    global log_pipeline, _created
+    if _created:
+        return app
+    log_pipeline = LogPipeline(
+        Config.LOG_FILE,
+        Config.LOG_FORMAT,
+        max_bytes=Config.LOG_MAX_BYTES,
+        backup_count=Config.LOG_BACKUP_COUNT,
+        queue_size=Config.LOG_QUEUE_SIZE
+    )
+    logging.basicConfig(
+        level=getattr(logging, Config.LOG_LEVEL),
+        handlers=[log_pipeline.handler]
+    )
+    log_pipeline.start(writer=log_writer)
+    startup_profile.mark('logging')
+
     if Config.DEBUG:
-        app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+        # Only needed in development, so only imported there
         from flask_debugtoolbar import DebugToolbarExtension
-        toolbar = DebugToolbarExtension(app)
-    else:
-        app.config['DEBUG_TB_ENABLED'] = False
+        DebugToolbarExtension(app)
+    if Config.ASYNC_VIEWS:
+        # Swap the Spotify-bound views for their async versions
+        import async_views
+        async_views.install(app, sys.modules[__name__])
+    startup_profile.mark('extensions')
+
+    template_count = _compile_templates()
+    startup_profile.mark(f'compile templates ({template_count})')
+
+    _created = True
+    logger.info("Application starting with configuration: DEBUG=%s", Config.DEBUG)
+    logger.info("Startup took %s", startup_profile.summary())
+    return app
+
+def _compile_templates():
+    """Load every template into the Jinja cache; returns how many there are."""
+    env = app.jinja_env
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+@app.cli.command('startup-profile')
+def startup_profile_command():
+    """Show how long each phase of starting the app takes."""
+    create_app()
+    click.echo(startup_profile.report())
+
+if __name__ == '__main__':
+    create_app()
+    app.debug = Config.DEBUG
     
     # Set additional production configs when not in debug mode - use Config values
     if not Config.DEBUG:
@@ -430,4 +1591,3 @@ if __name__ == '__main__':
     
     # Use Config.PORT instead of direct environment variable access
     app.run(debug=Config.DEBUG, host='0.0.0.0', port=Config.PORT)
-
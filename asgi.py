@@ -0,0 +1,15 @@
+"""
+ASGI entry point for the async view mode:
+
+    ASYNC_VIEWS=true uvicorn asgi:asgi_app --workers 3
+
+Flask is still a WSGI app, so a2wsgi runs each request on a thread pool
+while the async views share the worker's pooled async Spotify client.
+"""
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import create_app
+
+asgi_app = WSGIMiddleware(create_app(), workers=int(os.getenv('ASGI_THREADS', 10)))
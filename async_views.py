@@ -0,0 +1,246 @@
+import asyncio
+import logging
+
+from flask import abort, jsonify, redirect, render_template, request, session, url_for
+
+import resilience
+
+logger = logging.getLogger(__name__)
+
+
+async def _settle(calls, timeout):
+    """
+    Await upstream calls concurrently, within `timeout` seconds. Returns
+    one result per call; calls that failed or didn't finish in time give
+    None, so the view degrades the same way the FanOut-based views do.
+    """
+    if not calls:
+        return []
+    tasks = [asyncio.ensure_future(call) for call in calls]
+    done, pending = await asyncio.wait(tasks, timeout=max(timeout, 0))
+    for task in pending:
+        task.cancel()
+    results = []
+    for task in tasks:
+        if task in pending:
+            logger.warning("Upstream call timed out")
+            results.append(None)
+        elif task.exception() is not None:
+            logger.warning("Upstream call failed: %s", task.exception())
+            results.append(None)
+        else:
+            results.append(task.result())
+    return results
+
+
+def _ok(resp):
+    return resp is not None and resp.status_code == 200
+
+
+def install(app, views):
+    """
+    Replace the Spotify-bound views of `app` with async versions. `views`
+    is the app module; its helpers, config and shared objects are reused so
+    both modes render identically.
+    """
+    Config = views.Config
+
+    def remaining():
+        # What's left of the request's deadline budget, started in before_request
+        left = resilience.remaining()
+        return Config.SPOTIFY_REQUEST_DEADLINE if left is None else left
+
+    async def dashboard():
+        if 'spotify_token' not in session:
+            return redirect(url_for('index'))
+
+        token = session['spotify_token']
+        client = views.get_async_spotify_client()
+        user = views._user_key()
+        album_offset = views._album_offset()
+        album_key = f'albums:{album_offset}'
+
+        async def load_albums():
+            resp = await client.get('user.albums', token, params={'limit': views.ALBUM_PAGE_LIMIT, 'offset': album_offset})
+            if not _ok(resp):
+                return None
+            data = resp.json()
+            total = data.get('total', 0)
+            next_offset, prev_offset = views._page_offsets(album_offset, views.ALBUM_PAGE_LIMIT, total)
+            return views._album_page(data.get('items'), album_offset, total, next_offset, prev_offset)
+
+        if request.headers.get('HX-Request') == 'true' and 'album_offset' in request.args:
+            album_page = views._cached_value(user, album_key)
+            if album_page is None:
+                album_page, = await _settle([load_albums()], remaining())
+                views._cache_value(user, album_key, album_page)
+            return render_template('_albums_fragment.html', **views._album_context(album_page))
+
+        async def load_profile():
+            resp = await client.get('user.profile', token)
+            return views._profile_summary(resp.json()) if _ok(resp) else None
+
+        async def load_playlists():
+            limit = 50
+            first = await client.get('user.playlists', token, params={'limit': limit, 'offset': 0})
+            if not _ok(first):
+                return None
+            data = first.json()
+            items = list(data.get('items') or [])
+            rest = [
+                client.get('user.playlists', token, params={'limit': limit, 'offset': offset})
+                for offset in range(limit, data.get('total') or 0, limit)
+            ]
+            for resp in await _settle(rest, remaining()):
+                if not _ok(resp):
+                    return None
+                items.extend(resp.json().get('items') or [])
+            return [views.as_dict(playlist) for playlist in views.parse_playlists({'items': items})]
+
+        # Whatever isn't cached is fetched together; playlist pages after
+        # the first are fetched concurrently once its total is known
+        keys = ('profile', 'playlists', album_key)
+        values = [views._cached_value(user, key) for key in keys]
+        loaders = (load_profile, load_playlists, load_albums)
+        missing = [i for i, value in enumerate(values) if value is None]
+        for i, value in zip(missing, await _settle([loaders[i]() for i in missing], remaining())):
+            values[i] = value
+        user_profile, playlists, album_page = values
+        if user_profile is not None and user_profile['id']:
+            session['spotify_user_id'] = user_profile['id']
+            user = user_profile['id']
+        for i in missing:
+            views._cache_value(user, keys[i], values[i])
+
+        playlists = [views.Playlist(**playlist) for playlist in playlists] if playlists is not None else None
+        return render_template(
+            'dashboard.html',
+            playlists=playlists,
+            descriptions=views._playlist_descriptions(playlists or []),
+            user_profile=user_profile,
+            **views._album_context(album_page)
+        )
+
+    async def playlist_detail(playlist_id):
+        if 'spotify_token' not in session:
+            return redirect(url_for('login'))
+        token = session['spotify_token']
+        client = views.get_async_spotify_client()
+        offset = views._request_offset()
+        limit = views.PLAYLIST_PAGE_LIMIT
+        tracks = []
+        total_tracks = 0
+        next_offset = None
+        prev_offset = None
+        saved_albums = {}
+        saved_tracks = {}
+
+        user = views._user_key()
+        cache = views.playlist_cache
+        if offset and request.headers.get('HX-Request') == 'true':
+            views.prefetcher.claim((user, playlist_id, offset))
+        resp, playlist = views._revalidate_from_cache(user, playlist_id, offset, limit)
+        if resp is not None:
+            next_offset, _ = views._page_offsets(offset, limit, playlist.total)
+            views._schedule_prefetch(resp, user, token, playlist, limit, next_offset)
+            return resp
+
+        async def load_tracks():
+            resp = await client.get(
+                'playlists.tracks', token, path={'playlist_id': playlist_id},
+                params={'fields': views.PLAYLIST_PAGE_FIELDS, 'offset': offset, 'limit': limit}
+            )
+            return views.parse_track_page(resp.json()) if _ok(resp) else None
+
+        # Reuses the shared playlist cache; unlike the sync view, misses
+        # aren't coalesced across requests.
+        playlist = cache.cached_playlist(user, playlist_id)
+        if playlist is not None:
+            track_data = cache.cached_tracks_page(user, playlist, offset, limit)
+            if track_data is None:
+                track_data, = await _settle([load_tracks()], remaining())
+                cache.store_tracks_page(user, playlist, offset, limit, track_data)
+        else:
+            playlist_resp, track_data = await _settle([
+                client.get(
+                    'playlists.get', token, path={'playlist_id': playlist_id},
+                    params={'fields': views.PLAYLIST_FIELDS}
+                ),
+                load_tracks(),
+            ], remaining())
+            if _ok(playlist_resp):
+                playlist = cache.store_playlist(user, playlist_id, views.parse_playlist(playlist_resp.json(), playlist_id))
+                cache.store_tracks_page(user, playlist, offset, limit, track_data)
+        if playlist is None:
+            abort(400, description="Failed to fetch playlist")
+        if track_data is not None:
+            tracks = track_data.tracks
+            total_tracks = playlist.total
+            next_offset, prev_offset = views._page_offsets(offset, limit, total_tracks)
+            unique_album_ids, track_ids = views._saved_state_ids(tracks)
+
+            saved_albums, missing_albums = views.library_index.lookup(user, 'albums', unique_album_ids)
+            saved_tracks, missing_tracks = views.library_index.lookup(user, 'tracks', track_ids)
+            album_batches = views._batches(missing_albums, views.LIBRARY_ID_LIMITS['albums'])
+            track_batches = views._batches(missing_tracks, views.LIBRARY_ID_LIMITS['tracks'])
+            checks = [
+                client.get('user.check_saved_albums', token, params={'ids': ','.join(batch)})
+                for batch in album_batches
+            ] + [
+                client.get('user.check_saved_tracks', token, params={'ids': ','.join(batch)})
+                for batch in track_batches
+            ]
+            results = await _settle(checks, remaining())
+            for kind, batches, responses, saved in (
+                ('albums', album_batches, results[:len(album_batches)], saved_albums),
+                ('tracks', track_batches, results[len(album_batches):], saved_tracks),
+            ):
+                checked = {}
+                for batch, check_resp in zip(batches, responses):
+                    if _ok(check_resp):
+                        checked.update(zip(batch, check_resp.json()))
+                views.library_index.record(user, kind, checked)
+                saved.update(checked)
+
+        resp = views._render_playlist_page(
+            playlist, tracks, offset, limit, total_tracks,
+            next_offset, prev_offset, saved_albums, saved_tracks
+        )
+        views._schedule_prefetch(resp, user, token, playlist, limit, next_offset)
+        return resp
+
+    async def add_playlist_to_library(playlist_id):
+        if 'spotify_token' not in session:
+            return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+        job_manager = views.job_manager
+        job = job_manager.submit_playlist_save(views._user_key(), playlist_id, session['spotify_token'])
+        job = await asyncio.to_thread(job_manager.wait, job.id, Config.JOB_SYNC_WAIT)
+        return views._render_job(job)
+
+    async def add_track_to_library(track_id):
+        if 'spotify_token' not in session:
+            return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+        client = views.get_async_spotify_client()
+        resp = await client.put('user.tracks', session['spotify_token'], json={'ids': [track_id]})
+        if resp.status_code in (200, 201):
+            views.library_index.mark_saved(views._user_key(), 'tracks', [track_id])
+            message = 'Added to your library!'
+        else:
+            message = 'Failed to add track.'
+        return render_template('htmx_add_result.html', message=message)
+
+    async def add_album_to_library(album_id):
+        if 'spotify_token' not in session:
+            return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+        client = views.get_async_spotify_client()
+        resp = await client.put('user.albums', session['spotify_token'], json={'ids': [album_id]})
+        if resp.status_code in (200, 201):
+            views.library_index.mark_saved(views._user_key(), 'albums', [album_id])
+            views._forget_saved_albums(views._user_key())
+            message = 'Album added to your library!'
+        else:
+            message = 'Failed to add album.'
+        return render_template('htmx_add_result.html', message=message)
+
+    for view in (dashboard, playlist_detail, add_playlist_to_library, add_track_to_library, add_album_to_library):
+        app.view_functions[view.__name__] = view
@@ -0,0 +1,113 @@
+"""
+Compare the default sync workers with the async view mode under
+concurrent load, against a latency-injecting fake Spotify server.
+
+Both servers run as real processes: gunicorn with sync workers, and
+uvicorn serving asgi:asgi_app with ASYNC_VIEWS=true. Each simulated user
+loads a playlist page repeatedly over its own keep-alive connection.
+
+    python benchmarks/bench_async.py --users 30 --requests 10 --latency 0.05
+"""
+import argparse
+import os
+import secrets
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from fake_spotify import FakeSpotify
+
+
+def session_cookie(env):
+    """A session cookie holding a fake access token, valid for servers started with `env`."""
+    os.environ.update(env)
+    import app as spotiplay
+    with spotiplay.app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['spotify_token'] = 'fake-access-token'
+        return client.get_cookie('session').value
+
+
+def start_server(command, env, port):
+    proc = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}/'
+    for _ in range(100):
+        try:
+            requests.get(url, timeout=2, allow_redirects=False)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f'server did not start: {" ".join(command)}')
+
+
+def load(port, cookie, users, count, playlist_id):
+    url = f'http://127.0.0.1:{port}/playlist/{playlist_id}'
+
+    def user():
+        timings = []
+        with requests.Session() as http:
+            http.cookies.set('session', cookie)
+            for _ in range(count):
+                start = time.perf_counter()
+                resp = http.get(url)
+                timings.append(time.perf_counter() - start)
+                assert resp.status_code == 200, resp.status_code
+        return timings
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        timings = [t for result in pool.map(lambda _: user(), range(users)) for t in result]
+    return timings, time.perf_counter() - start
+
+
+def summarize(label, timings, elapsed):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f'{label:<28} {len(timings) / elapsed:7.1f} req/s  '
+          f'p50 {statistics.median(timings) * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.05, help='injected upstream latency in seconds')
+    parser.add_argument('--users', type=int, default=30, help='concurrent simulated users')
+    parser.add_argument('--requests', type=int, default=10, help='page loads per user')
+    parser.add_argument('--workers', type=int, default=3, help='server worker processes')
+    parser.add_argument('--port', type=int, default=5101)
+    args = parser.parse_args()
+
+    with FakeSpotify(latency=args.latency) as fake:
+        env = dict(os.environ, **fake.env())
+        env.update({
+            'SPOTIFY_CLIENT_ID': 'bench', 'SPOTIFY_CLIENT_SECRET': 'bench',
+            'SECRET_KEY': secrets.token_hex(24), 'LOG_LEVEL': 'WARNING',
+            # Don't let the shared rate limiter shape the comparison
+            'SPOTIFY_RATE_LIMIT': '0', 'DATA_DIR': os.path.join(ROOT, 'data', 'bench'),
+        })
+        cookie = session_cookie(env)
+        servers = [
+            ('sync (gunicorn)', ['gunicorn', '-k', 'sync', '-w', str(args.workers), '-b', f'127.0.0.1:{args.port}', 'app:create_app()'], {}),
+            ('async (uvicorn + httpx)', ['uvicorn', 'asgi:asgi_app', '--workers', str(args.workers),
+                                         '--port', str(args.port + 1), '--log-level', 'warning'], {'ASYNC_VIEWS': 'true'}),
+        ]
+        for offset, (label, command, extra_env) in enumerate(servers):
+            port = args.port + offset
+            proc = start_server(command, dict(env, **extra_env), port)
+            try:
+                load(port, cookie, args.workers, 1, 'pl-200')  # warm connections
+                summarize(label, *load(port, cookie, args.users, args.requests, 'pl-200'))
+            finally:
+                proc.terminate()
+                proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Compare payload size, decode time and retained memory for playlist track
+pages: full Spotify track objects decoded with json.loads, the same pages
+trimmed to PLAYLIST_PAGE_FIELDS, and the trimmed pages parsed into
+models records.
+
+    python benchmarks/bench_models.py --tracks 10000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from fake_spotify import parse_fields, project
+from models import PLAYLIST_PAGE_FIELDS, parse_track_page
+
+# Roughly what Spotify returns for a track available everywhere
+MARKETS = [f'{chr(65 + i // 26)}{chr(65 + i % 26)}' for i in range(180)]
+
+
+def full_track(index):
+    album_index = index // 12
+    artist = {
+        'external_urls': {'spotify': f'https://open.spotify.com/artist/ar{index % 97}'},
+        'href': f'https://api.spotify.com/v1/artists/ar{index % 97}',
+        'id': f'ar{index % 97}',
+        'name': f'Artist {index % 97}',
+        'type': 'artist',
+        'uri': f'spotify:artist:ar{index % 97}',
+    }
+    return {
+        'added_at': '2024-01-01T00:00:00Z',
+        'added_by': {'id': 'owner', 'type': 'user', 'uri': 'spotify:user:owner'},
+        'is_local': False,
+        'primary_color': None,
+        'video_thumbnail': {'url': None},
+        'track': {
+            'album': {
+                'album_type': 'album',
+                'artists': [artist],
+                'available_markets': MARKETS,
+                'external_urls': {'spotify': f'https://open.spotify.com/album/al{album_index}'},
+                'href': f'https://api.spotify.com/v1/albums/al{album_index}',
+                'id': f'al{album_index}',
+                'images': [
+                    {'height': size, 'width': size, 'url': f'https://i.scdn.co/image/al{album_index}-{size}'}
+                    for size in (640, 300, 64)
+                ],
+                'name': f'Album {album_index}',
+                'release_date': '2020-01-01',
+                'release_date_precision': 'day',
+                'total_tracks': 12,
+                'type': 'album',
+                'uri': f'spotify:album:al{album_index}',
+            },
+            'artists': [artist],
+            'available_markets': MARKETS,
+            'disc_number': 1,
+            'duration_ms': 200000 + index,
+            'explicit': False,
+            'external_ids': {'isrc': f'USRC1{index:07d}'},
+            'external_urls': {'spotify': f'https://open.spotify.com/track/t{index}'},
+            'href': f'https://api.spotify.com/v1/tracks/t{index}',
+            'id': f't{index}',
+            'is_local': False,
+            'name': f'Track {index}',
+            'popularity': index % 100,
+            'preview_url': None,
+            'track_number': index % 12 + 1,
+            'type': 'track',
+            'uri': f'spotify:track:t{index}',
+        },
+    }
+
+
+def measure(label, build, repeat):
+    """Best of `repeat` timings of `build()`, then one run under tracemalloc to see what its result holds on to."""
+    elapsed = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = build()
+        elapsed = min(elapsed, time.perf_counter() - start)
+        del result
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:<28} {elapsed * 1000:8.1f}ms  retained {retained / 1024 / 1024:7.2f}MB')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per variant (best is reported)')
+    args = parser.parse_args()
+
+    fields = parse_fields(PLAYLIST_PAGE_FIELDS)
+    full_pages, lean_pages = [], []
+    for offset in range(0, args.tracks, args.page_size):
+        page = {
+            'items': [full_track(i) for i in range(offset, min(offset + args.page_size, args.tracks))],
+            'total': args.tracks,
+            'href': 'https://api.spotify.com/v1/playlists/pl/tracks',
+            'limit': args.page_size,
+            'next': None,
+            'offset': offset,
+            'previous': None,
+        }
+        full_pages.append(json.dumps(page).encode())
+        lean_pages.append(json.dumps(project(page, fields)).encode())
+
+    full_bytes = sum(map(len, full_pages))
+    lean_bytes = sum(map(len, lean_pages))
+    print(f'{args.tracks} tracks in {len(full_pages)} pages of {args.page_size}')
+    print(f'payload: full {full_bytes / 1024 / 1024:.2f}MB, projected {lean_bytes / 1024 / 1024:.2f}MB '
+          f'({(1 - lean_bytes / full_bytes) * 100:.1f}% smaller)')
+
+    full = measure('json.loads full', lambda: [json.loads(body) for body in full_pages], args.repeat)
+    del full
+    lean = measure('json.loads projected', lambda: [json.loads(body) for body in lean_pages], args.repeat)
+    del lean
+    records = measure('projected -> records', lambda: [parse_track_page(json.loads(body)) for body in lean_pages], args.repeat)
+    assert sum(len(page.tracks) for page in records) == args.tracks
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark playlist_detail page time against a latency-injecting fake
+Spotify server, comparing sequential upstream calls (one fan-out worker)
+with the concurrent fan-out. Every timed request starts with the shared
+playlist, saved-library and fragment caches empty and walks to the next
+page of the playlist, so each one makes its full set of upstream calls.
+
+    python benchmarks/bench_playlist_detail.py --latency 0.05 --requests 30
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from fake_spotify import FakeSpotify
+
+
+def forget_everything(spotiplay):
+    """Empty the caches a repeat view would be served from."""
+    spotiplay.playlist_cache.clear()
+    spotiplay.fragment_cache.clear()
+    spotiplay.library_index.clear()
+
+
+def run(spotiplay, workers, playlist_id, tracks, count, htmx):
+    spotiplay.Config.SPOTIFY_FANOUT_WORKERS = workers
+    headers = {'HX-Request': 'true'} if htmx else {}
+    pages = max(1, -(-tracks // 50))
+    timings = []
+    with spotiplay.app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['spotify_token'] = 'fake-access-token'
+        client.get(f'/playlist/{playlist_id}', headers=headers)  # warm connections
+        for i in range(count):
+            forget_everything(spotiplay)
+            offset = i % pages * 50
+            start = time.perf_counter()
+            resp = client.get(f'/playlist/{playlist_id}?offset={offset}', headers=headers)
+            timings.append(time.perf_counter() - start)
+            assert resp.status_code == 200, resp.status_code
+    return timings
+
+
+def summarize(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f'{label:<24} mean {statistics.mean(timings) * 1000:7.1f}ms  '
+          f'p50 {statistics.median(timings) * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms')
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.05, help='injected upstream latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=4, help='fan-out workers for the concurrent run')
+    parser.add_argument('--htmx', action='store_true', help='request the tracks fragment instead of the full page')
+    args = parser.parse_args()
+
+    with FakeSpotify(latency=args.latency, jitter=args.jitter) as fake, tempfile.TemporaryDirectory(prefix='spotiplay-bench-') as state_dir:
+        os.environ.update(fake.env())
+        os.environ.setdefault('SPOTIFY_CLIENT_ID', 'bench')
+        os.environ.setdefault('SPOTIFY_CLIENT_SECRET', 'bench')
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        # Nothing but the page under test should talk to the fake API
+        os.environ.update({
+            'DATA_DIR': state_dir, 'LOG_DIR': state_dir, 'SPOTIFY_RATE_LIMIT': '0', 'PREFETCH_ENABLED': 'false',
+        })
+        import app as spotiplay
+
+        spotiplay.create_app()
+        spotiplay.app.config['TESTING'] = True
+        tracks = fake.playlist_size_for('pl-500')
+        sequential = summarize('sequential (1 worker)', run(spotiplay, 1, 'pl-500', tracks, args.requests, args.htmx))
+        concurrent = summarize(f'fan-out ({args.workers} workers)', run(spotiplay, args.workers, 'pl-500', tracks, args.requests, args.htmx))
+        print(f'page-time reduction: {(1 - concurrent / sequential) * 100:.1f}%')
+
+
+if __name__ == '__main__':
+    main()
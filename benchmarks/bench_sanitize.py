@@ -0,0 +1,97 @@
+"""
+CPU spent sanitizing playlist descriptions per request: the old
+bleach.clean() call on every page view, a reused precompiled Cleaner,
+and DescriptionSanitizer's cache, for one playlist page and for a
+dashboard of playlist cards.
+
+    python benchmarks/bench_sanitize.py --playlists 60
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import bleach
+
+from sanitize import ALLOWED_ATTRIBUTES, ALLOWED_PROTOCOLS, ALLOWED_TAGS, DescriptionSanitizer
+
+
+def description(index):
+    """Roughly what Spotify sends: escaped text with a couple of links."""
+    return (
+        f'Fresh picks for week {index}, updated every Friday. Featuring '
+        f'<a href="spotify:artist:ar{index}">Artist {index}</a> and '
+        f'<a href="https://example.com/artists/{index}">friends</a> &amp; more. '
+        f'Tickets: https://example.com/tour/{index} &#x2F; cover art by @studio{index}'
+    )
+
+
+def per_call(fn, repeat, number):
+    """Best of `repeat` runs of `number` calls to `fn`, in microseconds per call."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--playlists', type=int, default=60, help='playlist cards on the dashboard')
+    parser.add_argument('--number', type=int, default=200, help='requests per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per variant (best is reported)')
+    args = parser.parse_args()
+
+    texts = [description(i) for i in range(args.playlists)]
+    one = texts[0]
+
+    def old_clean(text):
+        return bleach.clean(
+            text, tags=['a'], attributes={'a': ['href', 'rel', 'target']}, protocols=['http', 'https'], strip=True
+        )
+
+    cleaner = bleach.sanitizer.Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, protocols=ALLOWED_PROTOCOLS, strip=True)
+    cold = DescriptionSanitizer()
+    warm = DescriptionSanitizer()
+    warm.sanitize_many(texts)
+    dashboard_number = max(1, args.number // args.playlists)
+
+    def cold_page():
+        cold.clear()
+        cold.sanitize(one)
+
+    def cold_dashboard():
+        cold.clear()
+        cold.sanitize_many(texts)
+
+    variants = [
+        ('playlist page', [
+            ('bleach.clean per request', lambda: old_clean(one), args.number),
+            ('reused Cleaner', lambda: cleaner.clean(one), args.number),
+            ('sanitizer, cold (linkify)', cold_page, args.number),
+            ('sanitizer, cached', lambda: warm.sanitize(one), args.number * 50),
+        ]),
+        (f'dashboard ({args.playlists} playlists)', [
+            ('bleach.clean per playlist', lambda: [old_clean(text) for text in texts], dashboard_number),
+            ('reused Cleaner', lambda: [cleaner.clean(text) for text in texts], dashboard_number),
+            ('sanitize_many, cold', cold_dashboard, dashboard_number),
+            ('sanitize_many, cached', lambda: warm.sanitize_many(texts), args.number),
+        ]),
+    ]
+    for heading, rows in variants:
+        print(heading)
+        baseline = None
+        for label, fn, number in rows:
+            fn()
+            micros = per_call(fn, args.repeat, number)
+            baseline = baseline or micros
+            print(f'  {label:<28} {micros:10.1f}us/request  ({baseline / micros:6.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Compare gunicorn worker classes (sync, gthread, gevent) under the same
+load, against the fake Spotify API.
+
+Each class runs with gunicorn.conf.py and the same number of worker
+processes, differing only in GUNICORN_WORKER_CLASS. Users log in and
+drive the load_test.py route mix; the table shows throughput and tail
+latency per class. gevent is skipped unless it's installed
+(requirements/gevent.txt). The shared Spotify rate limiter is off so it
+doesn't cap every class at the same rate.
+
+    python benchmarks/bench_workers.py --users 40 --duration 20
+    python benchmarks/bench_workers.py --classes sync,gthread --threads 16 --latency 0.2
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from fake_spotify import FakeSpotify
+from load_test import DEFAULT_MIX, parse_mix, run_load, start_server, summarize
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+
+
+def run_class(worker_class, args, mix, fake):
+    base_url = f'http://127.0.0.1:{args.port}'
+    command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'), '--bind', f'127.0.0.1:{args.port}']
+    with tempfile.TemporaryDirectory(prefix='spotiplay-workers-') as state_dir:
+        env = dict(os.environ, **fake.env())
+        env.update({
+            'GUNICORN_WORKER_CLASS': worker_class,
+            'GUNICORN_WORKERS': str(args.workers),
+            'GUNICORN_THREADS': str(args.threads),
+            'GUNICORN_WORKER_CONNECTIONS': str(args.connections),
+            'SPOTIFY_CLIENT_ID': 'bench', 'SPOTIFY_CLIENT_SECRET': 'bench',
+            'SPOTIFY_REDIRECT_URI': f'{base_url}/callback',
+            'SECRET_KEY': os.urandom(24).hex(), 'LOG_LEVEL': 'WARNING',
+            'SPOTIFY_RATE_LIMIT': '0',
+            'DATA_DIR': os.path.join(state_dir, 'data'), 'LOG_DIR': os.path.join(state_dir, 'logs'),
+        })
+        env.update(item.split('=', 1) for item in args.env)
+        proc = start_server(command, env, f'{base_url}/')
+        try:
+            samples, elapsed = run_load(base_url, args, mix)
+        finally:
+            proc.terminate()
+            proc.wait()
+    return summarize(samples, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--classes', default=','.join(WORKER_CLASSES), help='worker classes to compare, comma-separated')
+    parser.add_argument('--workers', type=int, default=3, help='worker processes for every class')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gthread worker')
+    parser.add_argument('--connections', type=int, default=100, help='connections per gevent worker')
+    parser.add_argument('--users', type=int, default=30, help='concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=15, help='seconds of measured load per class')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed playlist loads per user before the clock starts')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'route weights (default {DEFAULT_MIX})')
+    parser.add_argument('--playlist', default='pl-500', help='playlist ID; pl-<n> has n tracks')
+    parser.add_argument('--latency', type=float, default=0.1, help='injected upstream latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.05, help='extra random upstream latency, up to this many seconds')
+    parser.add_argument('--port', type=int, default=5301)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='extra environment for the app (repeatable)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results JSON here')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    classes = [name.strip() for name in args.classes.split(',') if name.strip()]
+    unknown = set(classes) - set(WORKER_CLASSES)
+    if unknown:
+        raise SystemExit(f'unknown worker classes: {", ".join(sorted(unknown))}')
+    if 'gevent' in classes and importlib.util.find_spec('gevent') is None:
+        print('gevent is not installed (pip install -r requirements/gevent.txt); skipping it')
+        classes.remove('gevent')
+
+    results = {}
+    print(f'{args.workers} workers, {args.users} users, {args.duration:.0f}s each, '
+          f'{args.latency * 1000:.0f}ms upstream latency, playlist {args.playlist}')
+    print(f"{'class':<10} {'reqs':>7} {'err':>5} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for worker_class in classes:
+        fake = FakeSpotify(latency=args.latency, jitter=args.jitter, seed=args.seed)
+        args.playlist_tracks = fake.playlist_size_for(args.playlist)
+        args.page_size = 50
+        with fake:
+            routes, overall = run_class(worker_class, args, mix, fake)
+        results[worker_class] = {'routes': routes, 'overall': overall, 'upstream': fake.stats()}
+        print(f"{worker_class:<10} {overall['requests']:>7} {overall['errors']:>5} {overall['rps']:>8.1f} "
+              f"{overall['p50_ms']:>7.1f}ms {overall['p95_ms']:>7.1f}ms {overall['p99_ms']:>7.1f}ms {overall['max_ms']:>7.1f}ms")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'args': {key: value for key, value in vars(args).items() if key != 'env'}, 'results': results}, f, indent=2)
+        print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Local stand-in for the Spotify Web API with injected latency.
+
+Covers every URL in app.SPOTIFY_API, including the authorize redirect, so
+the real login flow works against it. Playlist IDs of the form `pl-<n>`
+contain `n` synthetic tracks (up to MAX_PLAYLIST_SIZE); any other ID gets
+the default playlist size. A fraction of API calls can be answered with
+429 and a Retry-After header. `fields` projections are applied the way
+Spotify applies them, so payload sizes match production. Saved state and
+throttling are seeded, so runs are comparable.
+"""
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+MAX_PLAYLIST_SIZE = 50000
+
+
+def _is_saved(item_id):
+    return zlib.crc32(item_id.encode()) % 3 == 0
+
+
+def parse_fields(spec):
+    """Parse a Spotify `fields` string such as 'items(track(id,name)),total' into a nested dict."""
+    fields, stack, name = {}, [], ''
+    current = fields
+    for char in spec + ',':
+        if char in ',()':
+            if name:
+                current[name] = {}
+            if char == '(':
+                stack.append(current)
+                current = current[name]
+            elif char == ')':
+                current = stack.pop()
+            name = ''
+        else:
+            name += char
+    return fields
+
+
+def project(value, fields):
+    """Apply parsed fields the way Spotify does: keep only the named keys, recursing into lists."""
+    if not fields:
+        return value
+    if isinstance(value, list):
+        return [project(item, fields) for item in value]
+    if isinstance(value, dict):
+        return {key: project(value[key], sub) for key, sub in fields.items() if key in value}
+    return value
+
+
+class FakeSpotify:
+    def __init__(self, latency=0.05, jitter=0.0, playlist_size=200, throttle_rate=0.0, retry_after=1,
+                 seed=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.playlist_size = playlist_size
+        # Fraction of API calls answered with 429, and the Retry-After they carry
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self):
+        return f'{self.base_url}/v1'
+
+    @property
+    def accounts_url(self):
+        return self.base_url
+
+    def env(self):
+        """Environment variables that point app.py at this server."""
+        return {'SPOTIFY_API_URL': self.api_url, 'SPOTIFY_ACCOUNTS_URL': self.accounts_url}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        return {'requests': self.requests, 'throttled': self.throttled}
+
+    def playlist_size_for(self, playlist_id):
+        match = re.fullmatch(r'pl-(\d+)', playlist_id)
+        return min(int(match.group(1)), MAX_PLAYLIST_SIZE) if match else self.playlist_size
+
+    def track(self, playlist_id, index):
+        album_index = index // 2
+        return {
+            'id': f'{playlist_id}-t{index}',
+            'name': f'Track {index}',
+            'artists': [{'id': f'ar{index % 97}', 'name': f'Artist {index % 97}'}],
+            'album': {
+                'id': f'{playlist_id}-al{album_index}',
+                'name': f'Album {album_index}',
+                'images': [{'url': f'https://i.scdn.co/image/{album_index}', 'height': 640, 'width': 640}],
+            },
+            'external_urls': {'spotify': f'https://open.spotify.com/track/{playlist_id}-t{index}'},
+        }
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload=None, headers=None):
+                if self.fields and status == 200:
+                    payload = project(payload, self.fields)
+                body = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _delay(self):
+                """Count and delay the request; True if it should be answered with a 429."""
+                self.fields = None
+                with fake._lock:
+                    fake.requests += 1
+                    delay = fake.latency + fake._random.uniform(0, fake.jitter)
+                    throttle = self.path.startswith('/v1/') and fake._random.random() < fake.throttle_rate
+                    if throttle:
+                        fake.throttled += 1
+                time.sleep(delay)
+                if throttle:
+                    self._send(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                               headers={'Retry-After': str(fake.retry_after)})
+                return throttle
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def do_POST(self):
+                self._read_body()
+                self._delay()
+                if urlparse(self.path).path == '/api/token':
+                    return self._send(200, {
+                        'access_token': 'fake-access-token',
+                        'token_type': 'Bearer',
+                        'expires_in': 3600,
+                        'refresh_token': 'fake-refresh-token',
+                    })
+                self._send(404, {'error': 'not found'})
+
+            def do_PUT(self):
+                self._read_body()
+                if self._delay():
+                    return
+                if urlparse(self.path).path in ('/v1/me/tracks', '/v1/me/albums'):
+                    return self._send(200)
+                self._send(404, {'error': 'not found'})
+
+            def do_GET(self):
+                if self._delay():
+                    return
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if 'fields' in query:
+                    self.fields = parse_fields(query['fields'][0])
+                offset = int(query.get('offset', ['0'])[0])
+                limit = int(query.get('limit', ['20'])[0])
+                path = url.path
+                if path == '/authorize':
+                    # Consent is implied: straight back to the app with a code
+                    params = {'code': 'fake-code'}
+                    if 'state' in query:
+                        params['state'] = query['state'][0]
+                    self.send_response(302)
+                    self.send_header('Location', f"{query['redirect_uri'][0]}?{urlencode(params)}")
+                    self.send_header('Content-Length', '0')
+                    return self.end_headers()
+                if path == '/v1/me':
+                    return self._send(200, {'id': 'benchuser', 'display_name': 'Bench User', 'images': []})
+                if path in ('/v1/me/tracks/contains', '/v1/me/albums/contains'):
+                    ids = query.get('ids', [''])[0].split(',')
+                    return self._send(200, [_is_saved(item_id) for item_id in ids if item_id])
+                if path == '/v1/me/playlists':
+                    total = 60
+                    items = [
+                        {'id': f'pl-{50 * (i + 1)}', 'name': f'Playlist {i}', 'images': [],
+                         'description': f'Playlist <a href="https://example.com/{i}">{i}</a>',
+                         'snapshot_id': 'snap-1', 'tracks': {'total': 50 * (i + 1)}}
+                        for i in range(offset, min(offset + limit, total))
+                    ]
+                    return self._send(200, {'items': items, 'total': total, 'offset': offset, 'limit': limit})
+                if path == '/v1/me/albums':
+                    total = 120
+                    items = [
+                        {'album': {'id': f'saved-al{i}', 'name': f'Saved Album {i}', 'images': [],
+                                   'artists': [{'name': f'Artist {i}'}]}}
+                        for i in range(offset, min(offset + limit, total))
+                    ]
+                    return self._send(200, {'items': items, 'total': total, 'offset': offset, 'limit': limit})
+                if path == '/v1/me/tracks':
+                    total = 500
+                    items = [{'track': fake.track('saved', i)} for i in range(offset, min(offset + limit, total))]
+                    return self._send(200, {'items': items, 'total': total, 'offset': offset, 'limit': limit})
+                match = re.fullmatch(r'/v1/playlists/([^/]+)(/tracks)?', path)
+                if match:
+                    playlist_id, tracks = match.group(1), match.group(2)
+                    total = fake.playlist_size_for(playlist_id)
+                    if not tracks:
+                        return self._send(200, {
+                            'id': playlist_id,
+                            'name': f'Playlist {playlist_id}',
+                            'description': 'Synthetic playlist with a <a href="https://example.com">link</a>',
+                            'images': [],
+                            'owner': {'display_name': 'Bench User'},
+                            'public': True,
+                            'snapshot_id': 'snap-1',
+                            'tracks': {'total': total},
+                        })
+                    end = min(offset + limit, total)
+                    items = [{'track': fake.track(playlist_id, i)} for i in range(offset, end)]
+                    next_url = None
+                    if end < total:
+                        next_url = f'{fake.api_url}/playlists/{playlist_id}/tracks?offset={end}&limit={limit}'
+                        if 'fields' in query:
+                            next_url += f"&fields={query['fields'][0]}"
+                    return self._send(200, {'items': items, 'total': total, 'offset': offset, 'limit': limit, 'next': next_url})
+                self._send(404, {'error': 'not found'})
+
+        return Handler
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--playlist-size', type=int, default=200, help='tracks in playlists not named pl-<n>')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of API calls answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with each 429')
+    args = parser.parse_args()
+    fake = FakeSpotify(latency=args.latency, jitter=args.jitter, playlist_size=args.playlist_size,
+                       throttle_rate=args.throttle_rate, retry_after=args.retry_after, port=args.port)
+    print(f'Fake Spotify API on {fake.base_url} (SPOTIFY_API_URL={fake.api_url})')
+    fake.server.serve_forever()
@@ -0,0 +1,362 @@
+"""
+Load-test the main routes under the production gunicorn command, against
+the fake Spotify API, and report throughput and tail latency per route.
+
+The gunicorn arguments come from the ExecStart line in spotiplay.service
+(only --bind is replaced), so the run uses the same worker setup as
+production. Each simulated user logs in through the real OAuth flow, then
+loops over a weighted mix of requests:
+
+    dashboard            GET  /dashboard
+    playlist             GET  /playlist/<id>
+    playlist_fragment    GET  /playlist/<id>?offset=N with HX-Request (htmx paging)
+    add_playlist         POST /add_playlist_to_library/<id>
+
+Results are written as JSON. Pass --baseline to compare against an
+earlier run (exits non-zero when a route's p95 regressed by more than
+--max-regression), or --compare OLD NEW to compare two saved runs
+without load testing.
+
+    python benchmarks/load_test.py --users 20 --duration 30 --output results/before.json
+    python benchmarks/load_test.py --users 20 --duration 30 --baseline results/before.json
+    python benchmarks/load_test.py --users 20 --throttle-rate 0.05 --playlist pl-50000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from fake_spotify import FakeSpotify
+
+DEFAULT_MIX = 'dashboard=2,playlist=3,playlist_fragment=4,add_playlist=1'
+CSRF_PATTERN = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+
+def gunicorn_command(service_file, port):
+    """The gunicorn argv from a systemd unit's ExecStart, bound to a local port."""
+    with open(service_file) as f:
+        exec_start = next(line.split('=', 1)[1] for line in f if line.startswith('ExecStart='))
+    argv = shlex.split(exec_start)
+    argv = argv[next(i for i, arg in enumerate(argv) if os.path.basename(arg) == 'gunicorn') + 1:]
+    args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in ('-b', '--bind'):
+            skip = True
+        elif not arg.startswith('--bind='):
+            args.append(arg)
+    return [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', *args]
+
+
+def start_server(command, env, url):
+    proc = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(150):
+        if proc.poll() is not None:
+            break
+        try:
+            requests.get(url, timeout=2, allow_redirects=False)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f'server did not start: {" ".join(command)}')
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(ROUTES)
+    if unknown:
+        raise SystemExit(f'unknown routes in --mix: {", ".join(sorted(unknown))}')
+    return mix
+
+
+class User:
+    """
+    One simulated browser. The session cookie is Secure in production
+    config, which requests won't send over plain HTTP, so it's carried by
+    hand instead of through a cookie jar.
+    """
+
+    def __init__(self, base_url, playlist_id, page_size, total_tracks):
+        self.base_url = base_url
+        self.playlist_id = playlist_id
+        self.page_size = page_size
+        self.total_tracks = total_tracks
+        self.http = requests.Session()
+        self.cookie = None
+        self.csrf_token = None
+        self.random = random.Random()
+
+    def request(self, method, path, headers=None, **kwargs):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = f'session={self.cookie}'
+        url = path if path.startswith('http') else f'{self.base_url}{path}'
+        resp = self.http.request(method, url, headers=headers, allow_redirects=False, timeout=60, **kwargs)
+        if 'session' in resp.cookies:
+            self.cookie = resp.cookies['session']
+        return resp
+
+    def login(self):
+        """/login -> fake authorize -> /callback, then pick up a CSRF token."""
+        resp = self.request('GET', '/login')
+        for _ in range(3):
+            if resp.status_code != 302:
+                break
+            resp = self.request('GET', resp.headers['Location'])
+        if self.cookie is None:
+            raise RuntimeError(f'login failed: {resp.status_code}')
+        self.request_csrf()
+
+    def request_csrf(self):
+        resp = self.request('GET', f'/playlist/{self.playlist_id}')
+        match = CSRF_PATTERN.search(resp.text)
+        if match is None:
+            raise RuntimeError(f'no CSRF token on the playlist page ({resp.status_code})')
+        self.csrf_token = match.group(1)
+
+    def dashboard(self):
+        return self.request('GET', '/dashboard')
+
+    def playlist(self):
+        return self.request('GET', f'/playlist/{self.playlist_id}')
+
+    def playlist_fragment(self):
+        pages = max(1, -(-self.total_tracks // self.page_size))
+        offset = self.random.randrange(1, pages) * self.page_size if pages > 1 else 0
+        return self.request('GET', f'/playlist/{self.playlist_id}?offset={offset}', headers={'HX-Request': 'true'})
+
+    def add_playlist(self):
+        return self.request(
+            'POST', f'/add_playlist_to_library/{self.playlist_id}',
+            headers={'HX-Request': 'true', 'X-CSRFToken': self.csrf_token}
+        )
+
+
+ROUTES = {
+    'dashboard': User.dashboard,
+    'playlist': User.playlist,
+    'playlist_fragment': User.playlist_fragment,
+    'add_playlist': User.add_playlist,
+}
+
+
+def run_load(base_url, args, mix):
+    """Drive `args.users` users for `args.duration` seconds; returns {route: [(seconds, status), ...]} and wall time."""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    clock = {}
+
+    def start_clock():
+        clock['start'] = time.perf_counter()
+        clock['deadline'] = clock['start'] + args.duration
+
+    # Users log in and warm up first; the clock starts once all are ready
+    ready = threading.Barrier(args.users, action=start_clock)
+
+    def user(index):
+        client = User(base_url, args.playlist, args.page_size, args.playlist_tracks)
+        client.random.seed(args.seed + index)
+        try:
+            client.login()
+            for _ in range(args.warmup):
+                client.playlist()
+        except Exception:
+            ready.abort()
+            raise
+        ready.wait()
+        while time.perf_counter() < clock['deadline']:
+            name = client.random.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = ROUTES[name](client).status_code
+            except requests.RequestException:
+                status = 0
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[name].append((elapsed, status))
+
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        for future in [pool.submit(user, index) for index in range(args.users)]:
+            future.result()
+    return samples, time.perf_counter() - clock['start']
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples, elapsed):
+    def stats(entries):
+        timings = sorted(seconds for seconds, _ in entries)
+        statuses = {}
+        for _, status in entries:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        ms = lambda value: round(value * 1000, 2) if value is not None else None
+        return {
+            'requests': len(entries),
+            'errors': sum(1 for _, status in entries if not 200 <= status < 400),
+            'rps': round(len(entries) / elapsed, 2),
+            'p50_ms': ms(percentile(timings, 50)),
+            'p95_ms': ms(percentile(timings, 95)),
+            'p99_ms': ms(percentile(timings, 99)),
+            'max_ms': ms(timings[-1] if timings else None),
+            'statuses': statuses,
+        }
+
+    routes = {name: stats(entries) for name, entries in samples.items()}
+    overall = stats([entry for entries in samples.values() for entry in entries])
+    return routes, overall
+
+
+def print_report(result):
+    print(f"{'route':<20} {'reqs':>7} {'err':>5} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, row in [*result['routes'].items(), ('overall', result['overall'])]:
+        if not row['requests']:
+            continue
+        print(f"{name:<20} {row['requests']:>7} {row['errors']:>5} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>7.1f}ms {row['p95_ms']:>7.1f}ms {row['p99_ms']:>7.1f}ms")
+    upstream = result.get('upstream')
+    if upstream:
+        print(f"upstream: {upstream['requests']} calls, {upstream['throttled']} answered with 429")
+
+
+def compare(old, new, max_regression):
+    """Print per-route deltas; returns the routes whose p95 regressed beyond `max_regression`."""
+    regressions = []
+    print(f"{'route':<20} {'req/s':>18} {'p50':>22} {'p95':>22} {'p99':>22}")
+    rows = [(name, old['routes'].get(name), row) for name, row in new['routes'].items()]
+    rows.append(('overall', old['overall'], new['overall']))
+    for name, before, after in rows:
+        if not before or not before['requests'] or not after['requests']:
+            continue
+
+        def delta(key):
+            change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            return f'{before[key]:.1f} -> {after[key]:.1f} ({change:+.0f}%)'
+
+        print(f"{name:<20} {delta('rps'):>18} {delta('p50_ms'):>22} {delta('p95_ms'):>22} {delta('p99_ms'):>22}")
+        if name != 'overall' and after['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+            regressions.append(name)
+    if regressions:
+        print(f"p95 regressed by more than {max_regression * 100:.0f}%: {', '.join(regressions)}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20, help='concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of measured load')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed playlist loads per user before the clock starts')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'route weights (default {DEFAULT_MIX})')
+    parser.add_argument('--playlist', default='pl-2000', help='playlist ID; pl-<n> has n tracks (up to 50000)')
+    parser.add_argument('--latency', type=float, default=0.05, help='injected upstream latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02, help='extra random upstream latency, up to this many seconds')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of upstream calls answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with each 429')
+    parser.add_argument('--service', default=os.path.join(ROOT, 'spotiplay.service'), help='systemd unit to take the gunicorn command from')
+    parser.add_argument('--port', type=int, default=5201)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='extra environment for the app (repeatable)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.10, help='allowed p95 increase per route (0.10 = 10%%)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two results files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            sys.exit(1 if compare(json.load(f_old), json.load(f_new), args.max_regression) else 0)
+
+    mix = parse_mix(args.mix)
+    base_url = f'http://127.0.0.1:{args.port}'
+    fake = FakeSpotify(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                       retry_after=args.retry_after, seed=args.seed)
+    args.playlist_tracks = fake.playlist_size_for(args.playlist)
+    args.page_size = 50
+    command = gunicorn_command(args.service, args.port)
+
+    with fake, tempfile.TemporaryDirectory(prefix='spotiplay-load-') as state_dir:
+        env = dict(os.environ, **fake.env())
+        env.update({
+            'SPOTIFY_CLIENT_ID': 'bench', 'SPOTIFY_CLIENT_SECRET': 'bench',
+            'SPOTIFY_REDIRECT_URI': f'{base_url}/callback',
+            'SECRET_KEY': os.urandom(24).hex(), 'LOG_LEVEL': 'WARNING',
+            'DATA_DIR': os.path.join(state_dir, 'data'), 'LOG_DIR': os.path.join(state_dir, 'logs'),
+        })
+        env.update(item.split('=', 1) for item in args.env)
+        print(f"{' '.join(command[1:])}  ({args.users} users, {args.duration:.0f}s, playlist {args.playlist})")
+        proc = start_server(command, env, f'{base_url}/')
+        try:
+            samples, elapsed = run_load(base_url, args, mix)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    routes, overall = summarize(samples, elapsed)
+    result = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'command': command[1:],
+            'users': args.users,
+            'duration': round(elapsed, 2),
+            'mix': mix,
+            'playlist': args.playlist,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'throttle_rate': args.throttle_rate,
+            'env': dict(item.split('=', 1) for item in args.env),
+        },
+        'routes': routes,
+        'overall': overall,
+        'upstream': fake.stats(),
+    }
+    print_report(result)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'results written to {args.output}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(json.load(f), result, args.max_regression):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Scope of entries every user may read (public playlists)
+SHARED = '*'
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire `ttl` seconds after
+    they were stored. Holds at most `max_entries` entries.
+    """
+
+    def __init__(self, ttl=300, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class _Call:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key: the first caller runs the
+    function and everyone who arrives while it is in flight gets its
+    result (or exception) instead of making their own call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return (result, shared); `shared` is True for callers that waited on another's call."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+        try:
+            call.value = fn()
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+
+def _is_public(playlist):
+    return playlist is not None and playlist.public is True
+
+
+class SharedPlaylistCache:
+    """
+    Playlist metadata and track pages shared across users.
+
+    Entries are `models.Playlist` and `models.TrackPage` records. Public
+    playlists are stored once for everyone; anything else is only
+    visible to the user who fetched it. Track pages are keyed by the
+    playlist's `snapshot_id`, so a changed playlist stops matching its old
+    pages as soon as its metadata is refreshed (metadata lives for
+    `meta_ttl` seconds). Concurrent identical misses share one upstream
+    call. Entries hold only upstream data, never per-user saved state, and
+    callers must treat them as read-only.
+    """
+
+    def __init__(self, ttl=300, meta_ttl=30, max_entries=512):
+        self.meta_ttl = meta_ttl
+        self._playlists = TTLCache(meta_ttl, max_entries)
+        self._pages = TTLCache(ttl, max_entries)
+        self._flight = SingleFlight()
+
+    def cached_playlist(self, user, playlist_id):
+        """Return the cached metadata visible to `user`, or None."""
+        for scope in (SHARED, user):
+            playlist = self._playlists.get((scope, playlist_id))
+            if playlist is not None:
+                return playlist
+        return None
+
+    def playlist(self, user, playlist_id, load):
+        """
+        Return playlist metadata for `user`, calling `load()` (which returns
+        a Playlist or None) on a miss.
+        """
+        playlist = self.cached_playlist(user, playlist_id)
+        if playlist is not None:
+            return playlist
+        playlist, shared = self._flight.do(('playlist', playlist_id), load)
+        if shared and not _is_public(playlist):
+            # Another user's fetch; only public playlists can be handed over
+            playlist = load()
+        return self.store_playlist(user, playlist_id, playlist)
+
+    def store_playlist(self, user, playlist_id, playlist):
+        """Cache freshly fetched metadata and return it."""
+        if playlist is None:
+            return None
+        self._playlists.set((self._scope(user, playlist), playlist_id), playlist)
+        return playlist
+
+    def cached_tracks_page(self, user, playlist, offset, limit):
+        return self._pages.get(self._page_key(user, playlist, offset, limit))
+
+    def store_tracks_page(self, user, playlist, offset, limit, page):
+        if page is not None and playlist.snapshot_id:
+            self._pages.set(self._page_key(user, playlist, offset, limit), page)
+
+    def tracks_page(self, user, playlist, offset, limit, load):
+        """Return a page of the playlist's tracks, calling `load()` on a miss."""
+        key = self._page_key(user, playlist, offset, limit)
+        page = self._pages.get(key)
+        if page is not None:
+            return page
+        page, _ = self._flight.do(('tracks',) + key, load)
+        self.store_tracks_page(user, playlist, offset, limit, page)
+        return page
+
+    def _scope(self, user, playlist):
+        return SHARED if _is_public(playlist) else user
+
+    def _page_key(self, user, playlist, offset, limit):
+        return (self._scope(user, playlist), playlist.id, playlist.snapshot_id, offset, limit)
+
+    def clear(self):
+        self._playlists.clear()
+        self._pages.clear()
+
+    def stats(self):
+        return {
+            'playlists': self._playlists.stats(),
+            'pages': self._pages.stats(),
+            'coalesced': self._flight.coalesced,
+        }
@@ -6,6 +6,8 @@ set -e
 APP_NAME=spotiplay
 IMAGE_NAME=spotiplay:latest
 CONTAINER_NAME=spotiplay_app
+# Sessions, tokens and other SQLite state (DATA_DIR) outlive each container
+DATA_VOLUME=spotiplay_data
 DIR=/home/ubuntu/spotiplay
 SYSTEMD_SERVICE_FILE=spotiplay.service
 NGINX_CONF_FILE=spotiplay_nginx.conf
@@ -31,7 +33,10 @@ fi
 echo "[deploy.sh] Running new container..."
 docker run -d --name $CONTAINER_NAME --restart unless-stopped \
 	-p 127.0.0.1:5000:5000 \
+	-v $DATA_VOLUME:/app/data \
 	--env-file .env \
+	-e DATA_DIR=/app/data \
+	-e METRICS_ALLOWED_NETWORKS=127.0.0.1/32,::1/128,172.16.0.0/12 \
 	$IMAGE_NAME
 
 # (Optional) Nginx config for SSL/static proxy
@@ -0,0 +1,57 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+class FanOut:
+    """
+    Bounded per-request worker pool for independent upstream calls.
+
+    All results share one deadline: once it passes, unfinished calls are
+    abandoned and reported as missing instead of holding the request.
+    Tasks run in a copy of the submitting context so request-scoped
+    context variables follow them into the pool.
+    """
+
+    def __init__(self, max_workers, deadline):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='spotify-fanout')
+        self.expires_at = time.monotonic() + deadline
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def reset_deadline(self, deadline):
+        """Start a fresh deadline, for a pool that serves several rounds of calls (e.g. a streamed response)."""
+        self.expires_at = time.monotonic() + deadline
+
+    def remaining(self):
+        """Seconds left before the deadline (never negative)."""
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def submit(self, fn, *args, **kwargs):
+        context = contextvars.copy_context()
+        return self.executor.submit(context.run, fn, *args, **kwargs)
+
+    def result(self, future, default=None):
+        """
+        Wait for `future` until the deadline. Returns `default` if the call
+        raised or did not finish in time.
+        """
+        try:
+            return future.result(timeout=self.remaining())
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning("Upstream call abandoned at request deadline")
+        except Exception:
+            logger.warning("Upstream call failed", exc_info=True)
+        return default
+
+    def shutdown(self):
+        # Don't block on abandoned calls; their threads exit when they finish.
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,47 @@
+"""
+Gunicorn settings for Spotiplay (`gunicorn -c gunicorn.conf.py`).
+
+Requests spend nearly all their time waiting on the Spotify API, so the
+default worker class is `gthread`: each worker process serves
+GUNICORN_THREADS requests at once. GUNICORN_WORKER_CLASS=gevent serves
+up to GUNICORN_WORKER_CONNECTIONS requests per worker on green threads
+(needs requirements/gevent.txt); `sync` is one request per worker.
+benchmarks/bench_workers.py compares the three.
+"""
+import gc
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # --preload imports the app (requests, ssl, threading) in the master,
+    # before gunicorn's gevent worker would patch them; patch first.
+    from gevent import monkey
+    monkey.patch_all()
+
+# The master only preloads; leave the log file to the workers it forks
+wsgi_app = 'app:create_app(log_writer=False)'
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', 3))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))
+
+# Each worker shares one pooled Spotify client between its concurrent
+# requests; size the pool for them (and their fan-out) so busy workers
+# reuse connections instead of opening and discarding extra ones.
+_concurrency = {'gthread': threads, 'gevent': worker_connections}.get(worker_class, 1)
+os.environ.setdefault('SPOTIFY_POOL_SIZE', str(min(max(10, _concurrency * 2), 64)))
+
+# Import the app and compile its templates once, in the master
+preload_app = True
+# Longer than SPOTIFY_REQUEST_DEADLINE and STREAM_MAX_SECONDS
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+# nginx keeps connections to us open between requests
+keepalive = 5
+
+
+def when_ready(server):
+    # Everything loaded so far lives as long as the workers; keep the
+    # collector from touching it so those pages stay shared after fork.
+    gc.freeze()
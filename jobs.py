@@ -0,0 +1,420 @@
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pagination import SpotifyPageError, check_in_batches, iter_all_items, put_in_batches
+from sqlite_store import SQLiteStore, process_alive
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+CANCELLING = 'cancelling'
+CANCELLED = 'cancelled'
+DONE = 'done'
+FAILED = 'failed'
+INTERRUPTED = 'interrupted'
+
+ACTIVE_STATES = (QUEUED, RUNNING, CANCELLING)
+RESUMABLE_STATES = (CANCELLED, FAILED, INTERRUPTED)
+
+
+class Job:
+    """Snapshot of a background job's progress as stored in the job table."""
+    __slots__ = (
+        'id', 'user', 'playlist_id', 'state', 'fetched', 'saved', 'failed', 'skipped',
+        'total', 'cursor', 'track_ids', 'retry_ids', 'snapshot_id', 'message', 'runner_pid', 'created_at', 'updated_at'
+    )
+
+    def __init__(self, row, stale_after):
+        for key in self.__slots__:
+            setattr(self, key, row[key])
+        self.track_ids = json.loads(row['track_ids']) if row['track_ids'] is not None else None
+        self.retry_ids = json.loads(row['retry_ids']) if row['retry_ids'] is not None else []
+        # A job whose worker died (e.g. a gunicorn restart) stops updating.
+        # One that is merely slow still has its worker, and mustn't be
+        # resumed under it.
+        if (
+            self.state in ACTIVE_STATES and time.time() - self.updated_at > stale_after
+            and not process_alive(self.runner_pid)
+        ):
+            self.state = INTERRUPTED
+
+    @property
+    def finished(self):
+        return self.state not in ACTIVE_STATES
+
+    @property
+    def resumable(self):
+        return self.state in RESUMABLE_STATES
+
+
+class JobStore(SQLiteStore):
+    """
+    Job progress shared by all worker processes, so any worker can answer a
+    poll, plus each user's playlist sync state: the snapshot_id of the last
+    complete sync and every track ID known to be in their library.
+    """
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            user TEXT NOT NULL,
+            playlist_id TEXT NOT NULL,
+            state TEXT NOT NULL,
+            fetched INTEGER NOT NULL DEFAULT 0,
+            saved INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            track_ids TEXT,
+            retry_ids TEXT,
+            snapshot_id TEXT,
+            message TEXT,
+            runner_pid INTEGER,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)',
+        """
+        CREATE TABLE IF NOT EXISTS playlist_sync (
+            user TEXT NOT NULL,
+            playlist_id TEXT NOT NULL,
+            snapshot_id TEXT,
+            track_count INTEGER,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (user, playlist_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS synced_tracks (
+            user TEXT NOT NULL,
+            playlist_id TEXT NOT NULL,
+            track_id TEXT NOT NULL,
+            PRIMARY KEY (user, playlist_id, track_id)
+        ) WITHOUT ROWID
+        """,
+    )
+    COLUMNS = (
+        ('jobs', 'skipped', 'INTEGER NOT NULL DEFAULT 0'),
+        ('jobs', 'snapshot_id', 'TEXT'),
+        ('jobs', 'retry_ids', 'TEXT'),
+        ('playlist_sync', 'track_count', 'INTEGER'),
+        ('jobs', 'runner_pid', 'INTEGER'),
+    )
+
+    def __init__(self, path, stale_after=300, keep_for=86400):
+        super().__init__(path)
+        self.stale_after = stale_after
+        self.keep_for = keep_for
+
+    def create(self, user, playlist_id):
+        job_id = secrets.token_urlsafe(12)
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM jobs WHERE updated_at < ?', (now - self.keep_for,))
+            conn.execute(
+                'INSERT INTO jobs (id, user, playlist_id, state, runner_pid, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, user, playlist_id, QUEUED, os.getpid(), now, now)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        row = self.connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return Job(row, self.stale_after) if row else None
+
+    def update(self, job_id, **fields):
+        for key in ('track_ids', 'retry_ids'):
+            if fields.get(key) is not None:
+                fields[key] = json.dumps(fields[key])
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        self.connection().execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def request_cancel(self, job_id):
+        cursor = self.connection().execute(
+            'UPDATE jobs SET state = ?, updated_at = ? WHERE id = ? AND state IN (?, ?)',
+            (CANCELLING, time.time(), job_id, QUEUED, RUNNING)
+        )
+        return cursor.rowcount == 1
+
+    def synced_snapshot(self, user, playlist_id):
+        row = self.connection().execute(
+            'SELECT snapshot_id FROM playlist_sync WHERE user = ? AND playlist_id = ?', (user, playlist_id)
+        ).fetchone()
+        return row['snapshot_id'] if row else None
+
+    def synced_track_count(self, user, playlist_id):
+        """How many distinct tracks the last completely synced snapshot had, or None if unknown."""
+        row = self.connection().execute(
+            'SELECT track_count FROM playlist_sync WHERE user = ? AND playlist_id = ?', (user, playlist_id)
+        ).fetchone()
+        return row['track_count'] if row else None
+
+    def synced_track_ids(self, user, playlist_id):
+        rows = self.connection().execute(
+            'SELECT track_id FROM synced_tracks WHERE user = ? AND playlist_id = ?', (user, playlist_id)
+        )
+        return {row['track_id'] for row in rows}
+
+    def mark_synced(self, user, playlist_id, track_ids):
+        """Record track IDs from the playlist that are now in the user's library."""
+        if not track_ids:
+            return
+        with self.transaction() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO synced_tracks (user, playlist_id, track_id) VALUES (?, ?, ?)',
+                [(user, playlist_id, track_id) for track_id in track_ids]
+            )
+
+    def finish_sync(self, user, playlist_id, snapshot_id, track_count):
+        """Remember the snapshot (of `track_count` distinct tracks) every track of which is now in the user's library."""
+        self.connection().execute(
+            'INSERT OR REPLACE INTO playlist_sync (user, playlist_id, snapshot_id, track_count, updated_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (user, playlist_id, snapshot_id, track_count, time.time())
+        )
+
+    def clear_sync(self):
+        """Forget all sync state, so the next save of any playlist re-checks every track."""
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM playlist_sync')
+            conn.execute('DELETE FROM synced_tracks')
+
+    def claim_resume(self, job_id):
+        """
+        Move a resumable job back to queued, to be run by this process;
+        only one caller wins.
+        """
+        with self.transaction() as conn:
+            job = self.get(job_id)
+            if job is None or not job.resumable:
+                return False
+            conn.execute(
+                'UPDATE jobs SET state = ?, runner_pid = ?, updated_at = ? WHERE id = ?',
+                (QUEUED, os.getpid(), time.time(), job_id)
+            )
+        return True
+
+
+class JobManager:
+    """
+    Runs "add playlist to library" jobs on a small per-process thread pool.
+
+    Jobs sync incrementally: if the playlist's snapshot_id matches the last
+    complete sync there is nothing to do, and otherwise only tracks that
+    were neither synced before nor found saved (in `library`, a
+    SavedLibraryIndex, or via the contains endpoint) are PUT.
+
+    Progress (tracks fetched, saved, skipped and failed, plus the index of
+    the next batch to save) is written to the JobStore after every page
+    and batch, so a cancelled, failed or interrupted job resumes from the
+    last saved batch instead of starting over. Tracks of batches that
+    failed are kept too: a job that ends with any ends FAILED, and
+    resuming it retries just those tracks.
+    """
+
+    def __init__(self, store, client_factory, on_saved=None, library=None, max_workers=2, batch_size=50, page_size=100, concurrency=4):
+        self.store = store
+        self.client_factory = client_factory
+        self.on_saved = on_saved
+        self.library = library
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self._executor = None
+        self._executor_pid = None
+        self._done_events = {}
+        self._lock = threading.Lock()
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='spotiplay-job')
+                self._executor_pid = os.getpid()
+                self._done_events = {}
+            return self._executor
+
+    def submit_playlist_save(self, user, playlist_id, token):
+        job = self.store.create(user, playlist_id)
+        self._start(job.id, token)
+        return job
+
+    def resume(self, job, token):
+        if not self.store.claim_resume(job.id):
+            return False
+        self._start(job.id, token)
+        return True
+
+    def cancel(self, job):
+        return self.store.request_cancel(job.id)
+
+    def wait(self, job_id, timeout):
+        """Wait up to `timeout` seconds for a job started by this process; return its latest state."""
+        event = self._done_events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+        return self.store.get(job_id)
+
+    def _start(self, job_id, token):
+        executor = self.executor()
+        self._done_events[job_id] = threading.Event()
+        executor.submit(self._run, job_id, token)
+
+    def _run(self, job_id, token):
+        try:
+            self._save_playlist_tracks(job_id, token)
+        except Exception:
+            logger.exception("Job %s failed", job_id)
+            self.store.update(job_id, state=FAILED, message='Some tracks may not have been added.')
+        finally:
+            event = self._done_events.pop(job_id, None)
+            if event is not None:
+                event.set()
+
+    def _cancel_requested(self, job_id):
+        job = self.store.get(job_id)
+        if job.state == CANCELLING:
+            self.store.update(job_id, state=CANCELLED, message='Cancelled.')
+            return True
+        return False
+
+    def _snapshot_id(self, client, token, playlist_id):
+        resp = client.get('playlists.get', token, path={'playlist_id': playlist_id}, params={'fields': 'snapshot_id'})
+        return resp.json().get('snapshot_id') if resp.status_code == 200 else None
+
+    def _already_saved(self, client, token, user, track_ids):
+        """The subset of `track_ids` already in the user's Liked Songs."""
+        if self.library is not None:
+            known, missing = self.library.lookup(user, 'tracks', track_ids)
+        else:
+            known, missing = {}, track_ids
+        saved = {track_id for track_id, is_saved in known.items() if is_saved}
+        checks = check_in_batches(
+            client, 'user.check_saved_tracks', token, missing,
+            batch_size=self.batch_size, max_workers=client.max_concurrency(self.concurrency)
+        )
+        try:
+            for batch, flags in checks:
+                # A failed check just means those tracks get PUT again
+                if flags is None:
+                    continue
+                checked = dict(zip(batch, flags))
+                if self.library is not None:
+                    self.library.record(user, 'tracks', checked)
+                saved.update(track_id for track_id, is_saved in checked.items() if is_saved)
+        finally:
+            checks.close()
+        return saved
+
+    def _save_playlist_tracks(self, job_id, token):
+        if self._cancel_requested(job_id):
+            return
+        self.store.update(job_id, state=RUNNING)
+        job = self.store.get(job_id)
+        client = self.client_factory()
+
+        # Step 1: Work out which tracks still need saving
+        track_ids = job.track_ids
+        skipped = job.skipped
+        if track_ids is None:
+            snapshot_id = self._snapshot_id(client, token, job.playlist_id)
+            # Unchanged since the last complete sync: every one of its tracks
+            # is already saved. (Syncs recorded without a count start over.)
+            synced_count = self.store.synced_track_count(job.user, job.playlist_id)
+            if (
+                snapshot_id is not None and synced_count is not None
+                and snapshot_id == self.store.synced_snapshot(job.user, job.playlist_id)
+            ):
+                self.store.update(
+                    job_id, state=DONE, fetched=0, total=synced_count, skipped=synced_count, track_ids=[],
+                    message=_sync_message(0, synced_count)
+                )
+                return
+
+            # Fetch all track IDs from the playlist, pages in parallel
+            playlist_ids = []
+            items = iter_all_items(
+                client, 'playlists.tracks', token, path={'playlist_id': job.playlist_id},
+                params={'fields': 'items(track(id)),total'},
+                limit=self.page_size, max_workers=client.max_concurrency(self.concurrency)
+            )
+            try:
+                for count, item in enumerate(items, 1):
+                    track = item.get('track')
+                    if track and track.get('id'):
+                        playlist_ids.append(track['id'])
+                    if count % self.page_size == 0:
+                        if self._cancel_requested(job_id):
+                            return
+                        self.store.update(job_id, fetched=len(playlist_ids))
+            except SpotifyPageError:
+                self.store.update(job_id, state=FAILED, message='Failed to fetch playlist tracks.')
+                return
+            finally:
+                items.close()
+
+            # Diff against the last sync, then drop tracks already in Liked Songs
+            playlist_ids = list(dict.fromkeys(playlist_ids))
+            synced = self.store.synced_track_ids(job.user, job.playlist_id)
+            new_ids = [track_id for track_id in playlist_ids if track_id not in synced]
+            already_saved = self._already_saved(client, token, job.user, new_ids)
+            self.store.mark_synced(job.user, job.playlist_id, already_saved)
+            track_ids = [track_id for track_id in new_ids if track_id not in already_saved]
+            skipped = len(playlist_ids) - len(track_ids)
+            self.store.update(
+                job_id, fetched=len(playlist_ids), total=len(playlist_ids), skipped=skipped,
+                track_ids=track_ids, snapshot_id=snapshot_id
+            )
+            job.snapshot_id = snapshot_id
+            job.total = len(playlist_ids)
+
+        # Step 2: Add tracks to user's library in concurrent batches, from the last saved batch
+        saved = job.saved
+        cursor = job.cursor
+        retry_ids = job.retry_ids
+        batches = put_in_batches(
+            client, 'user.tracks', token, track_ids[cursor * self.batch_size:],
+            batch_size=self.batch_size, max_workers=client.max_concurrency(self.concurrency)
+        )
+        try:
+            for batch, succeeded in batches:
+                if succeeded:
+                    saved += len(batch)
+                    self.store.mark_synced(job.user, job.playlist_id, batch)
+                    if self.on_saved:
+                        self.on_saved(job.user, batch)
+                else:
+                    retry_ids = retry_ids + batch
+                cursor += 1
+                self.store.update(job_id, cursor=cursor, saved=saved, failed=len(retry_ids), retry_ids=retry_ids)
+                if self._cancel_requested(job_id):
+                    return
+        finally:
+            batches.close()
+
+        if retry_ids:
+            # Resuming retries only the tracks that failed
+            self.store.update(
+                job_id, state=FAILED, track_ids=retry_ids, retry_ids=[], cursor=0,
+                message='Some tracks may not have been added.'
+            )
+            return
+        if job.snapshot_id is not None:
+            self.store.finish_sync(job.user, job.playlist_id, job.snapshot_id, job.total)
+        self.store.update(job_id, state=DONE, message=_sync_message(saved, skipped))
+
+
+def _sync_message(added, skipped):
+    message = f"Added {added} tracks to your library!"
+    if skipped:
+        message += f" Skipped {skipped} already there."
+    return message
@@ -0,0 +1,192 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_store import SQLiteStore
+
+# Rough per-ID cost on top of the string itself: a set slot plus bookkeeping.
+_ID_OVERHEAD = 40
+
+
+class LibraryVersions(SQLiteStore):
+    """
+    A counter per user, shared by every worker process, that goes up
+    whenever the app changes the user's library. A worker whose copy of
+    the library was built at an older version knows to drop it.
+    """
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS library_versions (
+            user TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+    )
+
+    def get(self, user):
+        row = self.connection().execute('SELECT version FROM library_versions WHERE user = ?', (user,)).fetchone()
+        return row['version'] if row else 0
+
+    def bump(self, user):
+        """Move `user` to a new version; returns (old, new)."""
+        with self.transaction() as conn:
+            row = conn.execute('SELECT version FROM library_versions WHERE user = ?', (user,)).fetchone()
+            old = row['version'] if row else 0
+            conn.execute('INSERT OR REPLACE INTO library_versions (user, version) VALUES (?, ?)', (user, old + 1))
+        return old, old + 1
+
+
+class _UserLibrary:
+    __slots__ = ('expires_at', 'version', 'saved', 'unsaved', 'size')
+
+    def __init__(self, expires_at, version):
+        self.expires_at = expires_at
+        self.version = version
+        self.saved = {'tracks': set(), 'albums': set()}
+        self.unsaved = {'tracks': set(), 'albums': set()}
+        self.size = 0
+
+
+class SavedLibraryIndex:
+    """
+    Per-user index of which track and album IDs are in the user's library.
+
+    Answers "is this saved?" from memory and reports the IDs it doesn't
+    know, so callers only hit the `contains` endpoints on a miss. Each
+    user's entry expires `ttl` seconds after it was created, which bounds
+    how stale an answer can get after changes made outside the app, and
+    users are evicted least-recently-used first once the estimated size
+    passes `max_bytes`.
+
+    The index is per process. With `versions` (a LibraryVersions), saves
+    and invalidations made on one worker bump the user's shared version,
+    and the other workers drop their entry for that user on its next
+    lookup instead of serving it until it expires.
+    """
+
+    def __init__(self, ttl=300, max_bytes=32 * 1024 * 1024, versions=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.versions = versions
+        self._users = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _version(self, user):
+        return self.versions.get(user) if self.versions is not None else None
+
+    def _entry(self, user, version, create=False):
+        """
+        `user`'s live entry, dropping it if it has expired or was built at
+        another `version` than the current one (None skips that check).
+        """
+        entry = self._users.get(user)
+        if entry is not None and (
+            entry.expires_at <= time.monotonic() or (version is not None and entry.version != version)
+        ):
+            self._drop(user)
+            entry = None
+        if entry is None and create:
+            entry = self._users[user] = _UserLibrary(time.monotonic() + self.ttl, version)
+        if entry is not None:
+            self._users.move_to_end(user)
+        return entry
+
+    def _drop(self, user):
+        entry = self._users.pop(user, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def _add(self, entry, kind, item_id, is_saved):
+        add_to, remove_from = (entry.saved, entry.unsaved) if is_saved else (entry.unsaved, entry.saved)
+        if item_id in add_to[kind]:
+            return
+        if item_id in remove_from[kind]:
+            remove_from[kind].discard(item_id)
+        else:
+            cost = sys.getsizeof(item_id) + _ID_OVERHEAD
+            entry.size += cost
+            self._size += cost
+        add_to[kind].add(item_id)
+
+    def _evict(self, keep):
+        while self._size > self.max_bytes and len(self._users) > 1:
+            user = next(iter(self._users))
+            if user == keep:
+                self._users.move_to_end(user)
+                continue
+            self._drop(user)
+            self.evictions += 1
+
+    def lookup(self, user, kind, ids):
+        """
+        Return ({id: is_saved} for known IDs, [unknown IDs]) preserving the
+        order of `ids`.
+        """
+        known = {}
+        missing = []
+        # Nothing to check the shared version against for a user we don't know
+        version = self._version(user) if user in self._users else None
+        with self._lock:
+            entry = self._entry(user, version)
+            for item_id in ids:
+                if entry is not None and item_id in entry.saved[kind]:
+                    known[item_id] = True
+                elif entry is not None and item_id in entry.unsaved[kind]:
+                    known[item_id] = False
+                else:
+                    missing.append(item_id)
+            self.hits += len(known)
+            self.misses += len(missing)
+        return known, missing
+
+    def record(self, user, kind, results):
+        """Store {id: is_saved} answers from a `contains` check."""
+        if not results:
+            return
+        version = self._version(user)
+        with self._lock:
+            entry = self._entry(user, version, create=True)
+            for item_id, is_saved in results.items():
+                self._add(entry, kind, item_id, bool(is_saved))
+            self._evict(keep=user)
+
+    def mark_saved(self, user, kind, ids):
+        """Write through IDs the user just added to their library."""
+        if not ids:
+            return
+        old = new = None
+        if self.versions is not None:
+            old, new = self.versions.bump(user)
+        with self._lock:
+            # Kept only if no other worker changed the library since it was built
+            entry = self._entry(user, old, create=True)
+            entry.version = new
+            for item_id in ids:
+                self._add(entry, kind, item_id, True)
+            self._evict(keep=user)
+
+    def invalidate(self, user):
+        if self.versions is not None:
+            self.versions.bump(user)
+        with self._lock:
+            self._drop(user)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'estimated_bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,231 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import socket
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Windows
+    fcntl = None
+
+# Unix datagrams are delivered whole or not at all; keep lines well under
+# the default socket buffer.
+MAX_LINE_BYTES = 32 * 1024
+
+_STOP = object()
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when its queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        # Only merge args into the message here; the listener does the
+        # real formatting off the request thread.
+        self.setFormatter(logging.Formatter('%(message)s'))
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    Logging that never writes files on the calling thread.
+
+    Records go into a bounded queue (full means dropped and counted) and a
+    background thread formats them, writes them to stderr and passes them
+    to the host's log writer. The writer is whichever process holds an
+    flock on `<log file>.lock`. It owns the RotatingFileHandler and takes
+    lines from the other processes over a unix datagram socket, so only
+    one process ever rotates the file. If the writer exits, the next
+    process that fails to reach it takes over. `start(writer=False)` keeps
+    a process (gunicorn's preloading master) out of the election; its
+    forked children take part as usual.
+    """
+
+    def __init__(self, path, fmt, max_bytes=10 * 1024 * 1024, backup_count=5, queue_size=10000, console=True):
+        self.path = path
+        self.lock_path = f'{path}.lock'
+        self.socket_path = f'{path}.sock'
+        self.formatter = logging.Formatter(fmt)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue_size = queue_size
+        self.console = logging.StreamHandler() if console else None
+        if self.console is not None:
+            self.console.setFormatter(self.formatter)
+        self.handler = BoundedQueueHandler(queue.Queue(queue_size))
+        self.sent = 0
+        self.send_failures = 0
+        self._file = None
+        self._lock_fd = None
+        self._server = None
+        self._client = None
+        self._threads = []
+        self._elect_lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        self._may_write = True
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.close)
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    @property
+    def is_writer(self):
+        return self._file is not None
+
+    def start(self, writer=True):
+        self._started = True
+        self._may_write = writer
+        self._elect()
+        self._spawn(self._drain, 'log-drain')
+        return self
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _elect(self):
+        """Try to become the host's log writer; returns True if this process is it."""
+        with self._elect_lock:
+            if self._file is not None:
+                return True
+            if not self._may_write:
+                return False
+            if fcntl is not None:
+                fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close(fd)
+                    return False
+                self._lock_fd = fd
+                try:
+                    os.unlink(self.socket_path)
+                except FileNotFoundError:
+                    pass
+                self._server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self._server.bind(self.socket_path)
+                self._spawn(self._serve, 'log-writer')
+            self._file = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes, backupCount=self.backup_count
+            )
+            self._file.setFormatter(logging.Formatter('%(message)s'))
+            return True
+
+    def _drain(self):
+        while True:
+            record = self.handler.queue.get()
+            if record is _STOP:
+                return
+            try:
+                if self.console is not None:
+                    self.console.handle(record)
+                self._write(self.formatter.format(record))
+            except Exception:
+                self.send_failures += 1
+
+    def _serve(self):
+        server = self._server
+        while True:
+            try:
+                data = server.recv(MAX_LINE_BYTES)
+            except OSError:
+                return
+            if not data:
+                return
+            self._write_file(data.decode('utf-8', 'replace'))
+
+    def _write(self, line):
+        if self._file is not None:
+            self._write_file(line)
+            return
+        data = line.encode('utf-8')[:MAX_LINE_BYTES]
+        try:
+            if self._client is None:
+                self._client = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self._client.setblocking(False)
+            self._client.sendto(data, self.socket_path)
+            self.sent += 1
+        except BlockingIOError:
+            # The writer is backed up; drop rather than stall this process
+            self.send_failures += 1
+        except OSError:
+            # No writer listening (it exited); take over if we can
+            if self._elect():
+                self._write_file(line)
+            else:
+                self.send_failures += 1
+
+    def _write_file(self, line):
+        self._file.handle(logging.makeLogRecord({'msg': line}))
+
+    def _after_fork(self):
+        # Threads don't survive fork, and the parent stays the writer: the
+        # child drops its copies of the lock and sockets and starts over.
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.handler.dropped = 0
+        self.sent = 0
+        self.send_failures = 0
+        for resource in (self._server, self._client):
+            if resource is not None:
+                resource.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+        self._file = self._lock_fd = self._server = self._client = None
+        self._elect_lock = threading.Lock()
+        self._threads = []
+        if self._started and not self._closed:
+            self.start()
+
+    def close(self, timeout=2.0):
+        """Flush queued records and stop the background threads."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.handler.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        for thread in self._threads:
+            if thread.name == 'log-drain':
+                thread.join(timeout)
+        if self._server is not None:
+            try:
+                # Wakes the writer thread out of recv()
+                self._server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server.close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        if self._file is not None:
+            self._file.close()
+        if self._lock_fd is not None:
+            # Hand the file over to the next process that logs
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def stats(self):
+        return {
+            'writer': self.is_writer,
+            'queued': self.handler.queue.qsize(),
+            'dropped': self.dropped,
+            'sent': self.sent,
+            'send_failures': self.send_failures,
+        }
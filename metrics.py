@@ -0,0 +1,342 @@
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlite_store import SQLiteStore, process_alive
+
+logger = logging.getLogger(__name__)
+
+# Latency histogram buckets in seconds (+Inf is implied)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_recorder = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Timings for one request: every upstream Spotify call plus named local
+    phases such as rendering. FanOut copies the context into its workers,
+    so calls made from the pool land on the same recorder.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.upstream = []
+        self.phases = {}
+        self._renders = []
+        self._lock = threading.Lock()
+
+    def add_upstream(self, endpoint, status, elapsed, nbytes):
+        with self._lock:
+            self.upstream.append((endpoint, status, elapsed, nbytes))
+
+    def add_phase(self, name, elapsed):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def render_started(self):
+        self._renders.append(time.perf_counter())
+
+    def render_finished(self):
+        if self._renders:
+            start = self._renders.pop()
+            # Nested renders are already inside the outer one's time
+            if not self._renders:
+                self.add_phase('render', time.perf_counter() - start)
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Server-Timing header value: Spotify time per endpoint, local phases and the total."""
+        with self._lock:
+            upstream = list(self.upstream)
+            phases = dict(self.phases)
+        per_endpoint = {}
+        for endpoint, _, elapsed, _ in upstream:
+            calls, spent = per_endpoint.get(endpoint, (0, 0.0))
+            per_endpoint[endpoint] = (calls + 1, spent + elapsed)
+        entries = []
+        if upstream:
+            entries.append(f'spotify;dur={sum(call[2] for call in upstream) * 1000:.1f};desc="{len(upstream)} calls"')
+        for endpoint, (calls, spent) in per_endpoint.items():
+            entries.append(f'spotify-{endpoint};dur={spent * 1000:.1f};desc="{calls}x"')
+        for name, spent in phases.items():
+            entries.append(f'{name};dur={spent * 1000:.1f}')
+        entries.append(f'total;dur={self.total() * 1000:.1f}')
+        return ', '.join(entries)
+
+
+def start_request():
+    timings = RequestTimings()
+    _recorder.set(timings)
+    return timings
+
+
+def current():
+    return _recorder.get()
+
+
+def finish_request():
+    _recorder.set(None)
+
+
+def record_upstream(endpoint, status, elapsed, nbytes):
+    timings = _recorder.get()
+    if timings is not None:
+        timings.add_upstream(endpoint, status, elapsed, nbytes)
+
+
+@contextmanager
+def phase(name):
+    """Time a block of local work (e.g. 'render') on the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _recorder.get()
+        if timings is not None:
+            timings.add_phase(name, time.perf_counter() - start)
+
+
+class StartupProfile:
+    """
+    Wall-clock cost of each phase of starting the app. Each `mark()` closes
+    a phase that began at the previous mark (or at `started`).
+    """
+
+    def __init__(self, started=None):
+        self.phases = []
+        self._last = time.perf_counter() if started is None else started
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def total(self):
+        return sum(spent for _, spent in self.phases)
+
+    def summary(self):
+        """One line, for the log."""
+        parts = ', '.join(f'{name} {spent * 1000:.0f}ms' for name, spent in self.phases)
+        return f'{self.total() * 1000:.0f}ms ({parts})'
+
+    def report(self):
+        """A table of the phases, for the `startup-profile` command."""
+        width = max([len(name) for name, _ in self.phases] + [len('total')])
+        lines = [f'{name:<{width}}  {spent * 1000:8.1f} ms' for name, spent in self.phases]
+        lines.append(f'{"total":<{width}}  {self.total() * 1000:8.1f} ms')
+        return '\n'.join(lines)
+
+
+def _worker_alive(worker):
+    """Whether the process behind a `<pid>-<suffix>` worker ID is still running."""
+    try:
+        pid = int(worker.split('-', 1)[0])
+    except ValueError:
+        return True
+    return process_alive(pid)
+
+
+def _sum_rows(rows):
+    """Sum metric_series rows by series: {(name, labels): [buckets or None, sum, count]}."""
+    totals = {}
+    for row in rows:
+        key = (row['name'], row['labels'])
+        buckets = json.loads(row['buckets']) if row['buckets'] is not None else None
+        if key not in totals:
+            totals[key] = [buckets, row['sum'], row['count']]
+            continue
+        total = totals[key]
+        if buckets is not None:
+            total[0] = [a + b for a, b in zip(total[0], buckets)]
+        total[1] += row['sum']
+        total[2] += row['count']
+    return totals
+
+
+class MetricsRegistry(SQLiteStore):
+    """
+    Latency histograms and counters, aggregated across worker processes.
+
+    Each worker keeps its series in memory and periodically writes their
+    cumulative values to SQLite under its own worker ID; `render()` sums
+    every worker's rows, so series stay monotonic as workers come and go.
+    When a worker first flushes, rows left by workers whose process has
+    exited are folded into one retired row per series, so the table holds
+    at most one set of rows per live worker plus the retired totals.
+
+    Components that count for themselves (caches, the prefetcher, ...)
+    are hooked in with `add_collector()`; collectors run before each flush
+    and copy those counts in with `set_counter()`.
+    """
+    RETIRED = 'retired'
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS metric_series (
+            worker TEXT NOT NULL,
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            buckets TEXT,
+            sum REAL NOT NULL,
+            count REAL NOT NULL,
+            PRIMARY KEY (worker, name, labels)
+        )
+        """,
+    )
+
+    def __init__(self, path, flush_interval=5.0):
+        super().__init__(path)
+        self.flush_interval = flush_interval
+        self._series = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._pid = None
+        self._worker = None
+        self._flushed_at = 0.0
+        self._compacted = None
+
+    def _worker_id(self):
+        if self._pid != os.getpid():
+            # Forked workers start their own series
+            self._pid = os.getpid()
+            self._worker = f'{self._pid}-{secrets.token_hex(4)}'
+            self._series = {}
+        return self._worker
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def add_collector(self, collect):
+        """Call `collect()` before every flush, to record counts kept elsewhere."""
+        self._collectors.append(collect)
+
+    def observe(self, name, value, **labels):
+        """Add `value` (seconds) to a histogram series."""
+        key = (name, json.dumps(labels, sort_keys=True))
+        with self._lock:
+            self._worker_id()
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def increment(self, name, amount=1, **labels):
+        """Add `amount` to a counter series."""
+        key = (name, json.dumps(labels, sort_keys=True))
+        with self._lock:
+            self._worker_id()
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [None, 0.0, 0]
+            series[1] += amount
+            series[2] += 1
+
+    def set_counter(self, name, value, **labels):
+        """Set a counter series to a cumulative value this worker tracks itself."""
+        key = (name, json.dumps(labels, sort_keys=True))
+        with self._lock:
+            self._worker_id()
+            self._series[key] = [None, value, 0]
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception:
+                logger.warning("Metrics collector %r failed", collect, exc_info=True)
+        with self._lock:
+            worker = self._worker_id()
+            rows = [
+                (worker, name, labels, json.dumps(series[0]) if series[0] is not None else None, series[1], series[2])
+                for (name, labels), series in self._series.items()
+            ]
+            self._flushed_at = time.monotonic()
+            compact = self._compacted != worker
+            self._compacted = worker
+        if compact:
+            self.compact()
+        if rows:
+            with self.transaction() as conn:
+                conn.executemany('INSERT OR REPLACE INTO metric_series VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def compact(self):
+        """
+        Fold the rows of workers whose process has exited into the retired
+        row of each series. Returns how many workers were folded.
+        """
+        with self.transaction() as conn:
+            workers = [row['worker'] for row in conn.execute('SELECT DISTINCT worker FROM metric_series')]
+            dead = [worker for worker in workers if worker != self.RETIRED and not _worker_alive(worker)]
+            if not dead:
+                return 0
+            folded = [self.RETIRED] + dead
+            placeholders = ', '.join('?' * len(folded))
+            totals = _sum_rows(conn.execute(
+                f'SELECT name, labels, buckets, sum, count FROM metric_series WHERE worker IN ({placeholders})', folded
+            ))
+            conn.execute(f'DELETE FROM metric_series WHERE worker IN ({placeholders})', folded)
+            conn.executemany('INSERT INTO metric_series VALUES (?, ?, ?, ?, ?, ?)', [
+                (self.RETIRED, name, labels, json.dumps(buckets) if buckets is not None else None, total, count)
+                for (name, labels), (buckets, total, count) in totals.items()
+            ])
+        return len(dead)
+
+    def collect(self):
+        """Sum every worker's series: {(name, labels): (buckets or None, sum, count)}."""
+        return _sum_rows(self.connection().execute('SELECT name, labels, buckets, sum, count FROM metric_series'))
+
+    def render(self):
+        """Prometheus text exposition format."""
+        self.flush()
+        by_name = {}
+        for (name, labels), series in sorted(self.collect().items()):
+            by_name.setdefault(name, []).append((json.loads(labels), series))
+        lines = []
+        for name, entries in by_name.items():
+            kind, help_text = self._help.get(name, ('histogram' if entries[0][1][0] is not None else 'counter', ''))
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, (buckets, total, count) in entries:
+                if buckets is None:
+                    lines.append(f'{name}{_labels(labels)} {_number(total)}')
+                    continue
+                # observe() counts a value in every bucket it fits, so these are cumulative
+                for bound, bucket_count in zip(BUCKETS, buckets):
+                    lines.append(f'{name}_bucket{_labels(labels, le=_number(bound))} {bucket_count}')
+                lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {count}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()
+    )
+    return '{' + pairs + '}'
+
+
+def _number(value):
+    return repr(float(value))
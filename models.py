@@ -0,0 +1,141 @@
+"""
+Compact, read-only records for the parts of Spotify API objects the app
+renders. Each upstream call asks for just these fields, and responses
+are parsed once into `__slots__` records, so caches hold a few small
+objects per track instead of full decoded JSON.
+"""
+
+# `fields` projections for endpoints that accept one
+PLAYLIST_FIELDS = 'id,name,description,public,snapshot_id,images(url),owner(display_name),tracks(total)'
+PLAYLIST_PAGE_FIELDS = 'items(track(id,name,artists(name),album(id,images(url)),external_urls(spotify))),total'
+# Full fetches for the search index also need album names
+SEARCH_INDEX_FIELDS = 'items(track(id,name,artists(name),album(id,name,images(url)),external_urls(spotify))),total'
+
+
+def _first_image(images):
+    """URL of the first (largest) image, or None."""
+    if images:
+        return images[0].get('url')
+    return None
+
+
+class Album:
+    __slots__ = ('id', 'image', 'name')
+
+    def __init__(self, id, image=None, name=None):
+        self.id = id
+        self.image = image
+        self.name = name
+
+
+class Track:
+    __slots__ = ('id', 'name', 'artists', 'album', 'url')
+
+    def __init__(self, id, name, artists=(), album=None, url=None):
+        self.id = id
+        self.name = name
+        self.artists = artists
+        self.album = album
+        self.url = url
+
+    @property
+    def artist_names(self):
+        return ', '.join(self.artists)
+
+
+class Playlist:
+    __slots__ = ('id', 'name', 'description', 'public', 'snapshot_id', 'image', 'owner', 'total')
+
+    def __init__(self, id, name=None, description=None, public=None, snapshot_id=None, image=None, owner=None, total=0):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.public = public
+        self.snapshot_id = snapshot_id
+        self.image = image
+        self.owner = owner
+        self.total = total
+
+
+class SavedAlbum:
+    __slots__ = ('id', 'name', 'artist', 'image')
+
+    def __init__(self, id, name=None, artist=None, image=None):
+        self.id = id
+        self.name = name
+        self.artist = artist
+        self.image = image
+
+
+class TrackPage:
+    __slots__ = ('tracks', 'total')
+
+    def __init__(self, tracks, total):
+        self.tracks = tracks
+        self.total = total
+
+
+def parse_playlist(data, playlist_id=None):
+    """Playlist record from a full or simplified playlist object."""
+    return Playlist(
+        data.get('id') or playlist_id,
+        name=data.get('name'),
+        description=data.get('description'),
+        public=data.get('public'),
+        snapshot_id=data.get('snapshot_id'),
+        image=_first_image(data.get('images')),
+        owner=(data.get('owner') or {}).get('display_name'),
+        total=(data.get('tracks') or {}).get('total', 0),
+    )
+
+
+def parse_playlists(data):
+    """Playlist records from a page of the user's playlists (skipping any without an ID)."""
+    return [parse_playlist(item) for item in data.get('items') or [] if item and item.get('id')]
+
+
+def parse_saved_albums(items):
+    """SavedAlbum records from the items of a page of the user's saved albums."""
+    albums = []
+    for item in items or []:
+        album = (item or {}).get('album')
+        if not album or not album.get('id'):
+            continue
+        artists = album.get('artists') or [{}]
+        albums.append(SavedAlbum(album['id'], album.get('name'), artists[0].get('name'), _first_image(album.get('images'))))
+    return albums
+
+
+def as_dict(record):
+    """A record's fields as a dict, for caches that store JSON; `type(record)(**d)` rebuilds it."""
+    return {name: getattr(record, name) for name in record.__slots__}
+
+
+def parse_track_page(data):
+    """
+    TrackPage from a page of playlist items. Tracks from the same album
+    share one Album record; removed or local tracks without an item are
+    skipped.
+    """
+    albums = {}
+    tracks = []
+    for item in data.get('items') or []:
+        track = item.get('track') if item else None
+        if not track:
+            continue
+        album = None
+        album_data = track.get('album')
+        if album_data and album_data.get('id'):
+            album = albums.get(album_data['id'])
+            if album is None:
+                album = albums[album_data['id']] = Album(
+                    album_data['id'], _first_image(album_data.get('images')), album_data.get('name')
+                )
+        tracks.append(Track(
+            track.get('id'),
+            track.get('name'),
+            tuple(artist['name'] for artist in track.get('artists') or () if artist.get('name')),
+            album,
+            (track.get('external_urls') or {}).get('spotify'),
+        ))
+    return TrackPage(tuple(tracks), data.get('total', len(tracks)))
@@ -0,0 +1,126 @@
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SpotifyPageError(Exception):
+    """An upstream page or batch request returned a non-success status."""
+
+    def __init__(self, endpoint, status_code):
+        super().__init__(f"{endpoint} returned {status_code}")
+        self.endpoint = endpoint
+        self.status_code = status_code
+
+
+def _fetch_page(client, endpoint, token, offset, limit, path=None, params=None):
+    resp = client.get(endpoint, token, path=path, params={**(params or {}), 'limit': limit, 'offset': offset})
+    if resp.status_code != 200:
+        raise SpotifyPageError(endpoint, resp.status_code)
+    return resp.json()
+
+
+def fetch_spotify_items_with_pagination(client, endpoint, token, offset=0, limit=20, item_key="items", path=None, params=None):
+    """
+    Utility to fetch paginated data from Spotify API.
+    `endpoint` is a SPOTIFY_API key such as 'user.albums'.
+    Returns: items, total, next_offset, prev_offset
+    """
+    try:
+        data = _fetch_page(client, endpoint, token, offset, limit, path, params)
+    except SpotifyPageError:
+        return [], 0, None, None
+    items = data.get(item_key, [])
+    total = data.get('total', 0)
+    next_offset = offset + limit if offset + limit < total else None
+    prev_offset = offset - limit if offset - limit >= 0 else (0 if offset > 0 else None)
+    return items, total, next_offset, prev_offset
+
+
+def _ordered(executor, calls, window):
+    """
+    Submit `calls` (zero-argument callables) keeping at most `window` in
+    flight, and yield their results in submission order.
+    """
+    calls = iter(calls)
+    pending = deque()
+
+    def submit_next():
+        call = next(calls, None)
+        if call is not None:
+            pending.append(executor.submit(contextvars.copy_context().run, call))
+
+    for _ in range(window):
+        submit_next()
+    while pending:
+        result = pending.popleft().result()
+        submit_next()
+        yield result
+
+
+def iter_all_items(client, endpoint, token, path=None, params=None, limit=50, max_workers=4, item_key='items'):
+    """
+    Yield every item of a paginated Spotify collection, in order.
+
+    The first page gives `total`, so the remaining offsets are fetched
+    concurrently with at most `max_workers` pages in flight; memory stays
+    bounded by that window however large the collection is. Raises
+    SpotifyPageError if any page fails. Endpoints that take a `fields`
+    filter must include `total` in it.
+    """
+    first = _fetch_page(client, endpoint, token, 0, limit, path, params)
+    yield from first.get(item_key, [])
+    total = first.get('total') or 0
+    if total <= limit:
+        return
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='spotify-pages')
+    try:
+        pages = (
+            (lambda offset=offset: _fetch_page(client, endpoint, token, offset, limit, path, params))
+            for offset in range(limit, total, limit)
+        )
+        for data in _ordered(executor, pages, max_workers):
+            yield from data.get(item_key, [])
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def put_in_batches(client, endpoint, token, ids, batch_size=50, max_workers=4):
+    """
+    PUT `ids` to a library endpoint in batches of `batch_size`, with up to
+    `max_workers` batches in flight. Yields (batch, succeeded) in batch
+    order, so callers can checkpoint after each one.
+    """
+    batches = [ids[i:i+batch_size] for i in range(0, len(ids), batch_size)]
+    if not batches:
+        return
+
+    def save(batch):
+        resp = client.put(endpoint, token, json={'ids': batch})
+        return batch, resp.status_code in (200, 201)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='spotify-batches')
+    try:
+        yield from _ordered(executor, ((lambda batch=batch: save(batch)) for batch in batches), max_workers)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def check_in_batches(client, endpoint, token, ids, batch_size=50, max_workers=4):
+    """
+    Ask a `contains` endpoint about `ids` in batches of `batch_size`, with
+    up to `max_workers` batches in flight. Yields (batch, flags) in batch
+    order; `flags` is None when the batch's request failed.
+    """
+    batches = [ids[i:i+batch_size] for i in range(0, len(ids), batch_size)]
+    if not batches:
+        return
+
+    def check(batch):
+        resp = client.get(endpoint, token, params={'ids': ','.join(batch)})
+        return batch, resp.json() if resp.status_code == 200 else None
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='spotify-batches')
+    try:
+        yield from _ordered(executor, ((lambda batch=batch: check(batch)) for batch in batches), max_workers)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
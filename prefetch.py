@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Runs speculative background work, such as warming the next page of a
+    playlist, on a small per-process thread pool.
+
+    Each user has at most one prefetch waiting to start: scheduling
+    another supersedes it, since the user has navigated past the page it
+    would warm, and the superseded one is dropped instead of run. At most
+    `per_user` prefetches per user are outstanding (queued or running);
+    once that many are running, new ones are skipped. Nothing is
+    scheduled while `paused()` returns true (e.g. while Spotify is
+    throttling us). Warmed keys are remembered for `ttl` seconds so
+    `claim()` can count hits.
+    """
+
+    def __init__(self, max_workers=2, per_user=1, ttl=120, paused=None):
+        self.max_workers = max_workers
+        self.per_user = per_user
+        self.paused = paused
+        self._warmed = TTLCache(ttl=ttl, max_entries=4096)
+        self._generations = {}
+        self._outstanding = {}
+        self._queued = set()
+        self._idle = threading.Condition()
+        self._executor = None
+        self._executor_pid = None
+        self.scheduled = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+        self.hits = 0
+        self.misses = 0
+
+    def executor(self):
+        with self._idle:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='spotiplay-prefetch')
+                self._executor_pid = os.getpid()
+                self._generations = {}
+                self._outstanding = {}
+                self._queued = set()
+            return self._executor
+
+    def schedule(self, user, key, fn, *args):
+        """Queue `fn(*args)` to warm `key` for `user`; returns False if it was skipped."""
+        executor = self.executor()
+        if self.paused is not None and self.paused():
+            self.skipped += 1
+            return False
+        with self._idle:
+            if user in self._queued:
+                # Takes over the slot of the queued prefetch it supersedes
+                self.dropped += 1
+            elif self._outstanding.get(user, 0) >= self.per_user:
+                self.skipped += 1
+                return False
+            else:
+                self._outstanding[user] = self._outstanding.get(user, 0) + 1
+            generation = self._generations.get(user, 0) + 1
+            self._generations[user] = generation
+            self._queued.add(user)
+            self.scheduled += 1
+        executor.submit(self._run, user, generation, key, fn, args)
+        return True
+
+    def _run(self, user, generation, key, fn, args):
+        with self._idle:
+            if self._generations.get(user) != generation:
+                # Superseded while queued; its slot went to the newer prefetch
+                return
+            self._queued.discard(user)
+        try:
+            fn(*args)
+            self._warmed.set(key, True)
+            self.completed += 1
+        except Exception:
+            self.failed += 1
+            logger.warning("Prefetch of %s failed", key, exc_info=True)
+        finally:
+            with self._idle:
+                self._outstanding[user] -= 1
+                if not self._outstanding[user]:
+                    del self._outstanding[user]
+                self._idle.notify_all()
+
+    def claim(self, key):
+        """Count whether a request for `key` found it prefetched."""
+        if self._warmed.get(key) is not None:
+            self._warmed.delete(key)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def wait_idle(self, timeout=None):
+        """Wait until no prefetches are outstanding; returns False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._outstanding, timeout)
+
+    def stats(self):
+        claimed = self.hits + self.misses
+        return {
+            'scheduled': self.scheduled,
+            'skipped': self.skipped,
+            'dropped': self.dropped,
+            'completed': self.completed,
+            'failed': self.failed,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / claimed, 3) if claimed else None,
+        }
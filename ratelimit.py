@@ -0,0 +1,176 @@
+import threading
+import time
+
+from sqlite_store import SQLiteStore
+
+
+class RateLimitScheduler(SQLiteStore):
+    """
+    Token-bucket scheduler for Spotify API calls, shared by every worker
+    process on the host through a SQLite file.
+
+    There is one bucket per Spotify client ID, because that is what
+    Spotify rate-limits. A 429 blocks the bucket until its Retry-After has
+    passed and halves the allowed concurrency. Concurrency then creeps back
+    up once `recovery` seconds pass without another throttle.
+
+    To keep the shared write lock off most calls, a process takes up to
+    `lease` tokens per write and hands them out from memory; leased tokens
+    still unused after `lease_ttl` seconds are given up. Callers that have
+    to wait only read the bucket. Counters of how long callers spent
+    queued are kept per process, in `stats()`.
+    """
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            blocked_until REAL NOT NULL DEFAULT 0,
+            last_throttled REAL NOT NULL DEFAULT 0,
+            concurrency REAL NOT NULL
+        )
+        """,
+    )
+
+    def __init__(self, path, key, rate=20.0, burst=40, max_concurrency=8, min_concurrency=1, recovery=30.0,
+                 lease=4, lease_ttl=1.0):
+        if not key:
+            # A NULL key would never match its own row
+            raise ValueError('RateLimitScheduler needs a bucket key (the Spotify client ID)')
+        super().__init__(path)
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.recovery = recovery
+        self.lease = max(1, lease)
+        self.lease_ttl = lease_ttl
+        self._lock = threading.Lock()
+        self._leased = 0
+        self._lease_expires = 0.0
+        self.acquired = 0
+        self.queued = 0
+        self.queued_seconds = 0.0
+        self.throttles = 0
+        self.retries = 0
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO rate_limit_buckets (key, tokens, updated_at, concurrency) VALUES (?, ?, ?, ?)',
+                (key, burst, time.time(), max_concurrency)
+            )
+
+    def _bucket(self, conn):
+        return conn.execute('SELECT * FROM rate_limit_buckets WHERE key = ?', (self.key,)).fetchone()
+
+    def _tokens(self, bucket, now):
+        return min(self.burst, bucket['tokens'] + (now - bucket['updated_at']) * self.rate)
+
+    def _wait(self, bucket, now):
+        """Seconds until `bucket` has a token for us, or 0."""
+        if now < bucket['blocked_until']:
+            return bucket['blocked_until'] - now
+        tokens = self._tokens(bucket, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def _take_leased(self):
+        with self._lock:
+            if self._leased and time.monotonic() < self._lease_expires:
+                self._leased -= 1
+                return True
+            self._leased = 0
+            return False
+
+    def _take(self):
+        """Try to take a token; return 0 on success or the seconds to wait."""
+        if self._take_leased():
+            return 0.0
+        # Finding out we have to wait changes nothing, so it needs no write lock
+        wait = self._wait(self._bucket(self.connection()), time.time())
+        if wait:
+            return wait
+        with self.transaction() as conn:
+            bucket = self._bucket(conn)
+            now = time.time()
+            wait = self._wait(bucket, now)
+            if wait:
+                return wait
+            tokens = self._tokens(bucket, now)
+            taken = min(self.lease, int(tokens))
+            concurrency = bucket['concurrency']
+            if concurrency < self.max_concurrency and now - bucket['last_throttled'] > self.recovery:
+                concurrency = min(self.max_concurrency, concurrency + 0.1)
+            conn.execute(
+                'UPDATE rate_limit_buckets SET tokens = ?, updated_at = ?, concurrency = ? WHERE key = ?',
+                (tokens - taken, now, concurrency, self.key)
+            )
+        with self._lock:
+            self._leased += taken - 1
+            self._lease_expires = time.monotonic() + self.lease_ttl
+        return 0.0
+
+    def acquire(self, timeout=None):
+        """
+        Block until the bucket allows another call. Returns the seconds
+        spent queued, or None if `timeout` passed first.
+        """
+        start = time.monotonic()
+        queued = 0.0
+        while True:
+            wait = self._take()
+            if not wait:
+                self._count(queued, acquired=1)
+                return queued
+            queued = time.monotonic() - start
+            if timeout is not None and queued + wait > timeout:
+                self._count(queued, acquired=0)
+                return None
+            time.sleep(min(wait, 1.0))
+
+    def _count(self, queued_seconds, acquired):
+        with self._lock:
+            self.acquired += acquired
+            if queued_seconds:
+                self.queued += 1
+                self.queued_seconds += queued_seconds
+
+    def throttled(self, retry_after):
+        """Record a 429: block the bucket for `retry_after` seconds and back off concurrency."""
+        now = time.time()
+        with self._lock:
+            self._leased = 0
+            self.throttles += 1
+        with self.transaction() as conn:
+            conn.execute(
+                'UPDATE rate_limit_buckets SET blocked_until = MAX(blocked_until, ?), last_throttled = ?, '
+                'concurrency = MAX(?, concurrency / 2), tokens = 0, updated_at = ? WHERE key = ?',
+                (now + retry_after, now, self.min_concurrency, now, self.key)
+            )
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def concurrency(self):
+        """The number of parallel calls a single fan-out should currently use."""
+        row = self.connection().execute('SELECT concurrency FROM rate_limit_buckets WHERE key = ?', (self.key,)).fetchone()
+        return max(self.min_concurrency, int(row['concurrency']))
+
+    def is_throttled(self):
+        row = self.connection().execute('SELECT blocked_until FROM rate_limit_buckets WHERE key = ?', (self.key,)).fetchone()
+        return time.time() < row['blocked_until']
+
+    def stats(self):
+        """This process's counters, plus the shared bucket's current state."""
+        with self._lock:
+            stats = {
+                'acquired': self.acquired,
+                'queued': self.queued,
+                'queued_seconds': self.queued_seconds,
+                'throttled': self.throttles,
+                'retries': self.retries,
+            }
+        stats['concurrency'] = self.concurrency()
+        stats['throttled_now'] = self.is_throttled()
+        return stats
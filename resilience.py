@@ -0,0 +1,129 @@
+import contextvars
+import threading
+import time
+
+# Monotonic time by which the current request's upstream calls must finish.
+# FanOut copies the context into its workers, so the budget follows calls
+# made from the pool.
+_deadline = contextvars.ContextVar('spotify_deadline', default=None)
+
+
+def start_deadline(seconds):
+    """Start a deadline budget of `seconds` (never extending an outer one); returns a reset token."""
+    expires_at = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        expires_at = min(expires_at, current)
+    return _deadline.set(expires_at)
+
+
+def end_deadline(token):
+    _deadline.reset(token)
+
+
+def clear_deadline():
+    _deadline.set(None)
+
+
+def remaining():
+    """Seconds left in the current budget, or None outside of one."""
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return max(expires_at - time.monotonic(), 0.0)
+
+
+# Circuit states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _Circuit:
+    __slots__ = ('state', 'failures', 'opened_at', 'trial_started')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # When the half-open trial call went out, or None while none is out
+        self.trial_started = None
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker for one worker process.
+
+    After `failure_threshold` consecutive failures (timeouts, connection
+    errors, 5xx) an endpoint's circuit opens and calls fail fast for
+    `reset_timeout` seconds. Then a single trial call is let through:
+    success closes the circuit, failure opens it again. A trial that ends
+    without an outcome is released, and one that is still out after
+    another `reset_timeout` stops holding the circuit, so an endpoint
+    can't stay half-open for good.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._circuits = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if circuit.state == OPEN and now - circuit.opened_at >= self.reset_timeout:
+                circuit.state = HALF_OPEN
+                circuit.trial_started = None
+            if circuit.state == HALF_OPEN and (
+                circuit.trial_started is None or now - circuit.trial_started >= self.reset_timeout
+            ):
+                circuit.trial_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self, key):
+        """
+        A call let through by `allow` ended without reaching the endpoint
+        (e.g. its deadline ran out first); let another trial through.
+        """
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is not None and circuit.state == HALF_OPEN:
+                circuit.trial_started = None
+
+    def success(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is not None:
+                circuit.state = CLOSED
+                circuit.failures = 0
+
+    def failure(self, key):
+        with self._lock:
+            circuit = self._circuits.setdefault(key, _Circuit())
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or circuit.failures >= self.failure_threshold:
+                circuit.state = OPEN
+                circuit.opened_at = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._circuits.clear()
+
+    def state(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            return circuit.state if circuit is not None else CLOSED
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open': sorted(key for key, circuit in self._circuits.items() if circuit.state != CLOSED),
+                'rejected': self.rejected,
+            }
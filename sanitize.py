@@ -0,0 +1,81 @@
+import hashlib
+import threading
+from functools import partial
+
+from markupsafe import Markup
+
+from cache import TTLCache
+
+# What a playlist description may keep: plain links to web pages
+ALLOWED_TAGS = frozenset({'a'})
+ALLOWED_ATTRIBUTES = {'a': ['href', 'rel', 'target']}
+ALLOWED_PROTOCOLS = frozenset({'http', 'https'})
+
+
+def _external_link(attrs, new=False):
+    """Linkify callback: open links in a new tab without handing over the opener."""
+    if (None, 'href') in attrs:
+        attrs[(None, 'rel')] = 'nofollow noopener noreferrer'
+        attrs[(None, 'target')] = '_blank'
+    return attrs
+
+
+class DescriptionSanitizer:
+    """
+    Turns user-written playlist descriptions into safe HTML: only http(s)
+    links survive, and bare URLs become links. The bleach Cleaner (with
+    its linkify filter) is built once per thread, since Cleaners aren't
+    thread-safe; output is cached by a hash of the input, holding at most
+    `max_entries` descriptions. A description's HTML depends only on its
+    text, so entries never go stale and are only evicted.
+    """
+
+    def __init__(self, max_entries=2048):
+        self._cache = TTLCache(ttl=float('inf'), max_entries=max_entries)
+        self._local = threading.local()
+
+    def _cleaner(self):
+        cleaner = getattr(self._local, 'cleaner', None)
+        if cleaner is None:
+            # Imported on first use: most requests never sanitize anything
+            from bleach.linkifier import LinkifyFilter
+            from bleach.sanitizer import Cleaner
+            cleaner = self._local.cleaner = Cleaner(
+                tags=ALLOWED_TAGS,
+                attributes=ALLOWED_ATTRIBUTES,
+                protocols=ALLOWED_PROTOCOLS,
+                strip=True,
+                filters=[partial(LinkifyFilter, callbacks=[_external_link], parse_email=False)]
+            )
+        return cleaner
+
+    def sanitize(self, text):
+        """Safe HTML (as Markup) for `text`; empty for a missing description."""
+        return self.sanitize_many([text])[0]
+
+    def sanitize_many(self, texts):
+        """
+        Safe HTML for each of `texts`, in order. Repeated texts are looked
+        up and cleaned once, so a whole dashboard of descriptions costs one
+        pass.
+        """
+        results = {}
+        cleaner = None
+        for text in texts:
+            if not text or text in results:
+                continue
+            key = hashlib.sha256(text.encode()).digest()
+            html = self._cache.get(key)
+            if html is None:
+                if cleaner is None:
+                    cleaner = self._cleaner()
+                html = Markup(cleaner.clean(text))
+                self._cache.set(key, html)
+            results[text] = html
+        return [results[text] if text else Markup('') for text in texts]
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,242 @@
+import logging
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import SHARED, SingleFlight, TTLCache
+from models import Track
+
+logger = logging.getLogger(__name__)
+
+# Searchable parts of a track
+FIELDS = ('name', 'artist', 'album')
+
+_WORD = re.compile(r'\w+')
+# Sorts after any token that starts with a given prefix
+_PREFIX_END = '\U0010ffff'
+
+
+def tokenize(text):
+    """Lowercased words of `text` with accents stripped, so 'Beyoncé' matches 'beyonce'."""
+    if not text:
+        return []
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return _WORD.findall(''.join(char for char in decomposed if not unicodedata.combining(char)))
+
+
+class _FieldIndex:
+    """Sorted tokens with a parallel posting list (track positions) for each."""
+    __slots__ = ('tokens', 'postings')
+
+    def __init__(self, postings):
+        self.tokens = tuple(sorted(postings))
+        self.postings = tuple(postings[token] for token in self.tokens)
+
+    def prefix(self, term):
+        """Positions of tracks with a token starting with `term`."""
+        start = bisect_left(self.tokens, term)
+        end = bisect_left(self.tokens, term + _PREFIX_END, start)
+        for postings in self.postings[start:end]:
+            yield from postings
+
+
+class PlaylistIndex:
+    """
+    Prefix index over a playlist's tracks, built once from a full fetch.
+
+    Tracks are kept as columns (album records shared between their
+    tracks) and each field's tokens map to `array` posting lists, so a
+    large playlist costs a few compact objects per track. Every query
+    word has to match the start of a word in one of the searched fields.
+    Results are track positions in playlist order. The index is read-only
+    once built, so threads can share it.
+    """
+
+    def __init__(self, tracks):
+        albums = []
+        album_positions = {}
+        ids, names, artists, urls = [], [], [], []
+        track_albums = array('i')
+        postings = {field: {} for field in FIELDS}
+        for position, track in enumerate(tracks):
+            ids.append(track.id)
+            names.append(track.name)
+            artists.append(track.artists)
+            urls.append(track.url)
+            album = track.album
+            if album is None:
+                track_albums.append(-1)
+            else:
+                if album.id not in album_positions:
+                    album_positions[album.id] = len(albums)
+                    albums.append(album)
+                track_albums.append(album_positions[album.id])
+            words = {
+                'name': tokenize(track.name),
+                'artist': tokenize(' '.join(track.artists)),
+                'album': tokenize(album.name) if album is not None else (),
+            }
+            for field, tokens in words.items():
+                field_postings = postings[field]
+                for token in set(tokens):
+                    field_postings.setdefault(token, array('I')).append(position)
+        self._ids = tuple(ids)
+        self._names = tuple(names)
+        self._artists = tuple(artists)
+        self._urls = tuple(urls)
+        self._albums = tuple(albums)
+        self._track_albums = track_albums
+        self._fields = {field: _FieldIndex(postings[field]) for field in FIELDS}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def search(self, query, fields=FIELDS):
+        """Positions of the tracks matching every word of `query` in any of `fields`."""
+        terms = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not terms:
+            return list(range(len(self)))
+        matches = None
+        # Longest terms first: they usually match least
+        for term in terms:
+            term_matches = set()
+            for field in fields:
+                term_matches.update(self._fields[field].prefix(term))
+            matches = term_matches if matches is None else matches & term_matches
+            if not matches:
+                return []
+        return sorted(matches)
+
+    def track_id(self, position):
+        return self._ids[position]
+
+    def tracks(self, positions):
+        """Track records for `positions`, for rendering."""
+        result = []
+        for position in positions:
+            album = self._track_albums[position]
+            result.append(Track(
+                self._ids[position],
+                self._names[position],
+                self._artists[position],
+                self._albums[album] if album >= 0 else None,
+                self._urls[position],
+            ))
+        return result
+
+
+class PlaylistIndexCache:
+    """
+    PlaylistIndex per playlist snapshot, holding at most `max_entries`
+    indexes for `ttl` seconds each. A playlist whose `snapshot_id` changes
+    gets a new index on its next search. Indexes of public playlists are
+    shared by every user; others only by the user who built them.
+    Concurrent builds of the same index share one full fetch.
+
+    Requests use `ready()`, which never waits: a missing index is built on
+    a small per-process thread pool, outside any request's deadline, and
+    the caller asks again later. A build that fails isn't retried for
+    `retry_after` seconds. A playlist without a `snapshot_id` can't be
+    told apart from its later versions, so its index is only kept for
+    `unversioned_ttl` seconds. The playlist record each index was built
+    from is kept alongside it, so searches needn't refetch metadata.
+    """
+
+    def __init__(self, ttl=600, max_entries=32, max_workers=2, retry_after=30, unversioned_ttl=30):
+        self.max_workers = max_workers
+        self._indexes = TTLCache(ttl, max_entries)
+        self._unversioned = TTLCache(unversioned_ttl, max_entries)
+        self._playlists = TTLCache(ttl, max_entries)
+        self._failed = TTLCache(retry_after, max_entries)
+        self._flight = SingleFlight()
+        self._building = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def _key(self, user, playlist):
+        return (SHARED if playlist.public is True else user, playlist.id, playlist.snapshot_id)
+
+    def _cache(self, key):
+        return self._indexes if key[2] else self._unversioned
+
+    def playlist(self, user, playlist_id):
+        """The playlist record `playlist_id` was last searched with, as visible to `user`, or None."""
+        for scope in (SHARED, user):
+            playlist = self._playlists.get((scope, playlist_id))
+            if playlist is not None:
+                return playlist
+        return None
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='spotiplay-index')
+                self._executor_pid = os.getpid()
+                self._building = set()
+            return self._executor
+
+    def index(self, user, playlist, load):
+        """
+        The index for `playlist`, calling `load()` (which returns every
+        Track of the playlist, or None) to build it on a miss.
+        """
+        key = self._key(user, playlist)
+        index = self._cache(key).get(key)
+        if index is None:
+            index, _ = self._flight.do(key, lambda: self._build(key, load))
+        return index
+
+    def ready(self, user, playlist, load):
+        """
+        (index, state) for `playlist` without waiting: state is 'ready'
+        with the index, or 'building' or 'failed' with None. 'building'
+        means a background build (calling `load()` as for `index`) is under
+        way.
+        """
+        key = self._key(user, playlist)
+        self._playlists.set(key[:2], playlist)
+        index = self._cache(key).get(key)
+        if index is not None:
+            return index, 'ready'
+        if self._failed.get(key) is not None:
+            return None, 'failed'
+        executor = self.executor()
+        with self._lock:
+            if key in self._building:
+                return None, 'building'
+            self._building.add(key)
+        executor.submit(self._build_in_background, key, user, playlist, load)
+        return None, 'building'
+
+    def _build_in_background(self, key, user, playlist, load):
+        try:
+            if self.index(user, playlist, load) is None:
+                self._failed.set(key, True)
+        except Exception:
+            logger.warning("Building the search index of playlist %s failed", playlist.id, exc_info=True)
+            self._failed.set(key, True)
+        finally:
+            with self._lock:
+                self._building.discard(key)
+
+    def _build(self, key, load):
+        tracks = load()
+        if tracks is None:
+            return None
+        index = PlaylistIndex(tracks)
+        self._cache(key).set(key, index)
+        return index
+
+    def clear(self):
+        self._indexes.clear()
+        self._unversioned.clear()
+        self._playlists.clear()
+        self._failed.clear()
+
+    def stats(self):
+        return {**self._indexes.stats(), 'coalesced': self._flight.coalesced}
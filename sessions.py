@@ -0,0 +1,180 @@
+import json
+import re
+import secrets
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from sqlite_store import SQLiteStore
+
+_SESSION_ID = re.compile(r'[A-Za-z0-9_-]{43}')
+
+
+class SessionStore(SQLiteStore):
+    """
+    Server-side session data, plus small per-user values (keyed by
+    whatever stable user key the caller has) that every worker process can
+    read. Reads are single SELECTs on the calling thread's connection; in
+    WAL mode they never wait for a writer.
+    """
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        'CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)',
+        """
+        CREATE TABLE IF NOT EXISTS user_data (
+            user TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (user, key)
+        ) WITHOUT ROWID
+        """,
+        'CREATE INDEX IF NOT EXISTS user_data_expires_at ON user_data (expires_at)',
+    )
+
+    def load(self, session_id):
+        """(data, expires_at) for a live session, or None."""
+        row = self.connection().execute(
+            'SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?', (session_id, time.time())
+        ).fetchone()
+        return (row['data'], row['expires_at']) if row else None
+
+    def save(self, session_id, data, expires_at):
+        self.connection().execute(
+            'INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)', (session_id, data, expires_at)
+        )
+
+    def create(self, data, expires_at):
+        """Store a new session under a fresh ID, clearing out expired ones first."""
+        session_id = secrets.token_urlsafe(32)
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+            conn.execute('DELETE FROM user_data WHERE expires_at <= ?', (now,))
+            conn.execute('INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)', (session_id, data, expires_at))
+        return session_id
+
+    def delete(self, session_id):
+        self.connection().execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+    def get_user_value(self, user, key, default=None):
+        """A JSON value stored for `user`, or `default` if it's missing or expired."""
+        row = self.connection().execute(
+            'SELECT value FROM user_data WHERE user = ? AND key = ? AND expires_at > ?', (user, key, time.time())
+        ).fetchone()
+        return json.loads(row['value']) if row else default
+
+    def set_user_value(self, user, key, value, ttl):
+        self.connection().execute(
+            'INSERT OR REPLACE INTO user_data (user, key, value, expires_at) VALUES (?, ?, ?, ?)',
+            (user, key, json.dumps(value), time.time() + ttl)
+        )
+
+    def delete_user_values(self, user, prefix=''):
+        """Drop `user`'s values, or just those whose key starts with `prefix`."""
+        self.connection().execute(
+            'DELETE FROM user_data WHERE user = ? AND substr(key, 1, ?) = ?', (user, len(prefix), prefix)
+        )
+
+    def clear_user_values(self):
+        """Forget every user's values."""
+        self.connection().execute('DELETE FROM user_data')
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session contents loaded from a SessionStore; the cookie holds only `sid`."""
+
+    def __init__(self, initial=None, sid=None, expires_at=0):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """
+    Flask session interface backed by a SessionStore. Sessions expire
+    PERMANENT_SESSION_LIFETIME after their last write. Requests that don't
+    change the session only write to extend its expiry, at most once every
+    `touch_interval` seconds. The session ID is random and unguessable,
+    so it isn't signed.
+    """
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSession
+
+    def __init__(self, store, touch_interval=300):
+        self.store = store
+        self.touch_interval = touch_interval
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SESSION_ID.fullmatch(sid):
+            record = self.store.load(sid)
+            if record is not None:
+                data, expires_at = record
+                return self.session_class(self.serializer.loads(data), sid=sid, expires_at=expires_at)
+        return self.session_class()
+
+    def regenerate(self, session):
+        """Move the session to a new ID (at login), so an ID handed out before it can't be reused."""
+        if session.sid is not None:
+            self.store.delete(session.sid)
+            session.sid = None
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session:
+            if session.modified and session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly)
+            return
+
+        now = time.time()
+        expires_at = now + app.permanent_session_lifetime.total_seconds()
+        new = session.sid is None
+        if new:
+            session.sid = self.store.create(self.serializer.dumps(dict(session)), expires_at)
+        elif session.modified or expires_at - session.expires_at >= self.touch_interval:
+            self.store.save(session.sid, self.serializer.dumps(dict(session)), expires_at)
+        else:
+            return
+        session.expires_at = expires_at
+        if new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name, session.sid, expires=self.get_expiration_time(app, session), httponly=httponly,
+                domain=domain, path=path, secure=secure, samesite=samesite
+            )
@@ -0,0 +1,126 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import httpx
+
+from spotify_client import BaseSpotifyClient, SpotifyUnavailable
+
+
+class AsyncSpotifyClient(BaseSpotifyClient):
+    """
+    Async Spotify Web API client backed by one pooled httpx.AsyncClient.
+
+    Flask runs each async view in its own short-lived event loop, which
+    can't share a connection pool. So the httpx client lives on a
+    dedicated loop thread owned by this object, and views await calls that
+    are handed to that loop. Every request in the worker process then
+    shares the same kept-alive connections. Endpoint keys, auth headers,
+    rate limiting, deadlines, circuit breaking, 401 token refresh and
+    timings match SpotifyClient; requests are not hedged.
+    """
+
+    def __init__(self, api_urls, pool_size=10, transport=None, **kwargs):
+        super().__init__(api_urls, **kwargs)
+        self.pool_size = pool_size
+        self.transport = transport
+        self._loop = None
+        self._thread = None
+        self._http = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run_loop, args=(loop,), name='spotify-async', daemon=True)
+                self._thread.start()
+                self._http = asyncio.run_coroutine_threadsafe(self._make_http(), loop).result()
+                self._loop = loop
+        return self._loop
+
+    @staticmethod
+    def _run_loop(loop):
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    async def _make_http(self):
+        return httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            timeout=self.timeout,
+            transport=self.transport
+        )
+
+    async def request(self, method, endpoint, token=None, path=None, url=None, headers=None, **kwargs):
+        """Await a request against a SPOTIFY_API endpoint from any event loop."""
+        self._check_circuit(endpoint)
+        # Run on the client's loop in a copy of the caller's context, so the
+        # request's deadline budget and timings recorder come along
+        future = asyncio.run_coroutine_threadsafe(
+            self._in_context(contextvars.copy_context(), self._request(method, endpoint, token, path, url, headers, kwargs)),
+            self._ensure_loop()
+        )
+        try:
+            return await asyncio.wrap_future(future)
+        except BaseException:
+            self._release_circuit(endpoint)
+            raise
+
+    @staticmethod
+    async def _in_context(context, coro):
+        return await asyncio.get_running_loop().create_task(coro, context=context)
+
+    async def get(self, endpoint, token=None, **kwargs):
+        return await self.request('GET', endpoint, token, **kwargs)
+
+    async def put(self, endpoint, token=None, **kwargs):
+        return await self.request('PUT', endpoint, token, **kwargs)
+
+    async def post(self, endpoint, token=None, **kwargs):
+        return await self.request('POST', endpoint, token, **kwargs)
+
+    async def _request(self, method, endpoint, token, path, url, headers, kwargs):
+        resp = await self._attempt(method, endpoint, token, path, url, headers, kwargs)
+        if self._wants_refresh(resp, token):
+            # Refreshing blocks on SQLite and the token endpoint
+            new_token = await asyncio.to_thread(self._refreshed_token, endpoint, token)
+            if new_token is not None:
+                resp = await self._attempt(method, endpoint, new_token, path, url, headers, kwargs)
+        return resp
+
+    async def _attempt(self, method, endpoint, token, path, url, headers, kwargs):
+        target, all_headers, scheduled = self._prepare(endpoint, token, path, url, headers, kwargs)
+        for attempt in range(self.max_retries + 1):
+            if scheduled:
+                # The shared scheduler blocks on SQLite; keep it off the loop
+                acquired = await asyncio.to_thread(self.scheduler.acquire, self._acquire_timeout(endpoint))
+                if acquired is None:
+                    raise SpotifyUnavailable(endpoint, 'rate limit queue exceeded the request deadline')
+            timeout = self._call_timeout(endpoint)
+            start = time.perf_counter()
+            try:
+                resp = await self._http.request(
+                    method, target, headers=all_headers,
+                    timeout=httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout)), **kwargs
+                )
+            except httpx.HTTPError as exc:
+                self._record(endpoint, method, None, time.perf_counter() - start)
+                self._outcome(endpoint, None)
+                raise SpotifyUnavailable(endpoint, exc.__class__.__name__) from exc
+            self._outcome(endpoint, resp.status_code)
+            self._record(endpoint, method, resp.status_code, time.perf_counter() - start, nbytes=len(resp.content))
+            delay = self._retry_delay(resp, endpoint, attempt, scheduled)
+            if delay is None:
+                return resp
+            await asyncio.sleep(delay)
+        return resp
+
+    def close(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._http.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = self._thread = None
@@ -0,0 +1,378 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import resilience
+
+logger = logging.getLogger(__name__)
+
+
+class SpotifyUnavailable(Exception):
+    """A Spotify call failed fast or timed out: open circuit, spent deadline or network error."""
+
+    def __init__(self, endpoint, reason):
+        super().__init__(f"{endpoint}: {reason}")
+        self.endpoint = endpoint
+        self.reason = reason
+
+
+class CallTiming:
+    """Timing record for a single upstream Spotify call."""
+    __slots__ = ('endpoint', 'method', 'status', 'elapsed', 'new_connection')
+
+    def __init__(self, endpoint, method, status, elapsed, new_connection):
+        self.endpoint = endpoint
+        self.method = method
+        self.status = status
+        self.elapsed = elapsed
+        self.new_connection = new_connection
+
+    def as_dict(self):
+        return {
+            'endpoint': self.endpoint,
+            'method': self.method,
+            'status': self.status,
+            'elapsed_ms': round(self.elapsed * 1000, 2),
+            'new_connection': self.new_connection,
+        }
+
+
+class BaseSpotifyClient:
+    """
+    Transport-independent parts of a Spotify Web API client: endpoint
+    resolution from the SPOTIFY_API table, auth headers, rate-limit retry
+    policy, timeouts, circuit breaking and per-endpoint call timings.
+
+    Each call's timeout is `timeout`, shortened to whatever is left of the
+    current request's deadline budget (see resilience.start_deadline).
+    With a `breaker`, endpoints whose circuit is open fail fast with
+    SpotifyUnavailable. `on_call(endpoint, method, status, elapsed, nbytes)`
+    is called after every call, for metrics. With a `token_refresher`, a
+    call Spotify answers with 401 is retried once with the token
+    `token_refresher(token)` returns (if any).
+    """
+
+    def __init__(self, api_urls, history=500, scheduler=None, max_retries=3, backoff=0.5, max_retry_after=10.0,
+                 timeout=10.0, connect_timeout=3.05, breaker=None, on_call=None, token_refresher=None):
+        self.api_urls = api_urls
+        self.on_call = on_call
+        self.token_refresher = token_refresher
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history)
+        self._totals = {}
+
+    def url(self, endpoint, **path):
+        """Resolve a dotted SPOTIFY_API key to a URL, formatting path params."""
+        group, name = endpoint.split('.', 1)
+        url = self.api_urls[group][name]
+        return url.format(**path) if path else url
+
+    @staticmethod
+    def auth_headers(token, json=False):
+        """Build the headers for an authenticated Spotify call."""
+        headers = {'Authorization': f"Bearer {token}"}
+        if json:
+            headers['Content-Type'] = 'application/json'
+        return headers
+
+    def _prepare(self, endpoint, token, path, url, headers, kwargs):
+        target = url or self.url(endpoint, **(path or {}))
+        all_headers = self.auth_headers(token, json='json' in kwargs) if token else {}
+        if headers:
+            all_headers.update(headers)
+        # Token requests go to the accounts service, which isn't rate-limited
+        # together with the Web API.
+        scheduled = self.scheduler is not None and not endpoint.startswith('auth.')
+        return target, all_headers, scheduled
+
+    def _check_circuit(self, endpoint):
+        if self.breaker is not None and not self.breaker.allow(endpoint):
+            raise SpotifyUnavailable(endpoint, 'circuit open')
+
+    def _release_circuit(self, endpoint):
+        """Free the half-open trial slot of a call that ended without an outcome."""
+        if self.breaker is not None:
+            self.breaker.release(endpoint)
+
+    def _call_timeout(self, endpoint):
+        """Timeout for the next call: `timeout`, capped by the remaining deadline budget."""
+        left = resilience.remaining()
+        if left is None:
+            return self.timeout
+        if left <= 0:
+            raise SpotifyUnavailable(endpoint, 'request deadline exceeded')
+        return min(self.timeout, left)
+
+    def _acquire_timeout(self, endpoint):
+        """How long a call may queue for a rate-limit token (None: no limit)."""
+        left = resilience.remaining()
+        if left is not None and left <= 0:
+            raise SpotifyUnavailable(endpoint, 'request deadline exceeded')
+        return left
+
+    def _outcome(self, endpoint, status):
+        """Feed a call's result to the circuit breaker; None means it never got a response."""
+        if self.breaker is None:
+            return
+        if status is None or status >= 500:
+            self.breaker.failure(endpoint)
+        else:
+            self.breaker.success(endpoint)
+
+    def _retry_delay(self, resp, endpoint, attempt, scheduled):
+        """
+        Seconds to sleep before retrying a response, or None to return it.
+        Only 429s are retried; Retry-After is honoured (through the shared
+        scheduler when there is one) and retries are jittered so throttled
+        callers don't return in lockstep.
+        """
+        if resp.status_code != 429 or attempt == self.max_retries:
+            return None
+        retry_after = self._retry_after(resp)
+        if retry_after is not None and retry_after > self.max_retry_after:
+            logger.warning("Spotify asked to retry %s after %ss; giving up", endpoint, retry_after)
+            return None
+        delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        if scheduled:
+            self.scheduler.throttled(retry_after if retry_after is not None else delay)
+            self.scheduler.retried()
+            # The scheduler now holds callers until Retry-After has passed
+            delay = random.uniform(0, self.backoff)
+        elif retry_after is not None:
+            delay = retry_after + random.uniform(0, self.backoff)
+        left = resilience.remaining()
+        if left is not None and delay >= left:
+            logger.warning("Spotify throttled %s past the request deadline; giving up", endpoint)
+            return None
+        logger.info("Spotify throttled %s (attempt %d); retrying in %.2fs", endpoint, attempt + 1, delay)
+        return delay
+
+    def _wants_refresh(self, resp, token):
+        return resp.status_code == 401 and token is not None and self.token_refresher is not None
+
+    def _refreshed_token(self, endpoint, token):
+        """A new token to retry a 401 with, or None to return the 401."""
+        new_token = self.token_refresher(token)
+        if not new_token or new_token == token:
+            return None
+        logger.info("Retrying %s with a refreshed access token", endpoint)
+        return new_token
+
+    @staticmethod
+    def _retry_after(resp):
+        try:
+            return max(float(resp.headers['Retry-After']), 0.0)
+        except (KeyError, ValueError):
+            return None
+
+    def max_concurrency(self, limit):
+        """Cap a caller's parallelism by what the rate limiter currently allows."""
+        if self.scheduler is None:
+            return limit
+        return max(1, min(limit, self.scheduler.concurrency()))
+
+    def _record(self, endpoint, method, status, elapsed, new_connection=None, nbytes=0):
+        if self.on_call is not None:
+            self.on_call(endpoint, method, status, elapsed, nbytes)
+        timing = CallTiming(endpoint, method, status, elapsed, new_connection)
+        with self._lock:
+            self._history.append(timing)
+            totals = self._totals.setdefault(endpoint, {
+                'calls': 0, 'total_time': 0.0,
+                'new_connections': 0, 'new_connection_time': 0.0,
+                'reused_connections': 0, 'reused_connection_time': 0.0,
+            })
+            totals['calls'] += 1
+            totals['total_time'] += elapsed
+            if new_connection:
+                totals['new_connections'] += 1
+                totals['new_connection_time'] += elapsed
+            elif new_connection is False:
+                totals['reused_connections'] += 1
+                totals['reused_connection_time'] += elapsed
+        logger.debug(
+            "Spotify %s %s -> %s in %.1fms (%s connection)",
+            method, endpoint, status, elapsed * 1000,
+            'new' if new_connection else 'reused' if new_connection is False else 'unknown'
+        )
+
+    def recent_calls(self):
+        """Return the most recent call timings, oldest first."""
+        with self._lock:
+            return [timing.as_dict() for timing in self._history]
+
+    def stats(self):
+        """
+        Aggregate timings per endpoint. `handshake_saved_ms` estimates the
+        time saved by keep-alive: the average extra cost of a fresh
+        connection multiplied by the number of reused connections.
+        """
+        with self._lock:
+            totals = {endpoint: dict(values) for endpoint, values in self._totals.items()}
+        summary = {}
+        for endpoint, values in totals.items():
+            new_avg = values['new_connection_time'] / values['new_connections'] if values['new_connections'] else None
+            reused_avg = values['reused_connection_time'] / values['reused_connections'] if values['reused_connections'] else None
+            saved = None
+            if new_avg is not None and reused_avg is not None:
+                saved = max(new_avg - reused_avg, 0.0) * values['reused_connections'] * 1000
+            summary[endpoint] = {
+                'calls': values['calls'],
+                'avg_ms': round(values['total_time'] / values['calls'] * 1000, 2),
+                'new_connections': values['new_connections'],
+                'reused_connections': values['reused_connections'],
+                'avg_new_connection_ms': round(new_avg * 1000, 2) if new_avg is not None else None,
+                'avg_reused_connection_ms': round(reused_avg * 1000, 2) if reused_avg is not None else None,
+                'handshake_saved_ms': round(saved, 2) if saved is not None else None,
+            }
+        return summary
+
+
+class SpotifyClient(BaseSpotifyClient):
+    """
+    Pooled, keep-alive HTTP client for the Spotify Web API.
+
+    Endpoints are addressed by their dotted key in the SPOTIFY_API table
+    (e.g. 'playlists.tracks'), so every call is timed under a stable name.
+    One client is meant to live for the lifetime of a worker process.
+    With a `scheduler`, Web API calls wait for a rate-limit token and 429
+    responses are retried with jittered backoff, honouring Retry-After.
+    With `hedge_after`, a GET still unanswered after that many seconds is
+    sent a second time and whichever response arrives first wins.
+    """
+
+    def __init__(self, api_urls, pool_size=10, pool_block=False, hedge_after=None, **kwargs):
+        super().__init__(api_urls, **kwargs)
+        self.pool_size = pool_size
+        self.hedge_after = hedge_after
+        self._hedge_pool = None
+        self._hedge_lock = threading.Lock()
+        self.hedged = 0
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            pool_block=pool_block
+        )
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def request(self, method, endpoint, token=None, path=None, url=None, headers=None, **kwargs):
+        """
+        Perform a request against a SPOTIFY_API endpoint.
+        `url` overrides the resolved URL (e.g. a `next` link) while keeping
+        the call recorded under `endpoint`.
+        """
+        resp = self._request(method, endpoint, token, path, url, headers, kwargs)
+        if self._wants_refresh(resp, token):
+            new_token = self._refreshed_token(endpoint, token)
+            if new_token is not None:
+                resp = self._request(method, endpoint, new_token, path, url, headers, kwargs)
+        return resp
+
+    def _request(self, method, endpoint, token, path, url, headers, kwargs):
+        target, all_headers, scheduled = self._prepare(endpoint, token, path, url, headers, kwargs)
+        self._check_circuit(endpoint)
+        try:
+            for attempt in range(self.max_retries + 1):
+                if scheduled and self.scheduler.acquire(timeout=self._acquire_timeout(endpoint)) is None:
+                    raise SpotifyUnavailable(endpoint, 'rate limit queue exceeded the request deadline')
+                if method == 'GET' and self.hedge_after:
+                    resp = self._send_hedged(method, endpoint, target, all_headers, kwargs, scheduled)
+                else:
+                    resp = self._send(method, endpoint, target, all_headers, kwargs)
+                delay = self._retry_delay(resp, endpoint, attempt, scheduled)
+                if delay is None:
+                    return resp
+                time.sleep(delay)
+        except BaseException:
+            self._release_circuit(endpoint)
+            raise
+        return resp
+
+    def get(self, endpoint, token=None, **kwargs):
+        return self.request('GET', endpoint, token, **kwargs)
+
+    def put(self, endpoint, token=None, **kwargs):
+        return self.request('PUT', endpoint, token, **kwargs)
+
+    def post(self, endpoint, token=None, **kwargs):
+        return self.request('POST', endpoint, token, **kwargs)
+
+    def _send(self, method, endpoint, url, headers, kwargs):
+        timeout = self._call_timeout(endpoint)
+        kwargs = {'timeout': (min(self.connect_timeout, timeout), timeout), **kwargs}
+        connections_before = self._connection_count(url)
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, url, headers=headers, **kwargs)
+        except requests.RequestException as exc:
+            self._record(endpoint, method, None, time.perf_counter() - start)
+            self._outcome(endpoint, None)
+            raise SpotifyUnavailable(endpoint, exc.__class__.__name__) from exc
+        self._outcome(endpoint, resp.status_code)
+        elapsed = time.perf_counter() - start
+        connections_after = self._connection_count(url)
+        new_connection = None
+        if connections_before is not None and connections_after is not None:
+            new_connection = connections_after > connections_before
+        self._record(endpoint, method, resp.status_code, elapsed, new_connection, len(resp.content))
+        return resp
+
+    def _send_hedged(self, method, endpoint, url, headers, kwargs, scheduled):
+        """
+        Send an idempotent request; if it hasn't answered within
+        `hedge_after` seconds, send it again and return the first response.
+        The hedge is skipped when there's no budget or rate-limit token to
+        spare for it.
+        """
+        pool = self._hedge_executor()
+        first = pool.submit(contextvars.copy_context().run, self._send, method, endpoint, url, headers, kwargs)
+        try:
+            return first.result(timeout=self.hedge_after)
+        except FutureTimeoutError:
+            pass
+        left = resilience.remaining()
+        if (left is not None and left <= self.hedge_after) or (scheduled and self.scheduler.acquire(timeout=0) is None):
+            return first.result()
+        self.hedged += 1
+        logger.info("Hedging slow %s %s", method, endpoint)
+        second = pool.submit(contextvars.copy_context().run, self._send, method, endpoint, url, headers, kwargs)
+        error = None
+        for future in as_completed((first, second)):
+            try:
+                return future.result()
+            except SpotifyUnavailable as exc:
+                error = exc
+        raise error
+
+    def _hedge_executor(self):
+        with self._hedge_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='spotify-hedge')
+            return self._hedge_pool
+
+    def _connection_count(self, url):
+        # urllib3 counts every new connection a host pool opens, so a call
+        # that leaves the count unchanged went over a kept-alive connection.
+        try:
+            return self.adapter.poolmanager.connection_from_url(url).num_connections
+        except Exception:
+            return None
+
+    def close(self):
+        self.session.close()
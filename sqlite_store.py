@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import threading
+
+
+def process_alive(pid):
+    """Whether process `pid` on this host (where the SQLite files are shared) is still running."""
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SQLiteStore:
+    """
+    Small base for state shared by every worker process on a host.
+
+    Each thread gets its own connection (re-opened after fork), the
+    database runs in WAL mode so readers never block the writer, and
+    subclasses create their tables in `SCHEMA`. Columns added after a
+    table first shipped go in `COLUMNS` as (table, column, definition) so
+    existing databases pick them up.
+    """
+    SCHEMA = ()
+    COLUMNS = ()
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self.connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with self.transaction() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            for table, column, definition in self.COLUMNS:
+                existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+    def connection(self):
+        """This thread's autocommit connection, for reads and single statements."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def transaction(self):
+        """Run a block in an immediate (write-locked) transaction."""
+        return _Transaction(self.connection())
+
+
+class _Transaction:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, *exc_info):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
@@ -0,0 +1,13 @@
+import os
+import shutil
+import tempfile
+
+
+def pytest_configure(config):
+    # Runs before test modules import app, whose SQLite stores (sessions,
+    # tokens, jobs, metrics, rate limits) and logs would otherwise land in
+    # the working tree's data/ and logs/ and carry over between runs.
+    state_dir = tempfile.mkdtemp(prefix='spotiplay-tests-')
+    config.add_cleanup(lambda: shutil.rmtree(state_dir, ignore_errors=True))
+    os.environ['DATA_DIR'] = os.path.join(state_dir, 'data')
+    os.environ['LOG_DIR'] = os.path.join(state_dir, 'logs')
@@ -1,16 +1,29 @@
+import hashlib
+import ipaddress
 import os
+import re
 import sys
+import time
 import pytest
 from flask import session
 
 # Ensure app is importable
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from app import app as flask_app
+import app as app_module
+from app import app as flask_app, library_index, playlist_cache, fragment_cache, prefetcher, spotify_breaker, PLAYLIST_PAGE_FIELDS
 
 @pytest.fixture
 def client():
     flask_app.config['TESTING'] = True
     flask_app.config['WTF_CSRF_ENABLED'] = False
+    library_index.clear()
+    playlist_cache.clear()
+    fragment_cache.clear()
+    spotify_breaker.clear()
+    app_module.job_manager.store.clear_sync()
+    app_module.session_store.clear_user_values()
+    app_module.search_indexes.clear()
+    app_module.description_sanitizer.clear()
     with flask_app.test_client() as client:
         with flask_app.app_context():
             yield client
@@ -47,6 +60,26 @@ def test_callback(client, requests_mock, status, data):
         assert resp.status_code == 400
         assert b'Spotify authorization failed' in resp.data
 
+def test_session_token_is_refreshed_before_it_expires(client, requests_mock):
+    token = requests_mock.post('https://accounts.spotify.com/api/token', [
+        {'json': {'access_token': 'FIRST', 'refresh_token': 'R1', 'expires_in': 60}},
+        {'json': {'access_token': 'SECOND', 'expires_in': 3600}},
+    ])
+    profile = requests_mock.get('https://api.spotify.com/v1/me', json={'id': 'testuser'})
+    requests_mock.get('https://api.spotify.com/v1/me/playlists', json={'items': []})
+    client.get('/callback?code=1234')
+    with client.session_transaction() as sess:
+        assert sess['spotify_token'] == 'FIRST'
+        grant_id = sess['spotify_token_id']
+    # FIRST expires within the refresh margin, so the next request swaps it out first
+    assert client.get('/dashboard').status_code == 200
+    assert 'grant_type=refresh_token' in token.last_request.text
+    assert profile.last_request.headers['Authorization'] == 'Bearer SECOND'
+    with client.session_transaction() as sess:
+        assert sess['spotify_token'] == 'SECOND'
+    client.post('/logout')
+    assert app_module.token_manager.store.get(grant_id) is None
+
 def test_dashboard_requires_login(client):
     resp = client.get('/dashboard', follow_redirects=False)
     assert resp.status_code == 302
@@ -76,17 +109,24 @@ def test_playlist_detail(client, requests_mock, api_status, tracks_present):
     playlist_id = 'PL123'
     playlist_url = f'https://api.spotify.com/v1/playlists/{playlist_id}'
     tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
-    playlist_json = {'name': 'Test Playlist', 'images': [], 'tracks': {'total': 1 if tracks_present else 0}}
+    playlist_json = {
+        'name': 'Test Playlist', 'images': [], 'tracks': {'total': 1 if tracks_present else 0},
+        'description': 'Mixed by <a href="https://dj.example">DJ</a><script>alert(1)</script>'
+    }
     if api_status == 200:
         items = [{'track': {'id': 'T1', 'name': 'Track1', 'artists': [{'name': 'Artist1'}], 'album': {'images': [], 'id': 'A1'}, 'external_urls': {}}}] if tracks_present else []
         tracks_json = {'items': items, 'total': 1 if tracks_present else 0}
         requests_mock.get(playlist_url, json=playlist_json, status_code=200)
-        requests_mock.get(f'{tracks_url}?fields=items(track(id,name,artists,album,external_urls)),total,next,previous&offset=0&limit=50', json=tracks_json, status_code=200)
+        requests_mock.get(f'{tracks_url}?fields={PLAYLIST_PAGE_FIELDS}&offset=0&limit=50', json=tracks_json, status_code=200)
         requests_mock.get('https://api.spotify.com/v1/me/albums/contains?ids=A1', json=[False], status_code=200)
         resp = client.get(f'/playlist/{playlist_id}')
         assert resp.status_code == 200
+        assert b'Mixed by <a href="https://dj.example" rel="nofollow noopener noreferrer" target="_blank">DJ</a>' in resp.data
+        assert b'<script>alert' not in resp.data
         if tracks_present:
             assert b'Track1' in resp.data
+            assert b'value="T1" form="bulk-tracks-form"' in resp.data
+            assert b'id="bulk-albums-form"' in resp.data
         else:
             assert b'No tracks found' in resp.data
     else:
@@ -94,6 +134,334 @@ def test_playlist_detail(client, requests_mock, api_status, tracks_present):
         resp = client.get(f'/playlist/{playlist_id}')
         assert resp.status_code == 400
 
+def test_dashboard_renders_playlist_records(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    requests_mock.get('https://api.spotify.com/v1/me', json={'id': 'testuser'}, status_code=200)
+    items = [
+        {'id': 'PL1', 'name': 'Road Trip', 'images': [{'url': 'https://i.scdn.co/image/pl1'}], 'tracks': {'total': 42},
+         'description': 'Songs for the road. More at https://example.com'},
+        {'id': 'PL2', 'name': 'Copy', 'images': [], 'tracks': {'total': 1}, 'description': 'Songs for the road. More at https://example.com'},
+    ]
+    requests_mock.get('https://api.spotify.com/v1/me/playlists', json={'items': items}, status_code=200)
+    resp = client.get('/dashboard')
+    assert b'/playlist/PL1' in resp.data
+    assert b'https://i.scdn.co/image/pl1' in resp.data
+    assert b'42 tracks' in resp.data
+    assert resp.data.count(b'More at <a href="https://example.com" rel="nofollow noopener noreferrer" target="_blank">') == 2
+    assert app_module.description_sanitizer.stats()['entries'] == 1
+
+def test_dashboard_pages_through_playlists_and_caches_everything(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    profile = requests_mock.get('https://api.spotify.com/v1/me', json={'id': 'testuser', 'display_name': 'Tess'})
+
+    def playlist_page(request, context):
+        offset = int(request.qs['offset'][0])
+        return {'items': [{'id': f'PL{i}', 'name': f'List {i}'} for i in range(offset, min(offset + 50, 120))], 'total': 120}
+
+    playlists = requests_mock.get('https://api.spotify.com/v1/me/playlists', json=playlist_page)
+
+    def album_page(request, context):
+        offset = int(request.qs['offset'][0])
+        items = [
+            {'album': {'id': f'A{i}', 'name': f'Album {i}', 'artists': [{'name': 'Band'}], 'images': [{'url': f'https://i.scdn.co/image/a{i}'}]}}
+            for i in range(offset, min(offset + 20, 25))
+        ]
+        return {'items': items, 'total': 25}
+
+    albums = requests_mock.get('https://api.spotify.com/v1/me/albums', json=album_page)
+    resp = client.get('/dashboard')
+    assert b'/playlist/PL0' in resp.data and b'/playlist/PL119' in resp.data
+    assert b'Album 19' in resp.data and b'Album 20' not in resp.data
+    assert b'Albums 1-20 of 25' in resp.data
+    assert playlists.call_count == 3 and albums.call_count == 1
+
+    resp = client.get('/dashboard?album_offset=20', headers={'HX-Request': 'true'})
+    assert b'id="albums-container"' in resp.data and b'Your Playlists' not in resp.data
+    assert b'Albums 21-25 of 25' in resp.data and b'Album 24' in resp.data
+
+    # Revisits and album paging come from the per-user cache
+    assert b'List 119' in client.get('/dashboard').data
+    assert b'Album 24' in client.get('/dashboard?album_offset=20', headers={'HX-Request': 'true'}).data
+    assert (profile.call_count, playlists.call_count, albums.call_count) == (1, 3, 2)
+
+    # Saving an album drops the cached album pages
+    requests_mock.put('https://api.spotify.com/v1/me/albums', status_code=200)
+    client.post('/add_album_to_library/A99')
+    client.get('/dashboard')
+    assert (profile.call_count, playlists.call_count, albums.call_count) == (1, 3, 3)
+
+def test_dashboard_does_not_cache_failures(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    requests_mock.get('https://api.spotify.com/v1/me', json={'id': 'testuser'})
+    playlists = requests_mock.get('https://api.spotify.com/v1/me/playlists', [
+        {'status_code': 500},
+        {'json': {'items': [{'id': 'PL1', 'name': 'Road Trip'}], 'total': 1}},
+    ])
+    requests_mock.get('https://api.spotify.com/v1/me/albums', status_code=500)
+    assert b'No playlists found' in client.get('/dashboard').data
+    resp = client.get('/dashboard')
+    assert b'Road Trip' in resp.data and b'No albums found' in resp.data
+    assert playlists.call_count == 2
+
+def test_playlist_detail_requests_only_rendered_fields(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PL123'
+    playlist_call = requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json={'id': playlist_id, 'name': 'Test Playlist', 'tracks': {'total': 0}}, status_code=200)
+    tracks_call = requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json={'items': [], 'total': 0}, status_code=200)
+    client.get(f'/playlist/{playlist_id}')
+    assert playlist_call.last_request.qs['fields'] == [app_module.PLAYLIST_FIELDS.lower()]
+    assert tracks_call.last_request.qs['fields'] == [PLAYLIST_PAGE_FIELDS.lower()]
+
+def test_playlist_detail_marks_saved_items(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PL123'
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json={'id': playlist_id, 'name': 'Test Playlist', 'images': [], 'tracks': {'total': 1}}, status_code=200)
+    items = [{'track': {'id': 'T1', 'name': 'Track1', 'artists': [{'name': 'Artist1'}], 'album': {'images': [], 'id': 'A1'}, 'external_urls': {}}}]
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json={'items': items, 'total': 1}, status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/albums/contains?ids=A1', json=[True], status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/tracks/contains?ids=T1', json=[True], status_code=200)
+    resp = client.get(f'/playlist/{playlist_id}')
+    assert resp.status_code == 200
+    assert b'Track1' in resp.data
+    assert b'/add_track_to_library/T1' not in resp.data
+    assert b'/add_album_to_library/A1' not in resp.data
+    assert b'bulk-tracks-form' not in resp.data
+
+def test_playlist_all_tracks_streams_every_page(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PLALL'
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json={'id': playlist_id, 'name': 'Big Playlist', 'tracks': {'total': 150}})
+
+    def page(request, context):
+        offset = int(request.qs['offset'][0])
+        items = [
+            {'track': {'id': f'T{i}', 'name': f'Track{i}', 'artists': [], 'album': {'id': f'A{i // 10}', 'images': []}}}
+            for i in range(offset, min(offset + 100, 150))
+        ]
+        return {'items': items, 'total': 150}
+
+    tracks_call = requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json=page)
+    track_checks = requests_mock.get('https://api.spotify.com/v1/me/tracks/contains', json=lambda request, context: [False] * len(request.qs['ids'][0].split(',')))
+    album_checks = requests_mock.get('https://api.spotify.com/v1/me/albums/contains', json=lambda request, context: [True] * len(request.qs['ids'][0].split(',')))
+    resp = client.get(f'/playlist/{playlist_id}/all')
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    html = resp.get_data(as_text=True)
+    assert html.count('Big Playlist</p>') == 1
+    assert all(f'/add_track_to_library/T{i}"' in html for i in range(150))
+    assert '/add_album_to_library/' not in html
+    assert [(int(r.qs['offset'][0]), int(r.qs['limit'][0])) for r in tracks_call.request_history] == [(0, 100), (100, 100)]
+    # Saved state is checked per streamed page, within Spotify's ID limits
+    assert sorted(len(r.qs['ids'][0].split(',')) for r in track_checks.request_history) == [50, 50, 50]
+    assert sorted(len(r.qs['ids'][0].split(',')) for r in album_checks.request_history) == [5, 10]
+
+def test_playlist_all_tracks_continues_after_time_budget(client, requests_mock, monkeypatch):
+    monkeypatch.setattr(app_module.Config, 'STREAM_MAX_SECONDS', 0)
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PLMORE'
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json={'id': playlist_id, 'name': 'Big Playlist', 'tracks': {'total': 150}})
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json=lambda request, context: {
+        'items': [{'track': {'id': f'T{request.qs["offset"][0]}', 'name': 'Track', 'artists': []}}], 'total': 150
+    })
+    requests_mock.get('https://api.spotify.com/v1/me/tracks/contains', json=[False])
+    html = client.get(f'/playlist/{playlist_id}/all').get_data(as_text=True)
+    assert '/add_track_to_library/T0"' in html and 'T100' not in html
+    assert f'/playlist/{playlist_id}/all?offset=100' in html
+    rest = client.get(f'/playlist/{playlist_id}/all?offset=100', headers={'HX-Request': 'true'}).get_data(as_text=True)
+    assert '/add_track_to_library/T100"' in rest
+    assert 'Big Playlist' not in rest and 'Load more' not in rest
+
+def test_playlist_detail_uses_saved_library_index(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PL123'
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json={'id': playlist_id, 'name': 'Test Playlist', 'images': [], 'tracks': {'total': 1}}, status_code=200)
+    items = [{'track': {'id': 'T1', 'name': 'Track1', 'artists': [{'name': 'Artist1'}], 'album': {'images': [], 'id': 'A1'}, 'external_urls': {}}}]
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json={'items': items, 'total': 1}, status_code=200)
+    albums_check = requests_mock.get('https://api.spotify.com/v1/me/albums/contains?ids=A1', json=[False], status_code=200)
+    tracks_check = requests_mock.get('https://api.spotify.com/v1/me/tracks/contains?ids=T1', json=[False], status_code=200)
+    requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=200, json={})
+    client.get(f'/playlist/{playlist_id}')
+    client.post('/add_track_to_library/T1')
+    resp = client.get(f'/playlist/{playlist_id}')
+    assert albums_check.call_count == 1
+    assert tracks_check.call_count == 1
+    assert b'/add_track_to_library/T1' not in resp.data
+    assert b'/add_album_to_library/A1' in resp.data
+
+def test_playlist_detail_shares_public_playlists_between_users(client, requests_mock):
+    playlist_id = 'PL123'
+    playlist = {'id': playlist_id, 'name': 'Test Playlist', 'images': [], 'public': True, 'snapshot_id': 'S1', 'tracks': {'total': 1}}
+    playlist_call = requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json=playlist, status_code=200)
+    items = [{'track': {'id': 'T1', 'name': 'Track1', 'artists': [{'name': 'Artist1'}], 'album': {'images': [], 'id': 'A1'}, 'external_urls': {}}}]
+    tracks_call = requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json={'items': items, 'total': 1}, status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/albums/contains?ids=A1', json=[False], status_code=200)
+    tracks_check = requests_mock.get('https://api.spotify.com/v1/me/tracks/contains?ids=T1', json=[False], status_code=200)
+    for token in ('TOKEN_A', 'TOKEN_B'):
+        with client.session_transaction() as sess:
+            sess['spotify_token'] = token
+        resp = client.get(f'/playlist/{playlist_id}')
+        assert b'Track1' in resp.data
+    assert playlist_call.call_count == 1
+    assert tracks_call.call_count == 1
+    # Saved state is still checked for each user
+    assert tracks_check.call_count == 2
+
+def test_playlist_detail_keeps_private_playlists_per_user(client, requests_mock):
+    playlist_id = 'PL123'
+    playlist = {'id': playlist_id, 'name': 'Test Playlist', 'images': [], 'public': False, 'snapshot_id': 'S1', 'tracks': {'total': 0}}
+    playlist_call = requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json=playlist, status_code=200)
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json={'items': [], 'total': 0}, status_code=200)
+    for token in ('TOKEN_A', 'TOKEN_B', 'TOKEN_A'):
+        with client.session_transaction() as sess:
+            sess['spotify_token'] = token
+        client.get(f'/playlist/{playlist_id}')
+    assert playlist_call.call_count == 2
+
+def test_playlist_detail_etag_answers_304_without_upstream_calls(client, requests_mock, monkeypatch):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PL123'
+    playlist = {'id': playlist_id, 'name': 'Test Playlist', 'images': [], 'public': True, 'snapshot_id': 'S1', 'tracks': {'total': 1}}
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json=playlist, status_code=200)
+    items = [{'track': {'id': 'T1', 'name': 'Track1', 'artists': [{'name': 'Artist1'}], 'album': {'images': [], 'id': 'A1'}, 'external_urls': {}}}]
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json={'items': items, 'total': 1}, status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/albums/contains?ids=A1', json=[False], status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/tracks/contains?ids=T1', json=[False], status_code=200)
+    headers = {'HX-Request': 'true'}
+    first = client.get(f'/playlist/{playlist_id}', headers=headers)
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    calls = requests_mock.call_count
+    # The 304 is worked out from the cache before the fan-out and render are reached
+    render = app_module._render_playlist_page
+    monkeypatch.setattr(app_module, '_render_playlist_page', lambda *args: pytest.fail('page was rebuilt'))
+    again = client.get(f'/playlist/{playlist_id}', headers=dict(headers, **{'If-None-Match': first.headers['ETag']}))
+    assert again.status_code == 304
+    assert again.headers['ETag'] == first.headers['ETag']
+    assert again.headers['Cache-Control'] == 'private, no-cache'
+    assert requests_mock.call_count == calls
+    monkeypatch.setattr(app_module, '_render_playlist_page', render)
+    # A saved track changes the rendered list, so the old ETag no longer matches
+    requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=200, json={})
+    client.post('/add_track_to_library/T1')
+    changed = client.get(f'/playlist/{playlist_id}', headers=dict(headers, **{'If-None-Match': first.headers['ETag']}))
+    assert changed.status_code == 200
+    assert b'/add_track_to_library/T1' not in changed.data
+
+def test_cached_track_list_gets_a_fresh_csrf_token(requests_mock):
+    flask_app.config['TESTING'] = True
+    fragment_cache.clear()
+    playlist_cache.clear()
+    library_index.clear()
+    playlist_id = 'PL123'
+    playlist = {'id': playlist_id, 'name': 'Test Playlist', 'images': [], 'public': True, 'snapshot_id': 'S1', 'tracks': {'total': 1}}
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json=playlist, status_code=200)
+    items = [{'track': {'id': 'T1', 'name': 'Track1', 'artists': [{'name': 'Artist1'}], 'album': {'images': [], 'id': 'A1'}, 'external_urls': {}}}]
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json={'items': items, 'total': 1}, status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/albums/contains?ids=A1', json=[False], status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/tracks/contains?ids=T1', json=[False], status_code=200)
+    tokens = []
+    hits = fragment_cache.stats()['hits']
+    for user in ('TOKEN_A', 'TOKEN_B'):
+        # A fresh client per user, outside the fixture's app context, so each gets its own CSRF secret
+        with flask_app.test_client() as user_client:
+            with user_client.session_transaction() as sess:
+                sess['spotify_token'] = user
+            resp = user_client.get(f'/playlist/{playlist_id}', headers={'HX-Request': 'true'})
+        tokens.append(re.search(rb'name="csrf_token" value="([^"]+)"', resp.data).group(1))
+        assert app_module.CSRF_PLACEHOLDER.encode() not in resp.data
+    assert fragment_cache.stats()['hits'] == hits + 1
+    assert tokens[0] != tokens[1]
+
+def test_playlist_detail_prefetches_next_page(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PL123'
+    playlist = {'id': playlist_id, 'name': 'Test Playlist', 'images': [], 'snapshot_id': 'S1', 'tracks': {'total': 100}}
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json=playlist, status_code=200)
+    def page(offset):
+        return [{'track': {'id': f'T{i}', 'name': f'Track{i}', 'artists': [], 'album': {'images': [], 'id': 'A1'}, 'external_urls': {}}} for i in range(offset, offset + 50)]
+    tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks?fields={PLAYLIST_PAGE_FIELDS}&limit=50'
+    requests_mock.get(f'{tracks_url}&offset=0', json={'items': page(0), 'total': 100}, status_code=200)
+    next_page = requests_mock.get(f'{tracks_url}&offset=50', json={'items': page(50), 'total': 100}, status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/albums/contains', json=[False], status_code=200)
+    track_checks = requests_mock.get('https://api.spotify.com/v1/me/tracks/contains', json=[False] * 50, status_code=200)
+    client.get(f'/playlist/{playlist_id}').close()
+    assert prefetcher.wait_idle(2)
+    assert next_page.call_count == 1
+    assert track_checks.call_count == 2
+    hits = prefetcher.hits
+    resp = client.get(f'/playlist/{playlist_id}?offset=50', headers={'HX-Request': 'true'})
+    assert b'Track50' in resp.data
+    assert next_page.call_count == 1
+    assert track_checks.call_count == 2
+    assert prefetcher.hits == hits + 1
+    text = client.get('/metrics').data.decode()
+    assert f'spotiplay_prefetch_claims_total{{result="hit"}} {prefetcher.hits}' in text
+    assert 'spotiplay_prefetch_total{outcome="completed"}' in text
+
+def test_open_circuit_renders_error_fragment(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    for _ in range(flask_app.config['SPOTIFY_BREAKER_FAILURES']):
+        spotify_breaker.failure('user.profile')
+    profile = requests_mock.get('https://api.spotify.com/v1/me', json={'id': 'testuser'}, status_code=200)
+    resp = client.get('/dashboard', headers={'HX-Request': 'true'})
+    assert resp.status_code == 503
+    assert b'Spotify is not responding' in resp.data
+    assert profile.call_count == 0
+
+def test_playlist_detail_sends_server_timing(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PL123'
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', json={'id': playlist_id, 'name': 'Test Playlist', 'images': [], 'tracks': {'total': 0}}, status_code=200)
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json={'items': [], 'total': 0}, status_code=200)
+    resp = client.get(f'/playlist/{playlist_id}')
+    timing = resp.headers['Server-Timing']
+    assert 'spotify-playlists.get;dur=' in timing
+    assert 'render;dur=' in timing
+    assert 'total;dur=' in timing
+    # Keep-alive effect, per endpoint, for the whole app and for this worker
+    assert b'spotiplay_upstream_connections_total{connection="reused",endpoint="playlists.get"}' in client.get('/metrics').data
+    calls = client.get('/metrics/spotify').get_json()['clients']['sync']
+    assert 'handshake_saved_ms' in calls['endpoints']['playlists.get']
+    assert {'playlists.get', 'playlists.tracks'} <= {call['endpoint'] for call in calls['recent_calls']}
+
+def test_metrics_endpoint_is_local_only(client):
+    client.get('/')
+    app_module.get_spotify_client()
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert b'spotiplay_request_duration_seconds_bucket{view="index"' in resp.data
+    assert b'# TYPE spotiplay_ratelimit_queued_seconds_total counter' in resp.data
+    for cache in ('playlist_metadata', 'playlist_pages', 'fragments', 'search_indexes'):
+        assert f'spotiplay_cache_hits_total{{cache="{cache}"}}'.encode() in resp.data
+    assert b'spotiplay_cache_coalesced_total{cache="shared_playlists"}' in resp.data
+    assert client.get('/metrics/spotify', headers={'X-Forwarded-For': '203.0.113.9'}).status_code == 404
+    assert client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.9'}).status_code == 404
+
+def test_metrics_endpoint_allows_configured_networks_and_token(client, monkeypatch):
+    docker_gateway = {'REMOTE_ADDR': '172.17.0.1'}
+    assert client.get('/metrics', environ_base=docker_gateway).status_code == 404
+    monkeypatch.setattr(app_module, 'METRICS_NETWORKS', [ipaddress.ip_network('172.16.0.0/12')])
+    assert client.get('/metrics', environ_base=docker_gateway).status_code == 200
+    assert client.get('/metrics').status_code == 404
+
+    monkeypatch.setattr(app_module.Config, 'METRICS_TOKEN', 's3cret')
+    remote = {'REMOTE_ADDR': '203.0.113.9'}
+    assert client.get('/metrics', environ_base=remote).status_code == 404
+    assert client.get('/metrics', environ_base=remote, headers={'Authorization': 'Bearer wrong'}).status_code == 404
+    assert client.get('/metrics', environ_base=remote, headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
 def test_playlist_requires_login(client):
     resp = client.get('/playlist/dummy123', follow_redirects=False)
     assert resp.status_code == 302
@@ -103,8 +471,10 @@ def test_add_playlist_to_library_success(client, requests_mock):
     with client.session_transaction() as sess:
         sess['spotify_token'] = 'FAKE_TOKEN'
     playlist_id = 'PLX'
-    tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks?fields=items(track(id)),next&limit=100'
+    tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks?fields=items(track(id)),total&limit=100&offset=0'
     requests_mock.get(tracks_url, json={'items': [{'track': {'id': 'T1'}}], 'next': None}, status_code=200)
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}?fields=snapshot_id', json={'snapshot_id': 'S1'}, status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/tracks/contains?ids=T1', json=[False], status_code=200)
     requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=200, json={})
     resp = client.post(f'/add_playlist_to_library/{playlist_id}')
     assert b'Added 1 tracks' in resp.data
@@ -113,12 +483,92 @@ def test_add_playlist_to_library_failure(client, requests_mock):
     with client.session_transaction() as sess:
         sess['spotify_token'] = 'FAKE_TOKEN'
     playlist_id = 'PLX'
-    tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks?fields=items(track(id)),next&limit=100'
+    tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks?fields=items(track(id)),total&limit=100&offset=0'
     requests_mock.get(tracks_url, json={'items': [{'track': {'id': 'T1'}}], 'next': None}, status_code=200)
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}?fields=snapshot_id', json={'snapshot_id': 'S1'}, status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/tracks/contains?ids=T1', json=[False], status_code=200)
     requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=400, json={})
     resp = client.post(f'/add_playlist_to_library/{playlist_id}')
     assert b'Some tracks may not have been added' in resp.data
 
+def test_add_playlist_to_library_progress_endpoint(client, requests_mock, monkeypatch):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PLX'
+    tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks?fields=items(track(id)),total&limit=100&offset=0'
+    requests_mock.get(tracks_url, json={'items': [{'track': {'id': 'T1'}}], 'next': None}, status_code=200)
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}?fields=snapshot_id', json={'snapshot_id': 'S1'}, status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/tracks/contains?ids=T1', json=[False], status_code=200)
+    requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=200, json={})
+    monkeypatch.setattr('app.Config.JOB_SYNC_WAIT', 0)
+    resp = client.post(f'/add_playlist_to_library/{playlist_id}')
+    assert resp.status_code == 200
+    job_id = re.search(rb'data-job-id="([^"]+)"', resp.data)
+    if job_id:
+        from app import job_manager
+        job_manager.wait(job_id.group(1).decode(), timeout=5)
+        resp = client.get(f'/jobs/{job_id.group(1).decode()}')
+    assert b'Added 1 tracks' in resp.data
+
+def test_add_playlist_to_library_skips_synced_snapshot(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PLX'
+    tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks?fields=items(track(id)),total&limit=100&offset=0'
+    tracks = requests_mock.get(tracks_url, json={'items': [{'track': {'id': 'T1'}}, {'track': {'id': 'T2'}}], 'next': None}, status_code=200)
+    requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}?fields=snapshot_id', json={'snapshot_id': 'S1'}, status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/tracks/contains?ids=T1,T2', json=[True, False], status_code=200)
+    put = requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=200, json={})
+    resp = client.post(f'/add_playlist_to_library/{playlist_id}')
+    assert b'Added 1 tracks to your library! Skipped 1 already there.' in resp.data
+    assert put.last_request.json() == {'ids': ['T2']}
+    resp = client.post(f'/add_playlist_to_library/{playlist_id}')
+    assert b'Added 0 tracks to your library! Skipped 2 already there.' in resp.data
+    assert (tracks.call_count, put.call_count) == (1, 1)
+
+def test_job_progress_is_private_to_its_user(client):
+    from app import job_manager
+    job = job_manager.store.create('someone-else', 'PLX')
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    assert client.get(f'/jobs/{job.id}').status_code == 404
+
+def test_add_tracks_to_library_saves_unique_ids_in_batches(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    put = requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=200, json={})
+    ids = [f'T{i}' for i in range(60)]
+    resp = client.post('/add_tracks_to_library', data={'ids': ids + ['T0', 'T1,T2']})
+    assert b'Added 60 tracks to your library!' in resp.data
+    assert sorted(len(call.json()['ids']) for call in put.request_history) == [10, 50]
+    user = hashlib.sha256(b'FAKE_TOKEN').hexdigest()
+    assert library_index.lookup(user, 'tracks', ['T59'])[0] == {'T59': True}
+
+def test_add_albums_to_library_respects_album_id_limit(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    put = requests_mock.put('https://api.spotify.com/v1/me/albums', [{'status_code': 200, 'json': {}}, {'status_code': 500, 'json': {}}])
+    resp = client.post('/add_albums_to_library', data={'ids': [f'A{i}' for i in range(25)]})
+    assert sorted(len(call.json()['ids']) for call in put.request_history) == [5, 20]
+    assert b'Some albums may not have been added.' in resp.data
+
+def test_bulk_save_rejects_too_many_ids(client, monkeypatch):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    monkeypatch.setattr('app.Config.BULK_SAVE_MAX_IDS', 2)
+    assert client.post('/add_tracks_to_library', data={'ids': 'T1,T2,T3'}).status_code == 400
+
+def test_add_playlist_albums_skips_saved_albums(client, requests_mock):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    items = [{'track': {'album': {'id': album_id}}} for album_id in ('A1', 'A2', 'A1', 'A3')] + [{'track': None}]
+    requests_mock.get('https://api.spotify.com/v1/playlists/PLX/tracks', json={'items': items, 'total': 5}, status_code=200)
+    requests_mock.get('https://api.spotify.com/v1/me/albums/contains?ids=A1,A2,A3', json=[True, False, False], status_code=200)
+    put = requests_mock.put('https://api.spotify.com/v1/me/albums', status_code=200, json={})
+    resp = client.post('/add_playlist_albums_to_library/PLX')
+    assert b'Added 2 albums to your library! Skipped 1 already there.' in resp.data
+    assert put.last_request.json() == {'ids': ['A2', 'A3']}
+
 def test_add_playlist_to_library_not_logged_in(client):
     playlist_id = 'PLX'
     resp = client.post(f'/add_playlist_to_library/{playlist_id}')
@@ -229,3 +679,151 @@ def test_401_page_htmx(client):
     assert b'Back to Home' in resp.data
 
 
+
+def get_when_ready(client, url, headers=None, timeout=5):
+    """GET `url` until it stops answering with a polling placeholder."""
+    deadline = time.monotonic() + timeout
+    while True:
+        resp = client.get(url, headers=headers)
+        if b'hx-trigger="load delay:1s"' not in resp.data or time.monotonic() > deadline:
+            return resp
+        time.sleep(0.02)
+
+def test_playlist_search_builds_the_index_once(client, requests_mock, monkeypatch):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+    playlist_id = 'PL123'
+    requests_mock.get(
+        f'https://api.spotify.com/v1/playlists/{playlist_id}',
+        json={'id': playlist_id, 'name': 'Big List', 'snapshot_id': 'S1', 'tracks': {'total': 250}}
+    )
+
+    def tracks_page(request, context):
+        assert request.qs['fields'] == [app_module.SEARCH_INDEX_FIELDS.lower()]
+        offset = int(request.qs['offset'][0])
+        return {'total': 250, 'items': [
+            {'track': {
+                'id': f'T{i}', 'name': f'Song {i}', 'artists': [{'name': 'Zed' if i % 2 else 'Amy'}],
+                'album': {'id': f'A{i // 10}', 'name': f'Record {i // 10}', 'images': []}, 'external_urls': {}
+            }} for i in range(offset, min(offset + 100, 250))
+        ]}
+
+    pages = requests_mock.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json=tracks_page)
+    track_checks = requests_mock.get(
+        'https://api.spotify.com/v1/me/tracks/contains',
+        json=lambda request, context: [track_id in ('t3', 't5') for track_id in request.qs['ids'][0].split(',')]
+    )
+    requests_mock.get(
+        'https://api.spotify.com/v1/me/albums/contains',
+        json=lambda request, context: [False] * len(request.qs['ids'][0].split(','))
+    )
+    headers = {'HX-Request': 'true'}
+    # The index is built in the background; meanwhile the results poll
+    resp = client.get(f'/playlist/{playlist_id}/search?q=song+24', headers=headers)
+    assert b'Indexing 250 tracks' in resp.data and b'hx-trigger="load delay:1s"' in resp.data
+    resp = get_when_ready(client, f'/playlist/{playlist_id}/search?q=song+24', headers)
+    assert pages.call_count == 3
+    assert b'id="tracks-container"' in resp.data
+    assert re.findall(rb'<strong[^>]*>(Song \d+)</strong>', resp.data) == [b'Song 24'] + [f'Song {i}'.encode() for i in range(240, 250)]
+
+    # Once the index is ready, keystrokes never call Spotify: not for
+    # expired metadata, nor for saved state the library index lacks
+    assert app_module.prefetcher.wait_idle(5)
+    app_module.playlist_cache.clear()
+    monkeypatch.setattr(app_module.prefetcher, 'paused', lambda: True)
+    calls = requests_mock.call_count
+    resp = client.get(f'/playlist/{playlist_id}/search?q=reco+7&field=album', headers=headers)
+    assert b'Matches 1-10 of 10' in resp.data
+    resp = client.get(f'/playlist/{playlist_id}/search?q=zed', headers=headers)
+    assert b'Matches 1-50 of 125' in resp.data and b'Checking which tracks are saved.' in resp.data
+    assert b'offset=50' in resp.data and b'q=zed' in resp.data
+    assert b'No matching tracks' in client.get(f'/playlist/{playlist_id}/search?q=zed&field=name', headers=headers).data
+    resp = client.get(f'/playlist/{playlist_id}/search?q=zed&status=saved', headers=headers)
+    assert b'Checking which tracks are saved' in resp.data
+    assert requests_mock.call_count == calls
+
+    # Unknown saved state is checked in the background while the results poll
+    monkeypatch.setattr(app_module.prefetcher, 'paused', None)
+    resp = get_when_ready(client, f'/playlist/{playlist_id}/search?q=zed&status=saved', headers)
+    assert re.findall(rb'<strong[^>]*>(Song \d+)</strong>', resp.data) == [b'Song 3', b'Song 5']
+    # Saved state is remembered, so the opposite filter needs no more checks
+    checks = track_checks.call_count
+    resp = get_when_ready(client, f'/playlist/{playlist_id}/search?q=zed&status=unsaved', headers)
+    assert b'Matches 1-50 of 123' in resp.data and b'Checking' not in resp.data
+    assert track_checks.call_count == checks
+
+    resp = client.get(f'/playlist/{playlist_id}/search?q=amy')
+    assert b'Big List' in resp.data and b'value="amy"' in resp.data
+    assert pages.call_count == 3
+
+def test_create_app_compiles_templates_and_reports_startup(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module.Config, 'LOG_FILE', str(tmp_path / 'spotiplay.log'))
+    monkeypatch.setattr(app_module, '_created', False)
+    monkeypatch.setattr(app_module, 'log_pipeline', None)
+    env = flask_app.jinja_env
+    env.cache.clear()
+    try:
+        assert app_module.create_app() is flask_app
+        assert app_module.create_app() is flask_app
+        assert {name for _, name in env.cache.keys()} >= set(env.list_templates())
+        phases = [name for name, _ in app_module.startup_profile.phases]
+        assert phases[:4] == ['import framework', 'import app modules', 'config', 'module setup']
+        assert phases.count('logging') == 1
+        assert phases[-1].startswith('compile templates')
+        result = flask_app.test_cli_runner().invoke(args=['startup-profile'])
+        assert 'compile templates' in result.output and 'total' in result.output
+    finally:
+        app_module.log_pipeline.close()
+
+def test_spotify_client_is_built_once_per_process(monkeypatch):
+    import threading
+    monkeypatch.setattr(app_module, '_spotify_client', None)
+    built = []
+    original = app_module.SpotifyClient
+
+    def slow_client(*args, **kwargs):
+        built.append(1)
+        threading.Event().wait(0.05)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, 'SpotifyClient', slow_client)
+    start = threading.Barrier(8)
+    clients = []
+
+    def get():
+        start.wait()
+        clients.append(app_module.get_spotify_client())
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1 and len({id(client) for client in clients}) == 1
+
+@pytest.mark.parametrize('async_views', [False, True])
+def test_saving_an_album_refreshes_the_dashboard_albums(client, requests_mock, monkeypatch, async_views):
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'FAKE_TOKEN'
+        sess['spotify_user_id'] = 'testuser'
+    app_module.session_store.set_user_value('testuser', 'albums:0', {'albums': [{'id': 'AL1'}]}, ttl=60)
+    if async_views:
+        httpx = pytest.importorskip('httpx')
+        import async_views as async_module
+        from spotify_async import AsyncSpotifyClient
+        monkeypatch.setattr(flask_app, 'view_functions', dict(flask_app.view_functions))
+        async_module.install(flask_app, app_module)
+        upstream = AsyncSpotifyClient(
+            app_module.SPOTIFY_API, transport=httpx.MockTransport(lambda request: httpx.Response(200))
+        )
+        monkeypatch.setattr(app_module, '_async_spotify_client', upstream)
+        monkeypatch.setattr(app_module, '_async_spotify_client_pid', os.getpid())
+    else:
+        requests_mock.put('https://api.spotify.com/v1/me/albums', status_code=200)
+    try:
+        resp = client.post('/add_album_to_library/AL1')
+    finally:
+        if async_views:
+            upstream.close()
+    assert b'Album added to your library!' in resp.data
+    assert app_module.session_store.get_user_value('testuser', 'albums:0') is None
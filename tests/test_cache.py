@@ -0,0 +1,62 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from cache import SharedPlaylistCache, SingleFlight, TTLCache
+from models import Playlist
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(ttl=60, max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait(1)
+        return 'page'
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', load)))
+    leader.start()
+    started.wait(1)
+    follower = threading.Thread(target=lambda: results.append(flight.do('key', load)))
+    follower.start()
+    while flight.coalesced == 0:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(calls) == 1
+    assert sorted(results) == [('page', False), ('page', True)]
+
+def test_track_pages_are_keyed_by_snapshot():
+    cache = SharedPlaylistCache()
+    playlist = Playlist('PL1', public=True, snapshot_id='S1')
+    assert cache.tracks_page('alice', playlist, 0, 50, lambda: {'items': ['old']}) == {'items': ['old']}
+    assert cache.tracks_page('bob', playlist, 0, 50, lambda: {'items': ['new']}) == {'items': ['old']}
+    changed = Playlist('PL1', public=True, snapshot_id='S2')
+    assert cache.tracks_page('bob', changed, 0, 50, lambda: {'items': ['new']}) == {'items': ['new']}
+
+def test_private_metadata_is_not_shared():
+    cache = SharedPlaylistCache()
+    cache.playlist('alice', 'PL1', lambda: Playlist('PL1', public=False))
+    assert cache.cached_playlist('alice', 'PL1') is not None
+    assert cache.cached_playlist('bob', 'PL1') is None
@@ -0,0 +1,25 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fanout import FanOut
+
+def test_calls_run_concurrently():
+    with FanOut(max_workers=4, deadline=5) as fanout:
+        start = time.monotonic()
+        futures = [fanout.submit(time.sleep, 0.2) for _ in range(4)]
+        for future in futures:
+            fanout.result(future)
+        assert time.monotonic() - start < 0.6
+
+def test_deadline_abandons_slow_calls():
+    with FanOut(max_workers=2, deadline=0.1) as fanout:
+        future = fanout.submit(lambda: time.sleep(1) or 'late')
+        assert fanout.result(future, default='missing') == 'missing'
+
+def test_failed_call_returns_default():
+    def boom():
+        raise RuntimeError('upstream down')
+    with FanOut(max_workers=1, deadline=1) as fanout:
+        assert fanout.result(fanout.submit(boom)) is None
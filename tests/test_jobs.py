@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import jobs
+from spotify_client import SpotifyClient
+
+API = {
+    'user': {
+        'tracks': 'https://api.spotify.com/v1/me/tracks',
+        'check_saved_tracks': 'https://api.spotify.com/v1/me/tracks/contains',
+    },
+    'playlists': {
+        'get': 'https://api.spotify.com/v1/playlists/{playlist_id}',
+        'tracks': 'https://api.spotify.com/v1/playlists/{playlist_id}/tracks',
+    }
+}
+TRACKS_URL = 'https://api.spotify.com/v1/playlists/PLX/tracks?fields=items(track(id)),total&limit=100&offset=0'
+SNAPSHOT_URL = 'https://api.spotify.com/v1/playlists/PLX?fields=snapshot_id'
+CONTAINS_URL = 'https://api.spotify.com/v1/me/tracks/contains'
+
+def make_manager(tmp_path, **kwargs):
+    client = SpotifyClient(API)
+    store = jobs.JobStore(str(tmp_path / 'jobs.db'))
+    return jobs.JobManager(store, lambda: client, **kwargs)
+
+def mock_unsaved(requests_mock, snapshot_id='S1'):
+    requests_mock.get(SNAPSHOT_URL, json={'snapshot_id': snapshot_id})
+    requests_mock.get(CONTAINS_URL, json=lambda request, context: [False] * len(request.qs['ids'][0].split(',')))
+
+def test_job_reports_progress(tmp_path, requests_mock):
+    requests_mock.get(TRACKS_URL, json={'items': [{'track': {'id': f'T{i}'}} for i in range(3)], 'next': None})
+    mock_unsaved(requests_mock)
+    requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=200, json={})
+    saved = []
+    manager = make_manager(tmp_path, batch_size=2, on_saved=lambda user, ids: saved.extend(ids))
+    job = manager.wait(manager.submit_playlist_save('u1', 'PLX', 'TOKEN').id, timeout=5)
+    assert job.state == jobs.DONE
+    assert (job.fetched, job.saved, job.failed, job.cursor) == (3, 3, 0, 2)
+    assert saved == ['T0', 'T1', 'T2']
+    assert job.message == 'Added 3 tracks to your library!'
+
+def test_resume_continues_from_last_saved_batch(tmp_path, requests_mock):
+    requests_mock.get(TRACKS_URL, json={'items': [{'track': {'id': f'T{i}'}} for i in range(4)], 'next': None})
+    mock_unsaved(requests_mock)
+    put = requests_mock.put('https://api.spotify.com/v1/me/tracks', [
+        {'status_code': 200, 'json': {}},
+        {'exc': RuntimeError('worker died')},
+        {'status_code': 200, 'json': {}},
+    ])
+    manager = make_manager(tmp_path, batch_size=2, concurrency=1)
+    job = manager.wait(manager.submit_playlist_save('u1', 'PLX', 'TOKEN').id, timeout=5)
+    assert job.state == jobs.FAILED
+    assert (job.saved, job.cursor) == (2, 1)
+    assert manager.resume(job, 'TOKEN')
+    job = manager.wait(job.id, timeout=5)
+    assert job.state == jobs.DONE
+    assert job.saved == 4
+    assert put.last_request.json() == {'ids': ['T2', 'T3']}
+
+def test_resume_retries_only_failed_batches(tmp_path, requests_mock):
+    requests_mock.get(TRACKS_URL, json={'items': [{'track': {'id': f'T{i}'}} for i in range(6)], 'next': None})
+    mock_unsaved(requests_mock)
+    put = requests_mock.put('https://api.spotify.com/v1/me/tracks', [
+        {'status_code': 200, 'json': {}},
+        {'status_code': 502, 'json': {}},
+        {'status_code': 200, 'json': {}},
+        {'status_code': 200, 'json': {}},
+    ])
+    manager = make_manager(tmp_path, batch_size=2, concurrency=1)
+    job = manager.wait(manager.submit_playlist_save('u1', 'PLX', 'TOKEN').id, timeout=5)
+    assert job.state == jobs.FAILED and job.resumable
+    assert (job.saved, job.failed) == (4, 2)
+    assert manager.store.synced_snapshot('u1', 'PLX') is None
+    assert manager.resume(job, 'TOKEN')
+    job = manager.wait(job.id, timeout=5)
+    assert job.state == jobs.DONE
+    assert (job.saved, job.failed) == (6, 0)
+    assert put.call_count == 4
+    assert put.last_request.json() == {'ids': ['T2', 'T3']}
+    assert manager.store.synced_snapshot('u1', 'PLX') == 'S1'
+
+def test_cancel_stops_before_next_batch(tmp_path, requests_mock):
+    requests_mock.get(TRACKS_URL, json={'items': [{'track': {'id': 'T1'}}], 'next': None})
+    manager = make_manager(tmp_path)
+    job = manager.store.create('u1', 'PLX')
+    assert manager.cancel(job)
+    manager._run(job.id, 'TOKEN')
+    job = manager.store.get(job.id)
+    assert job.state == jobs.CANCELLED
+    assert job.resumable
+
+def test_sync_puts_only_new_unsaved_tracks(tmp_path, requests_mock):
+    tracks = requests_mock.get(TRACKS_URL, json={'items': [{'track': {'id': f'T{i}'}} for i in range(3)], 'next': None})
+    mock_unsaved(requests_mock, 'S1')
+    put = requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=200, json={})
+    manager = make_manager(tmp_path)
+    job = manager.wait(manager.submit_playlist_save('u1', 'PLX', 'TOKEN').id, timeout=5)
+    assert (job.saved, job.skipped) == (3, 0)
+
+    # Same snapshot: nothing is fetched or saved
+    job = manager.wait(manager.submit_playlist_save('u1', 'PLX', 'TOKEN').id, timeout=5)
+    assert job.state == jobs.DONE
+    assert (job.saved, job.skipped) == (0, 3)
+    assert (tracks.call_count, put.call_count) == (1, 1)
+
+    # New snapshot with one new track, one of which is already in Liked Songs
+    requests_mock.get(TRACKS_URL, json={'items': [{'track': {'id': f'T{i}'}} for i in range(5)], 'next': None})
+    requests_mock.get(SNAPSHOT_URL, json={'snapshot_id': 'S2'})
+    contains = requests_mock.get(CONTAINS_URL, json=[True, False])
+    job = manager.wait(manager.submit_playlist_save('u1', 'PLX', 'TOKEN').id, timeout=5)
+    assert contains.last_request.qs['ids'] == ['t3,t4']
+    assert put.last_request.json() == {'ids': ['T4']}
+    assert (job.saved, job.skipped) == (1, 4)
+    assert job.message == 'Added 1 tracks to your library! Skipped 4 already there.'
+
+def test_unchanged_snapshot_skips_only_tracks_still_in_the_playlist(tmp_path, requests_mock):
+    requests_mock.get(TRACKS_URL, json={'items': [{'track': {'id': f'T{i}'}} for i in range(3)], 'next': None})
+    mock_unsaved(requests_mock, 'S1')
+    requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=200, json={})
+    manager = make_manager(tmp_path)
+    manager.wait(manager.submit_playlist_save('u1', 'PLX', 'TOKEN').id, timeout=5)
+
+    # T2 is removed from the playlist; it stays among the synced tracks
+    requests_mock.get(TRACKS_URL, json={'items': [{'track': {'id': f'T{i}'}} for i in range(2)], 'next': None})
+    requests_mock.get(SNAPSHOT_URL, json={'snapshot_id': 'S2'})
+    job = manager.wait(manager.submit_playlist_save('u1', 'PLX', 'TOKEN').id, timeout=5)
+    assert (job.saved, job.skipped) == (0, 2)
+    job = manager.wait(manager.submit_playlist_save('u1', 'PLX', 'TOKEN').id, timeout=5)
+    assert (job.fetched, job.skipped) == (0, 2)
+    assert job.message == 'Added 0 tracks to your library! Skipped 2 already there.'
+
+def test_job_store_adds_new_columns_to_old_databases(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE jobs (id TEXT PRIMARY KEY, user TEXT NOT NULL, playlist_id TEXT NOT NULL, state TEXT NOT NULL, '
+                 'fetched INTEGER NOT NULL DEFAULT 0, saved INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, '
+                 'total INTEGER, cursor INTEGER NOT NULL DEFAULT 0, track_ids TEXT, message TEXT, '
+                 'created_at REAL NOT NULL, updated_at REAL NOT NULL)')
+    conn.close()
+    job = jobs.JobStore(path).create('u1', 'PLX')
+    assert (job.skipped, job.snapshot_id) == (0, None)
+
+def test_stale_job_is_resumable_only_once_its_worker_is_gone(tmp_path):
+    store = jobs.JobStore(str(tmp_path / 'jobs.db'), stale_after=0)
+    job = store.create('u1', 'PLX')
+    store.update(job.id, state=jobs.RUNNING)
+    # Not updated lately, but the process running it is alive: just slow
+    job = store.get(job.id)
+    assert job.state == jobs.RUNNING and not job.resumable
+    assert not store.claim_resume(job.id)
+
+    exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    store.update(job.id, runner_pid=int(exited.stdout))
+    job = store.get(job.id)
+    assert job.state == jobs.INTERRUPTED
+    assert store.claim_resume(job.id)
+    job = store.get(job.id)
+    assert (job.state, job.runner_pid) == (jobs.QUEUED, os.getpid())
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from library_index import LibraryVersions, SavedLibraryIndex
+
+def test_lookup_reports_known_and_missing_ids():
+    index = SavedLibraryIndex()
+    index.record('u1', 'tracks', {'T1': True, 'T2': False})
+    known, missing = index.lookup('u1', 'tracks', ['T1', 'T2', 'T3'])
+    assert known == {'T1': True, 'T2': False}
+    assert missing == ['T3']
+    assert index.lookup('u2', 'tracks', ['T1']) == ({}, ['T1'])
+
+def test_mark_saved_overrides_unsaved():
+    index = SavedLibraryIndex()
+    index.record('u1', 'albums', {'A1': False})
+    index.mark_saved('u1', 'albums', ['A1'])
+    assert index.lookup('u1', 'albums', ['A1']) == ({'A1': True}, [])
+
+def test_entries_expire_after_ttl():
+    index = SavedLibraryIndex(ttl=0.05)
+    index.record('u1', 'tracks', {'T1': True})
+    time.sleep(0.06)
+    assert index.lookup('u1', 'tracks', ['T1']) == ({}, ['T1'])
+
+def test_least_recently_used_user_is_evicted_over_memory_cap():
+    index = SavedLibraryIndex(max_bytes=2000)
+    index.record('u1', 'tracks', {f'T{i}': True for i in range(10)})
+    index.record('u2', 'tracks', {f'T{i}': True for i in range(10)})
+    index.lookup('u1', 'tracks', ['T1'])
+    index.record('u3', 'tracks', {f'T{i}': True for i in range(10)})
+    assert index.lookup('u2', 'tracks', ['T1']) == ({}, ['T1'])
+    assert index.lookup('u1', 'tracks', ['T1']) == ({'T1': True}, [])
+    assert index.stats()['evictions'] >= 1
+
+def test_recording_known_ids_again_does_not_grow_the_size():
+    index = SavedLibraryIndex()
+    results = {f'T{i}': i % 2 == 0 for i in range(10)}
+    index.record('u1', 'tracks', results)
+    size = index.stats()['estimated_bytes']
+    index.record('u1', 'tracks', results)
+    index.mark_saved('u1', 'tracks', ['T0', 'T1'])
+    assert index.stats()['estimated_bytes'] == size
+
+def test_a_save_on_one_worker_drops_the_others_copy(tmp_path):
+    versions = LibraryVersions(str(tmp_path / 'library.db'))
+    workers = [SavedLibraryIndex(versions=versions), SavedLibraryIndex(versions=versions)]
+    for worker in workers:
+        worker.record('u1', 'tracks', {'T1': False, 'T2': True})
+        worker.record('u2', 'tracks', {'T1': False})
+    workers[0].mark_saved('u1', 'tracks', ['T1'])
+    assert workers[0].lookup('u1', 'tracks', ['T1', 'T2']) == ({'T1': True, 'T2': True}, [])
+    assert workers[1].lookup('u1', 'tracks', ['T1', 'T2']) == ({}, ['T1', 'T2'])
+    assert workers[1].lookup('u2', 'tracks', ['T1']) == ({'T1': False}, [])
+    workers[1].invalidate('u2')
+    assert workers[0].lookup('u2', 'tracks', ['T1']) == ({}, ['T1'])
+
+def test_a_save_keeps_nothing_another_worker_made_stale(tmp_path):
+    versions = LibraryVersions(str(tmp_path / 'library.db'))
+    workers = [SavedLibraryIndex(versions=versions), SavedLibraryIndex(versions=versions)]
+    workers[0].record('u1', 'tracks', {'T1': False})
+    workers[1].mark_saved('u1', 'tracks', ['T1'])
+    workers[0].mark_saved('u1', 'tracks', ['T2'])
+    assert workers[0].lookup('u1', 'tracks', ['T1', 'T2']) == ({'T2': True}, ['T1'])
@@ -0,0 +1,83 @@
+import logging
+import os
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from log_pipeline import BoundedQueueHandler, LogPipeline
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def _read(path):
+    if not os.path.exists(path):
+        return ''
+    with open(path) as f:
+        return f.read()
+
+def test_full_queue_drops_and_counts_instead_of_blocking():
+    handler = BoundedQueueHandler(queue.Queue(2))
+    logger = logging.getLogger('test_log_pipeline.bounded')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(5):
+            logger.warning('message %d', i)
+    finally:
+        logger.removeHandler(handler)
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+    # Args are merged on the way in so records survive the thread hop
+    assert handler.queue.get_nowait().getMessage() == 'message 0'
+
+def test_one_writer_per_log_file(tmp_path):
+    path = str(tmp_path / 'spotiplay.log')
+    writer = LogPipeline(path, '%(name)s %(message)s', console=False).start()
+    other = LogPipeline(path, '%(name)s %(message)s', console=False).start()
+    try:
+        assert writer.is_writer and not other.is_writer
+        writer.handler.handle(logging.makeLogRecord({'name': 'first', 'msg': 'from %s', 'args': ('writer',)}))
+        other.handler.handle(logging.makeLogRecord({'name': 'second', 'msg': 'from other'}))
+        assert _wait_for(lambda: 'second from other' in _read(path))
+        assert 'first from writer' in _read(path)
+        # `sent` is counted after sendto returns, which can be after the writer has the line
+        assert _wait_for(lambda: other.sent == 1)
+        assert other.send_failures == 0
+    finally:
+        other.close()
+        writer.close()
+
+def test_takes_over_when_the_writer_exits(tmp_path):
+    path = str(tmp_path / 'spotiplay.log')
+    writer = LogPipeline(path, '%(message)s', console=False).start()
+    other = LogPipeline(path, '%(message)s', console=False).start()
+    writer.close()
+    try:
+        other.handler.handle(logging.makeLogRecord({'msg': 'after handover'}))
+        assert _wait_for(lambda: 'after handover' in _read(path))
+        assert other.is_writer
+    finally:
+        other.close()
+
+def test_non_writer_never_takes_the_log_file(tmp_path):
+    path = str(tmp_path / 'spotiplay.log')
+    master = LogPipeline(path, '%(message)s', console=False).start(writer=False)
+    try:
+        master.handler.handle(logging.makeLogRecord({'msg': 'no writer yet'}))
+        assert _wait_for(lambda: master.send_failures == 1)
+        assert not master.is_writer
+        worker = LogPipeline(path, '%(message)s', console=False).start()
+        try:
+            assert worker.is_writer
+            master.handler.handle(logging.makeLogRecord({'msg': 'from the master'}))
+            assert _wait_for(lambda: 'from the master' in _read(path))
+        finally:
+            worker.close()
+    finally:
+        master.close()
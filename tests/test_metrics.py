@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import metrics
+from metrics import MetricsRegistry
+
+def test_server_timing_groups_upstream_calls_by_endpoint():
+    timings = metrics.start_request()
+    try:
+        metrics.record_upstream('playlists.get', 200, 0.05, 1000)
+        metrics.record_upstream('user.check_saved_tracks', 200, 0.02, 10)
+        metrics.record_upstream('user.check_saved_tracks', 200, 0.03, 10)
+        with metrics.phase('sanitize'):
+            pass
+    finally:
+        metrics.finish_request()
+    header = timings.server_timing()
+    assert 'spotify;dur=100.0;desc="3 calls"' in header
+    assert 'spotify-user.check_saved_tracks;dur=50.0;desc="2x"' in header
+    assert 'sanitize;dur=' in header
+    assert header.split(', ')[-1].startswith('total;dur=')
+
+def test_histograms_are_summed_across_workers(tmp_path):
+    path = str(tmp_path / 'metrics.db')
+    workers = [MetricsRegistry(path), MetricsRegistry(path)]
+    workers[0].observe('spotiplay_request_duration_seconds', 0.02, view='dashboard')
+    workers[1].observe('spotiplay_request_duration_seconds', 0.3, view='dashboard')
+    workers[1].increment('spotiplay_upstream_response_bytes_total', 512, endpoint='user.profile')
+    workers[1].flush()
+    text = workers[0].render()
+    assert 'spotiplay_request_duration_seconds_bucket{view="dashboard",le="0.025"} 1' in text
+    assert 'spotiplay_request_duration_seconds_bucket{view="dashboard",le="+Inf"} 2' in text
+    assert 'spotiplay_request_duration_seconds_count{view="dashboard"} 2' in text
+    assert 'spotiplay_upstream_response_bytes_total{endpoint="user.profile"} 512.0' in text
+
+
+def test_dead_workers_rows_are_folded_into_one(tmp_path):
+    path = str(tmp_path / 'metrics.db')
+    exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    dead_pid = int(exited.stdout)
+    for suffix in ('aaaa', 'bbbb'):
+        old = MetricsRegistry(path)
+        old._pid, old._worker = os.getpid(), f'{dead_pid}-{suffix}'
+        old.observe('spotiplay_request_duration_seconds', 0.02, view='dashboard')
+        old.increment('spotiplay_upstream_response_bytes_total', 100, endpoint='user.profile')
+        old.flush()
+    live = MetricsRegistry(path)
+    live.observe('spotiplay_request_duration_seconds', 0.3, view='dashboard')
+    text = live.render()
+    workers = {row['worker'] for row in live.connection().execute('SELECT worker FROM metric_series')}
+    assert workers == {MetricsRegistry.RETIRED, live._worker}
+    assert 'spotiplay_request_duration_seconds_count{view="dashboard"} 3' in text
+    assert 'spotiplay_request_duration_seconds_bucket{view="dashboard",le="0.025"} 2' in text
+    assert 'spotiplay_upstream_response_bytes_total{endpoint="user.profile"} 200.0' in text
+    assert live.compact() == 0
+
+def test_collectors_copy_component_counts_in_before_each_flush(tmp_path):
+    registry = MetricsRegistry(str(tmp_path / 'metrics.db'))
+    counts = {'hits': 0}
+    registry.add_collector(lambda: registry.set_counter('spotiplay_cache_hits_total', counts['hits'], cache='pages'))
+    registry.add_collector(lambda: 1 / 0)
+    counts['hits'] = 3
+    assert 'spotiplay_cache_hits_total{cache="pages"} 3' in registry.render()
+    counts['hits'] = 5
+    assert 'spotiplay_cache_hits_total{cache="pages"} 5' in registry.render()
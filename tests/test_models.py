@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models import SavedAlbum, as_dict, parse_playlist, parse_playlists, parse_saved_albums, parse_track_page
+
+def test_track_page_shares_album_records_and_skips_missing_tracks():
+    album = {'id': 'A1', 'images': [{'url': 'https://i.scdn.co/image/a1'}, {'url': 'small'}]}
+    page = parse_track_page({'items': [
+        {'track': {'id': 'T1', 'name': 'One', 'artists': [{'name': 'X'}, {'name': 'Y'}], 'album': album,
+                   'external_urls': {'spotify': 'https://open.spotify.com/track/T1'}}},
+        {'track': None},
+        {'track': {'id': 'T2', 'name': 'Two', 'artists': [], 'album': dict(album)}},
+    ], 'total': 3})
+    assert page.total == 3
+    assert [track.id for track in page.tracks] == ['T1', 'T2']
+    first, second = page.tracks
+    assert first.artist_names == 'X, Y'
+    assert first.url == 'https://open.spotify.com/track/T1'
+    assert first.album is second.album
+    assert first.album.image == 'https://i.scdn.co/image/a1'
+    assert second.url is None
+
+def test_playlist_keeps_only_rendered_fields():
+    playlist = parse_playlist({
+        'name': 'Mix', 'public': True, 'snapshot_id': 'S1', 'images': [],
+        'owner': {'display_name': 'Alice', 'id': 'alice'}, 'tracks': {'total': 12, 'items': [{}]},
+    }, 'PL1')
+    assert (playlist.id, playlist.owner, playlist.total, playlist.image) == ('PL1', 'Alice', 12, None)
+    assert not hasattr(playlist, '__dict__')
+    assert [p.id for p in parse_playlists({'items': [{'id': 'PL1'}, None, {'name': 'no id'}]})] == ['PL1']
+
+def test_saved_albums_round_trip_through_dicts():
+    albums = parse_saved_albums([
+        {'album': {'id': 'A1', 'name': 'First', 'artists': [{'name': 'X'}, {'name': 'Y'}], 'images': [{'url': 'big'}]}},
+        {'album': None},
+        {'album': {'id': 'A2', 'artists': []}},
+    ])
+    assert [(album.id, album.name, album.artist, album.image) for album in albums] == [
+        ('A1', 'First', 'X', 'big'), ('A2', None, None, None)
+    ]
+    copy = SavedAlbum(**as_dict(albums[0]))
+    assert (copy.id, copy.artist) == ('A1', 'X')
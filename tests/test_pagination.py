@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from pagination import SpotifyPageError, fetch_spotify_items_with_pagination, iter_all_items, put_in_batches
+from spotify_client import SpotifyClient
+
+API = {
+    'user': {
+        'albums': 'https://api.spotify.com/v1/me/albums',
+        'tracks': 'https://api.spotify.com/v1/me/tracks'
+    },
+    'playlists': {'tracks': 'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'}
+}
+TRACKS_URL = 'https://api.spotify.com/v1/playlists/PL1/tracks'
+
+def page_callback(total):
+    def callback(request, context):
+        offset, limit = int(request.qs['offset'][0]), int(request.qs['limit'][0])
+        # Later pages answer faster, so out-of-order completion is exercised
+        time.sleep(max(0.0, 0.05 - offset / 1000))
+        return {'items': [{'n': i} for i in range(offset, min(offset + limit, total))], 'total': total}
+    return callback
+
+def test_fetch_spotify_items_with_pagination_offsets(requests_mock):
+    requests_mock.get('https://api.spotify.com/v1/me/albums', json={'items': [{'n': 1}], 'total': 45})
+    items, total, next_offset, prev_offset = fetch_spotify_items_with_pagination(SpotifyClient(API), 'user.albums', 'TOKEN', offset=20)
+    assert (items, total, next_offset, prev_offset) == ([{'n': 1}], 45, 40, 0)
+
+def test_iter_all_items_streams_every_page_in_order(requests_mock):
+    requests_mock.get(TRACKS_URL, json=page_callback(230))
+    items = iter_all_items(SpotifyClient(API), 'playlists.tracks', 'TOKEN', path={'playlist_id': 'PL1'}, limit=20, max_workers=4)
+    assert [item['n'] for item in items] == list(range(230))
+    offsets = sorted(int(r.qs['offset'][0]) for r in requests_mock.request_history)
+    assert offsets == list(range(0, 230, 20))
+
+def test_iter_all_items_raises_on_failed_page(requests_mock):
+    requests_mock.get(TRACKS_URL, status_code=502)
+    with pytest.raises(SpotifyPageError):
+        list(iter_all_items(SpotifyClient(API), 'playlists.tracks', 'TOKEN', path={'playlist_id': 'PL1'}))
+
+def test_put_in_batches_yields_in_batch_order(requests_mock):
+    put = requests_mock.put('https://api.spotify.com/v1/me/tracks', [{'json': {}}, {'status_code': 500, 'json': {}}, {'json': {}}])
+    ids = [f'T{i}' for i in range(7)]
+    results = list(put_in_batches(SpotifyClient(API), 'user.tracks', 'TOKEN', ids, batch_size=3, max_workers=3))
+    assert [batch for batch, _ in results] == [ids[0:3], ids[3:6], ids[6:]]
+    assert sorted(ok for _, ok in results) == [False, True, True]
+    assert sorted(request.json()['ids'][0] for request in put.request_history) == ['T0', 'T3', 'T6']
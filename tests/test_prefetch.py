@@ -0,0 +1,56 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from prefetch import Prefetcher
+
+def test_prefetch_warms_key_and_counts_hits():
+    prefetcher = Prefetcher()
+    warmed = []
+    assert prefetcher.schedule('alice', 'page-2', warmed.append, 2)
+    assert prefetcher.wait_idle(1)
+    assert warmed == [2]
+    assert prefetcher.claim('page-2')
+    assert not prefetcher.claim('page-3')
+    assert prefetcher.stats()['hit_rate'] == 0.5
+
+def test_newest_prefetch_supersedes_the_queued_one():
+    prefetcher = Prefetcher(max_workers=1, per_user=1)
+    ran = []
+    release = threading.Event()
+    prefetcher.schedule('bob', 'block', release.wait, 1)
+    prefetcher.schedule('alice', 'page-2', ran.append, 2)
+    # The user has moved on: the queued page-2 and page-3 never run
+    assert prefetcher.schedule('alice', 'page-3', ran.append, 3)
+    assert prefetcher.schedule('alice', 'page-4', ran.append, 4)
+    release.set()
+    assert prefetcher.wait_idle(1)
+    assert ran == [4]
+    assert prefetcher.stats()['dropped'] == 2
+
+def test_prefetch_is_capped_per_user_while_running():
+    prefetcher = Prefetcher(max_workers=2, per_user=1)
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def slow(page):
+        started.set()
+        release.wait(1)
+        ran.append(page)
+
+    assert prefetcher.schedule('alice', 'page-2', slow, 2)
+    assert started.wait(1)
+    # Running work can't be superseded, and the cap is reached
+    assert not prefetcher.schedule('alice', 'page-3', ran.append, 3)
+    assert prefetcher.schedule('bob', 'page-3', ran.append, 3)
+    release.set()
+    assert prefetcher.wait_idle(1)
+    assert sorted(ran) == [2, 3]
+    assert prefetcher.stats()['skipped'] == 1
+
+def test_prefetch_pauses_while_throttled():
+    prefetcher = Prefetcher(paused=lambda: True)
+    assert not prefetcher.schedule('alice', 'page-2', lambda: None)
+    assert prefetcher.stats()['skipped'] == 1
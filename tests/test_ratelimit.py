@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ratelimit import RateLimitScheduler
+from spotify_client import SpotifyClient
+
+API = {'user': {'tracks': 'https://api.spotify.com/v1/me/tracks'}}
+
+def test_bucket_queues_callers_past_burst(tmp_path):
+    scheduler = RateLimitScheduler(str(tmp_path / 'rl.db'), 'client', rate=50, burst=2)
+    assert scheduler.acquire() == 0
+    assert scheduler.acquire() == 0
+    assert scheduler.acquire() > 0
+    stats = scheduler.stats()
+    assert stats['acquired'] == 3
+    assert stats['queued'] == 1
+    assert stats['queued_seconds'] > 0
+
+def test_most_calls_skip_the_shared_write_lock(tmp_path, monkeypatch):
+    scheduler = RateLimitScheduler(str(tmp_path / 'rl.db'), 'client', rate=1, burst=8, lease=4)
+    writes = []
+    transaction = scheduler.transaction
+    monkeypatch.setattr(scheduler, 'transaction', lambda: writes.append(1) or transaction())
+    for _ in range(8):
+        assert scheduler.acquire() == 0
+    assert len(writes) == 2
+    # Out of tokens: a waiting caller only reads the bucket
+    assert scheduler.acquire(timeout=0.05) is None
+    assert len(writes) == 2
+    assert scheduler.stats()['acquired'] == 8
+
+def test_bucket_needs_a_key(tmp_path):
+    with pytest.raises(ValueError):
+        RateLimitScheduler(str(tmp_path / 'rl.db'), None)
+
+def test_state_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'rl.db')
+    first = RateLimitScheduler(path, 'client', rate=1, burst=1)
+    second = RateLimitScheduler(path, 'client', rate=1, burst=1)
+    assert first.acquire() == 0
+    assert second.acquire(timeout=0.1) is None
+
+def test_throttle_blocks_and_halves_concurrency(tmp_path):
+    scheduler = RateLimitScheduler(str(tmp_path / 'rl.db'), 'client', max_concurrency=8)
+    scheduler.throttled(0.2)
+    assert scheduler.is_throttled()
+    assert scheduler.concurrency() == 4
+    start = time.monotonic()
+    scheduler.acquire()
+    assert time.monotonic() - start >= 0.15
+
+def test_client_retries_429_honouring_retry_after(tmp_path, requests_mock):
+    scheduler = RateLimitScheduler(str(tmp_path / 'rl.db'), 'client')
+    client = SpotifyClient(API, scheduler=scheduler, backoff=0.01)
+    requests_mock.get('https://api.spotify.com/v1/me/tracks', [
+        {'status_code': 429, 'headers': {'Retry-After': '0'}},
+        {'status_code': 200, 'json': {'items': []}},
+    ])
+    resp = client.get('user.tracks', 'TOKEN')
+    assert resp.status_code == 200
+    stats = scheduler.stats()
+    assert (stats['throttled'], stats['retries']) == (1, 1)
+
+def test_client_gives_up_on_long_retry_after(requests_mock):
+    client = SpotifyClient(API, max_retry_after=5)
+    requests_mock.get('https://api.spotify.com/v1/me/tracks', status_code=429, headers={'Retry-After': '60'})
+    assert client.get('user.tracks', 'TOKEN').status_code == 429
+    assert requests_mock.call_count == 1
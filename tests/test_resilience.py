@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import resilience
+from resilience import CircuitBreaker
+
+def test_deadline_budget_never_extends_an_outer_one():
+    assert resilience.remaining() is None
+    outer = resilience.start_deadline(1)
+    try:
+        inner = resilience.start_deadline(60)
+        assert resilience.remaining() <= 1
+        resilience.end_deadline(inner)
+    finally:
+        resilience.end_deadline(outer)
+    assert resilience.remaining() is None
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.failure('playlists.get')
+    assert breaker.allow('playlists.get')
+    breaker.failure('playlists.get')
+    assert not breaker.allow('playlists.get')
+    assert breaker.allow('user.profile')
+    assert breaker.stats() == {'open': ['playlists.get'], 'rejected': 1}
+
+def test_breaker_lets_one_trial_through_after_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.failure('user.tracks')
+    time.sleep(0.02)
+    assert breaker.allow('user.tracks')
+    assert not breaker.allow('user.tracks')
+    breaker.success('user.tracks')
+    assert breaker.state('user.tracks') == resilience.CLOSED
+
+def test_breaker_trial_is_time_boxed():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.failure('user.tracks')
+    time.sleep(0.06)
+    assert breaker.allow('user.tracks')
+    assert not breaker.allow('user.tracks')
+    # The trial never reported back; after another reset_timeout a new one may go
+    time.sleep(0.06)
+    assert breaker.allow('user.tracks')
+    breaker.release('user.tracks')
+    assert breaker.allow('user.tracks')
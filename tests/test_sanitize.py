@@ -0,0 +1,46 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from sanitize import DescriptionSanitizer
+
+def test_only_web_links_survive_and_urls_are_linked():
+    sanitizer = DescriptionSanitizer()
+    html = sanitizer.sanitize(
+        'Curated by <a href="spotify:user:me">me</a> &amp; <b>friends</b><script>x()</script>. '
+        'Tour dates: https://example.com/tour <a href="javascript:alert(1)" onclick="x()">click</a>'
+    )
+    assert html == (
+        'Curated by <a>me</a> &amp; friendsx(). Tour dates: '
+        '<a href="https://example.com/tour" rel="nofollow noopener noreferrer" target="_blank">https://example.com/tour</a> '
+        '<a>click</a>'
+    )
+    assert sanitizer.sanitize(None) == '' and sanitizer.sanitize('') == ''
+
+def test_output_is_cached_by_content_and_bounded():
+    sanitizer = DescriptionSanitizer(max_entries=2)
+    first = sanitizer.sanitize_many(['one', None, 'two', 'one'])
+    assert first == ['one', '', 'two', 'one']
+    assert sanitizer.stats()['misses'] == 2
+    assert sanitizer.sanitize('two') == 'two'
+    assert sanitizer.stats()['hits'] == 1
+    sanitizer.sanitize('three')
+    assert sanitizer.stats() == {'entries': 2, 'hits': 1, 'misses': 3, 'evictions': 1}
+
+def test_each_thread_gets_its_own_cleaner():
+    sanitizer = DescriptionSanitizer()
+    cleaners = []
+    together = threading.Barrier(3)
+
+    def clean():
+        cleaners.append(sanitizer._cleaner())
+        assert sanitizer._cleaner() is cleaners[-1]
+        together.wait()
+
+    threads = [threading.Thread(target=clean) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(cleaner) for cleaner in cleaners}) == 3
@@ -0,0 +1,104 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models import Album, Playlist, Track
+from search_index import PlaylistIndex, PlaylistIndexCache, tokenize
+
+def make_tracks():
+    blue = Album('A1', 'https://i.scdn.co/image/a1', 'Kind of Blue')
+    return [
+        Track('T1', 'So What', ('Miles Davis',), blue, 'https://open.spotify.com/track/T1'),
+        Track('T2', 'Halo', ('Beyoncé',), Album('A2', None, 'I Am... Sasha Fierce')),
+        Track('T3', 'Blue in Green', ('Miles Davis', 'Bill Evans'), blue),
+        Track(None, 'Local file', ()),
+    ]
+
+def test_tokenize_folds_case_and_accents():
+    assert tokenize('Beyoncé – HALO (Remix)') == ['beyonce', 'halo', 'remix']
+    assert tokenize(None) == []
+
+def test_every_word_must_prefix_match_in_playlist_order():
+    index = PlaylistIndex(make_tracks())
+    assert index.search('') == [0, 1, 2, 3]
+    assert index.search('mil') == [0, 2]
+    assert index.search('blue mil') == [0, 2]
+    assert index.search('blue', fields=('name',)) == [2]
+    assert index.search('BEYONCE halo') == [1]
+    assert index.search('evans halo') == []
+    first, third = index.tracks([0, 2])
+    assert (first.id, first.name, first.artist_names, first.url) == ('T1', 'So What', 'Miles Davis', 'https://open.spotify.com/track/T1')
+    # Tracks of one album share a single Album record
+    assert first.album is third.album and first.album.name == 'Kind of Blue'
+    assert index.tracks([3])[0].album is None
+
+def test_cache_builds_each_snapshot_once_and_scopes_private_playlists():
+    cache = PlaylistIndexCache(ttl=60, max_entries=2)
+    builds = []
+
+    def load():
+        builds.append(1)
+        time.sleep(0.05)
+        return make_tracks()
+
+    private = Playlist('PL1', snapshot_id='S1', public=False)
+    threads = [threading.Thread(target=cache.index, args=('u1', private, load)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert len(cache.index('u1', private, load)) == 4
+    cache.index('u2', private, load)
+    assert len(builds) == 2
+    cache.index('u1', Playlist('PL1', snapshot_id='S2', public=False), load)
+    assert len(builds) == 3
+    assert cache.index('u1', Playlist('PL2', snapshot_id='S1'), lambda: None) is None
+    assert cache.stats()['entries'] == 2
+
+def test_ready_builds_in_the_background_and_remembers_failures():
+    cache = PlaylistIndexCache(ttl=60, max_entries=4, retry_after=60)
+    release = threading.Event()
+    builds = []
+
+    def load():
+        builds.append(1)
+        release.wait(5)
+        return make_tracks()
+
+    playlist = Playlist('PL1', snapshot_id='S1', public=True)
+    assert cache.ready('u1', playlist, load) == (None, 'building')
+    assert cache.ready('u2', playlist, load) == (None, 'building')
+    release.set()
+    deadline = time.monotonic() + 5
+    while cache.ready('u1', playlist, load)[1] == 'building' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    index, state = cache.ready('u2', playlist, load)
+    assert state == 'ready' and len(index) == 4 and len(builds) == 1
+
+    broken = Playlist('PL2', snapshot_id='S1', public=True)
+    assert cache.ready('u1', broken, lambda: None) == (None, 'building')
+    while cache.ready('u1', broken, lambda: None)[1] == 'building' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.ready('u1', broken, lambda: None) == (None, 'failed')
+
+def test_ready_never_builds_inline_without_a_snapshot():
+    cache = PlaylistIndexCache(ttl=60, max_entries=4, unversioned_ttl=60)
+    release = threading.Event()
+
+    def load():
+        release.wait(5)
+        return make_tracks()
+
+    playlist = Playlist('PL1', public=False)
+    assert cache.ready('u1', playlist, load) == (None, 'building')
+    assert cache.playlist('u1', 'PL1') is playlist
+    assert cache.playlist('u2', 'PL1') is None
+    release.set()
+    deadline = time.monotonic() + 5
+    while cache.ready('u1', playlist, load)[1] == 'building' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    index, state = cache.ready('u1', playlist, load)
+    assert state == 'ready' and len(index) == 4
@@ -0,0 +1,98 @@
+import datetime
+import os
+import sys
+import time
+
+from flask import Flask, session
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import sessions
+
+def make_app(tmp_path, **kwargs):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.permanent_session_lifetime = datetime.timedelta(hours=1)
+    store = sessions.SessionStore(str(tmp_path / 'sessions.db'))
+    app.session_interface = sessions.SQLiteSessionInterface(store, **kwargs)
+
+    @app.route('/set/<value>')
+    def set_value(value):
+        session['value'] = value
+        return ''
+
+    @app.route('/get')
+    def get_value():
+        return session.get('value', '-')
+
+    @app.route('/clear')
+    def clear():
+        session.clear()
+        return ''
+
+    @app.route('/login')
+    def login():
+        app.session_interface.regenerate(session)
+        return ''
+
+    return app, store
+
+def test_cookie_holds_only_the_session_id(tmp_path):
+    app, store = make_app(tmp_path)
+    client = app.test_client()
+    client.get('/set/hello')
+    sid = client.get_cookie('session').value
+    assert len(sid) == 43 and '.' not in sid
+    data, expires_at = store.load(sid)
+    assert 'hello' in data
+    assert 3500 < expires_at - time.time() <= 3600
+    assert client.get('/get').data == b'hello'
+    # Another process serving the same cookie sees the same session
+    other_app, _ = make_app(tmp_path)
+    other = other_app.test_client()
+    other.set_cookie('session', sid)
+    assert other.get('/get').data == b'hello'
+
+def test_unchanged_sessions_are_only_touched_after_the_interval(tmp_path):
+    app, store = make_app(tmp_path, touch_interval=300)
+    client = app.test_client()
+    client.get('/set/hello')
+    sid = client.get_cookie('session').value
+    _, first_expiry = store.load(sid)
+    client.get('/get')
+    assert store.load(sid)[1] == first_expiry
+    store.save(sid, store.load(sid)[0], first_expiry - 600)
+    client.get('/get')
+    assert store.load(sid)[1] > first_expiry - 1
+
+def test_expired_cleared_and_regenerated_sessions(tmp_path):
+    app, store = make_app(tmp_path)
+    client = app.test_client()
+    client.get('/set/hello')
+    sid = client.get_cookie('session').value
+    client.get('/login')
+    new_sid = client.get_cookie('session').value
+    assert new_sid != sid and store.load(sid) is None
+    assert client.get('/get').data == b'hello'
+
+    store.save(new_sid, store.load(new_sid)[0], time.time() - 1)
+    assert client.get('/get').data == b'-'
+
+    client.get('/set/again')
+    sid = client.get_cookie('session').value
+    client.get('/clear')
+    assert store.load(sid) is None
+    assert client.get_cookie('session') is None
+
+def test_user_values_are_shared_and_expire(tmp_path):
+    store = sessions.SessionStore(str(tmp_path / 'sessions.db'))
+    other = sessions.SessionStore(str(tmp_path / 'sessions.db'))
+    store.set_user_value('u1', 'profile', {'id': 'u1'}, ttl=60)
+    store.set_user_value('u1', 'stale', [1], ttl=-1)
+    assert other.get_user_value('u1', 'profile') == {'id': 'u1'}
+    assert other.get_user_value('u1', 'stale', 'missing') == 'missing'
+    store.set_user_value('u1', 'albums:0', [], ttl=60)
+    other.delete_user_values('u1', prefix='albums:')
+    assert store.get_user_value('u1', 'albums:0') is None
+    assert store.get_user_value('u1', 'profile') == {'id': 'u1'}
+    other.delete_user_values('u1')
+    assert store.get_user_value('u1', 'profile') is None
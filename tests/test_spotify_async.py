@@ -0,0 +1,56 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from async_views import _settle
+from spotify_async import AsyncSpotifyClient
+
+API = {
+    'user': {'tracks': 'https://api.spotify.com/v1/me/tracks'},
+    'playlists': {'get': 'https://api.spotify.com/v1/playlists/{playlist_id}'}
+}
+
+def make_client(handler, **kwargs):
+    return AsyncSpotifyClient(API, transport=httpx.MockTransport(handler), **kwargs)
+
+def test_requests_resolve_endpoints_and_auth_headers():
+    sent = []
+    def handler(request):
+        sent.append(request)
+        return httpx.Response(200, json={})
+    client = make_client(handler)
+    try:
+        asyncio.run(client.get('playlists.get', 'TOKEN', path={'playlist_id': 'PL1'}))
+        asyncio.run(client.put('user.tracks', 'TOKEN', json={'ids': ['T1']}))
+    finally:
+        client.close()
+    assert str(sent[0].url) == 'https://api.spotify.com/v1/playlists/PL1'
+    assert sent[1].headers['Authorization'] == 'Bearer TOKEN'
+    assert sent[1].headers['Content-Type'] == 'application/json'
+    assert client.stats()['playlists.get']['calls'] == 1
+
+def test_throttled_calls_are_retried():
+    statuses = iter([429, 200])
+    def handler(request):
+        return httpx.Response(next(statuses), headers={'Retry-After': '0'}, json={})
+    client = make_client(handler, backoff=0.01)
+    try:
+        resp = asyncio.run(client.get('user.tracks', 'TOKEN'))
+    finally:
+        client.close()
+    assert resp.status_code == 200
+    assert [call['status'] for call in client.recent_calls()] == [429, 200]
+
+def test_settle_degrades_failures_and_timeouts_to_none():
+    async def ok():
+        return 'ok'
+    async def boom():
+        raise RuntimeError('boom')
+    async def slow():
+        await asyncio.sleep(5)
+    assert asyncio.run(_settle([ok(), boom(), slow()], 0.05)) == ['ok', None, None]
@@ -0,0 +1,101 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+
+import pytest
+import requests
+
+import resilience
+from resilience import CircuitBreaker
+from spotify_client import SpotifyClient, SpotifyUnavailable
+
+API = {
+    'user': {'tracks': 'https://api.spotify.com/v1/me/tracks'},
+    'playlists': {'get': 'https://api.spotify.com/v1/playlists/{playlist_id}'}
+}
+
+def test_url_resolves_dotted_key():
+    client = SpotifyClient(API)
+    assert client.url('playlists.get', playlist_id='PL1') == 'https://api.spotify.com/v1/playlists/PL1'
+    assert client.url('user.tracks') == 'https://api.spotify.com/v1/me/tracks'
+
+def test_auth_headers_built_in_one_place(requests_mock):
+    client = SpotifyClient(API)
+    requests_mock.put('https://api.spotify.com/v1/me/tracks', status_code=200, json={})
+    client.put('user.tracks', 'TOKEN', json={'ids': ['T1']})
+    sent = requests_mock.last_request
+    assert sent.headers['Authorization'] == 'Bearer TOKEN'
+    assert sent.headers['Content-Type'] == 'application/json'
+
+def test_calls_are_timed_per_endpoint(requests_mock):
+    client = SpotifyClient(API, pool_size=2)
+    requests_mock.get('https://api.spotify.com/v1/playlists/PL1', json={}, status_code=200)
+    client.get('playlists.get', 'TOKEN', path={'playlist_id': 'PL1'})
+    client.get('playlists.get', 'TOKEN', path={'playlist_id': 'PL1'})
+    calls = client.recent_calls()
+    assert [call['endpoint'] for call in calls] == ['playlists.get', 'playlists.get']
+    assert all(call['status'] == 200 for call in calls)
+    assert client.stats()['playlists.get']['calls'] == 2
+
+def test_pool_size_is_configurable():
+    client = SpotifyClient(API, pool_size=4)
+    assert client.adapter._pool_maxsize == 4
+
+def test_timeout_is_capped_by_the_request_deadline(requests_mock):
+    client = SpotifyClient(API, timeout=10)
+    requests_mock.get('https://api.spotify.com/v1/me/tracks', json={}, status_code=200)
+    client.get('user.tracks', 'TOKEN')
+    assert requests_mock.last_request.timeout == (3.05, 10)
+    token = resilience.start_deadline(2)
+    try:
+        client.get('user.tracks', 'TOKEN')
+    finally:
+        resilience.end_deadline(token)
+    connect, read = requests_mock.last_request.timeout
+    assert read <= 2
+
+def test_open_circuit_fails_fast(requests_mock):
+    client = SpotifyClient(API, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    upstream = requests_mock.get('https://api.spotify.com/v1/me/tracks', exc=requests.ConnectTimeout)
+    for _ in range(2):
+        with pytest.raises(SpotifyUnavailable):
+            client.get('user.tracks', 'TOKEN')
+    with pytest.raises(SpotifyUnavailable, match='circuit open'):
+        client.get('user.tracks', 'TOKEN')
+    assert upstream.call_count == 2
+
+def test_half_open_trial_that_never_sends_frees_the_circuit(requests_mock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    client = SpotifyClient(API, breaker=breaker)
+    upstream = requests_mock.get('https://api.spotify.com/v1/me/tracks', json={}, status_code=200)
+    breaker.failure('user.tracks')
+    time.sleep(0.02)
+    token = resilience.start_deadline(0)
+    try:
+        with pytest.raises(SpotifyUnavailable, match='deadline exceeded'):
+            client.get('user.tracks', 'TOKEN')
+    finally:
+        resilience.end_deadline(token)
+    assert breaker.state('user.tracks') == resilience.HALF_OPEN
+    assert client.get('user.tracks', 'TOKEN').status_code == 200
+    assert breaker.state('user.tracks') == resilience.CLOSED
+    assert upstream.call_count == 1
+
+def test_slow_get_is_hedged(monkeypatch):
+    client = SpotifyClient(API, hedge_after=0.05)
+    calls = []
+    def send(method, endpoint, url, headers, kwargs):
+        calls.append(endpoint)
+        resp = requests.Response()
+        resp.status_code = 200
+        if len(calls) == 1:
+            time.sleep(0.5)
+            resp.reason = 'slow'
+        else:
+            resp.reason = 'fast'
+        return resp
+    monkeypatch.setattr(client, '_send', send)
+    assert client.get('user.tracks', 'TOKEN').reason == 'fast'
+    assert client.hedged == 1
@@ -0,0 +1,87 @@
+import os
+import sys
+import threading
+import time
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import tokens
+from spotify_client import SpotifyClient
+
+API = {
+    'auth': {'token': 'https://accounts.spotify.com/api/token'},
+    'user': {'profile': 'https://api.spotify.com/v1/me'},
+}
+TOKEN_URL = 'https://accounts.spotify.com/api/token'
+
+def make_manager(tmp_path, client=None, **kwargs):
+    client = client or SpotifyClient(API)
+    store = tokens.TokenStore(str(tmp_path / 'tokens.db'))
+    return tokens.TokenManager(store, lambda: client, 'id', 'secret', **kwargs)
+
+def test_refreshes_ahead_of_expiry_and_keeps_the_refresh_token(tmp_path, requests_mock):
+    post = requests_mock.post(TOKEN_URL, json={'access_token': 'NEW', 'expires_in': 3600})
+    manager = make_manager(tmp_path, refresh_margin=300)
+    fresh_id = manager.issue({'access_token': 'FRESH', 'refresh_token': 'R1', 'expires_in': 3600})
+    assert manager.current(fresh_id).access_token == 'FRESH'
+    assert not post.called
+
+    grant_id = manager.issue({'access_token': 'OLD', 'refresh_token': 'R1', 'expires_in': 60})
+    grant = manager.current(grant_id)
+    assert grant.access_token == 'NEW'
+    assert grant.expires_at > time.time() + 3000
+    assert grant.refresh_token == 'R1'
+    assert parse_qs(post.last_request.text) == {
+        'grant_type': ['refresh_token'], 'refresh_token': ['R1'], 'client_id': ['id'], 'client_secret': ['secret']
+    }
+    # Calls still holding the old token map to the new one without another refresh
+    assert manager.refresh_stale('OLD') == 'NEW'
+    assert post.call_count == 1
+
+def test_concurrent_refreshes_across_workers_are_coalesced(tmp_path, requests_mock):
+    def slow_token(request, context):
+        time.sleep(0.2)
+        return {'access_token': 'NEW', 'expires_in': 3600}
+
+    post = requests_mock.post(TOKEN_URL, json=slow_token)
+    # Two managers on one store stand in for two gunicorn workers
+    workers = [make_manager(tmp_path), make_manager(tmp_path)]
+    grant_id = workers[0].issue({'access_token': 'OLD', 'refresh_token': 'R1', 'expires_in': 0})
+    results = []
+    threads = [
+        threading.Thread(target=lambda manager=manager: results.append(manager.refresh_stale('OLD')))
+        for manager in workers for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['NEW'] * 6
+    assert post.call_count == 1
+    assert workers[1].store.get(grant_id).refreshing_until == 0
+
+def test_rejected_refresh_token_drops_the_grant(tmp_path, requests_mock):
+    requests_mock.post(TOKEN_URL, status_code=400, json={'error': 'invalid_grant'})
+    manager = make_manager(tmp_path)
+    grant_id = manager.issue({'access_token': 'OLD', 'refresh_token': 'R1', 'expires_in': 0})
+    assert manager.current(grant_id) is None
+    assert manager.store.get(grant_id) is None
+    assert manager.refresh_stale('OLD') is None
+
+def test_client_retries_a_401_once_with_the_refreshed_token(tmp_path, requests_mock):
+    requests_mock.post(TOKEN_URL, json={'access_token': 'NEW', 'expires_in': 3600})
+    def profile_for(request, context):
+        context.status_code = 200 if request.headers['Authorization'] == 'Bearer NEW' else 401
+        return {}
+
+    profile = requests_mock.get(API['user']['profile'], json=profile_for)
+    holder = {}
+    client = SpotifyClient(API, token_refresher=lambda token: holder['manager'].refresh_stale(token))
+    manager = holder['manager'] = make_manager(tmp_path, client=client)
+    manager.issue({'access_token': 'OLD', 'refresh_token': 'R1', 'expires_in': 3600})
+
+    assert client.get('user.profile', 'OLD').status_code == 200
+    assert [r.headers['Authorization'] for r in profile.request_history] == ['Bearer OLD', 'Bearer NEW']
+    # Unknown tokens get their 401 back after a single call
+    assert client.get('user.profile', 'UNKNOWN').status_code == 401
+    assert profile.call_count == 3
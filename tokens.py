@@ -0,0 +1,225 @@
+import logging
+import secrets
+import time
+
+from cache import SingleFlight
+from sqlite_store import SQLiteStore
+from spotify_client import SpotifyUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+class Grant:
+    """One login's tokens as stored in the token table."""
+    __slots__ = ('id', 'access_token', 'refresh_token', 'expires_at', 'previous_token', 'refreshing_until', 'updated_at')
+
+    def __init__(self, row):
+        for key in self.__slots__:
+            setattr(self, key, row[key])
+
+    def expires_within(self, seconds):
+        return self.expires_at - time.time() <= seconds
+
+
+class TokenStore(SQLiteStore):
+    """
+    Spotify tokens for each login, shared by all worker processes. The
+    session cookie only carries the grant ID and the current access token;
+    the refresh token never leaves the server. The access token a refresh
+    replaced is kept as `previous_token`, so calls still holding it can
+    find the new one.
+    """
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS tokens (
+            id TEXT PRIMARY KEY,
+            access_token TEXT NOT NULL,
+            refresh_token TEXT,
+            expires_at REAL NOT NULL,
+            previous_token TEXT,
+            refreshing_until REAL NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS tokens_access_token ON tokens (access_token)',
+        'CREATE INDEX IF NOT EXISTS tokens_previous_token ON tokens (previous_token)',
+        'CREATE INDEX IF NOT EXISTS tokens_updated_at ON tokens (updated_at)',
+    )
+
+    def __init__(self, path, keep_for=30 * 86400):
+        super().__init__(path)
+        self.keep_for = keep_for
+
+    def create(self, access_token, refresh_token, expires_at):
+        grant_id = secrets.token_urlsafe(16)
+        now = time.time()
+        with self.transaction() as conn:
+            # Logins nobody has used for `keep_for` seconds
+            conn.execute('DELETE FROM tokens WHERE updated_at < ?', (now - self.keep_for,))
+            conn.execute(
+                'INSERT INTO tokens (id, access_token, refresh_token, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (grant_id, access_token, refresh_token, expires_at, now)
+            )
+        return grant_id
+
+    def get(self, grant_id):
+        row = self.connection().execute('SELECT * FROM tokens WHERE id = ?', (grant_id,)).fetchone()
+        return Grant(row) if row else None
+
+    def find(self, access_token):
+        """The grant whose current or previous access token is `access_token`."""
+        row = self.connection().execute(
+            'SELECT * FROM tokens WHERE access_token = ? OR previous_token = ? LIMIT 1', (access_token, access_token)
+        ).fetchone()
+        return Grant(row) if row else None
+
+    def claim(self, grant_id, lease):
+        """Take the right to refresh a grant for `lease` seconds; False if another process holds it."""
+        now = time.time()
+        cursor = self.connection().execute(
+            'UPDATE tokens SET refreshing_until = ? WHERE id = ? AND refreshing_until < ?',
+            (now + lease, grant_id, now)
+        )
+        return cursor.rowcount == 1
+
+    def refreshed(self, grant_id, access_token, refresh_token, expires_at):
+        """Store a refresh's result and release the claim. A null refresh token keeps the old one."""
+        self.connection().execute(
+            """
+            UPDATE tokens SET previous_token = access_token, access_token = ?,
+                refresh_token = COALESCE(?, refresh_token), expires_at = ?, refreshing_until = 0, updated_at = ?
+            WHERE id = ?
+            """,
+            (access_token, refresh_token, expires_at, time.time(), grant_id)
+        )
+
+    def release(self, grant_id):
+        self.connection().execute('UPDATE tokens SET refreshing_until = 0 WHERE id = ?', (grant_id,))
+
+    def delete(self, grant_id):
+        self.connection().execute('DELETE FROM tokens WHERE id = ?', (grant_id,))
+
+
+class TokenManager:
+    """
+    Keeps each login's access token fresh using its refresh token.
+
+    `current()` hands out a grant, refreshing its access token first when
+    it expires within `refresh_margin` seconds; `refresh_stale()` swaps a
+    token Spotify rejected with 401 for a fresh one. Refreshes of the same
+    grant are coalesced: within a process through SingleFlight, and across
+    worker processes by a lease in the shared store, whose losers wait up
+    to `wait` seconds for the winner's token instead of refreshing again.
+    Tokens are requested through `get_client()`'s 'auth.token' endpoint.
+    """
+
+    def __init__(self, store, get_client, client_id, client_secret, refresh_margin=300, lease=10, wait=5, poll=0.05):
+        self.store = store
+        self.get_client = get_client
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self.lease = lease
+        self.wait = wait
+        self.poll = poll
+        self._flight = SingleFlight()
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def issue(self, token_response):
+        """Store the tokens from an authorization_code exchange; returns the grant ID."""
+        return self.store.create(
+            token_response['access_token'],
+            token_response.get('refresh_token'),
+            time.time() + token_response.get('expires_in', 3600)
+        )
+
+    def current(self, grant_id):
+        """
+        The grant with a usable access token, refreshed ahead of expiry.
+        Returns None when the grant is gone or its token has expired and
+        couldn't be refreshed, so the user has to log in again.
+        """
+        grant = self.store.get(grant_id)
+        if grant is None or not grant.expires_within(self.refresh_margin):
+            return grant
+        fresh = self._refresh(grant.id, grant.access_token)
+        if fresh is None and not grant.expires_within(0):
+            # Couldn't refresh early; the old token still has a little time
+            return grant
+        return fresh
+
+    def refresh_stale(self, stale_token):
+        """
+        A replacement for an access token Spotify answered 401 to, or None.
+        A token that another caller already replaced maps straight to its
+        successor without another refresh.
+        """
+        grant = self.store.find(stale_token)
+        if grant is not None and grant.access_token == stale_token:
+            grant = self._refresh(grant.id, stale_token)
+        return grant.access_token if grant is not None else None
+
+    def revoke(self, grant_id):
+        self.store.delete(grant_id)
+
+    def _refresh(self, grant_id, stale_token):
+        """The grant with its `stale_token` replaced, or None if that failed."""
+        grant, _ = self._flight.do(grant_id, lambda: self._refresh_once(grant_id, stale_token))
+        return grant
+
+    def _refresh_once(self, grant_id, stale_token):
+        deadline = time.monotonic() + self.wait
+        while True:
+            grant = self.store.get(grant_id)
+            if grant is None:
+                return None
+            if grant.access_token != stale_token:
+                # Another process refreshed it while we were deciding
+                return grant
+            if self.store.claim(grant_id, self.lease):
+                return self._request_token(grant)
+            if time.monotonic() >= deadline:
+                logger.warning("Timed out waiting for another worker to refresh a token")
+                return None
+            time.sleep(self.poll)
+
+    def _request_token(self, grant):
+        if not grant.refresh_token:
+            self.store.release(grant.id)
+            return None
+        payload = {
+            'grant_type': 'refresh_token',
+            'refresh_token': grant.refresh_token,
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+        }
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        try:
+            resp = self.get_client().post('auth.token', data=payload, headers=headers)
+        except SpotifyUnavailable as exc:
+            self.store.release(grant.id)
+            self.refresh_failures += 1
+            logger.warning("Token refresh failed: %s", exc)
+            return None
+        if resp.status_code != 200:
+            self.refresh_failures += 1
+            if resp.status_code in (400, 401):
+                # invalid_grant: the refresh token was revoked; the user must log in again
+                logger.info("Refresh token rejected (%s); dropping the grant", resp.status_code)
+                self.store.delete(grant.id)
+            else:
+                self.store.release(grant.id)
+                logger.warning("Token refresh failed with status %s", resp.status_code)
+            return None
+        try:
+            data = resp.json()
+            access_token = data['access_token']
+        except (ValueError, KeyError):
+            self.store.release(grant.id)
+            self.refresh_failures += 1
+            logger.warning("Token refresh returned no access token")
+            return None
+        self.store.refreshed(grant.id, access_token, data.get('refresh_token'), time.time() + data.get('expires_in', 3600))
+        self.refreshes += 1
+        return self.store.get(grant.id)